@@ -0,0 +1,249 @@
+''' Offline analysis of the link graph recorded with LINKGRAPH = true (see
+crawler/graph.py).
+
+Maps the chunk columns into NumPy arrays, renumbers the node ids densely
+with np.unique, and computes over the deduplicated edges, all vectorized:
+
+    PageRank     power iteration on a SciPy sparse matrix
+    in-degree    and out-degree of every page, the top ones printed
+    orphans      downloaded pages no recorded link points to
+    fan-out      per host: pages downloaded, links out, links to other
+                 hosts and how many hosts they point to
+
+Only the urls that are printed are decoded. Several graph directories (one
+per shard) can be given; node ids are the same in all of them.
+
+    python -m analysis.linkgraph frontier.shelve.graph --top 20
+    python -m analysis.linkgraph frontier.shelve.shard*.graph \\
+        --orphans orphans.txt --parquet graph_parquet
+
+--parquet also writes the edges and the nodes with their metrics as Parquet
+files, if pyarrow is installed.
+'''
+import os
+import sys
+
+from argparse import ArgumentParser
+
+import numpy as np
+import scipy.sparse
+
+from crawler.graph import HEADER, MAGIC
+
+
+class LinkGraphData(object):
+    ''' The columns of every chunk of some graph directories, concatenated.
+
+    src, dst, visits, node_ids:  uint64 node ids
+    node_hosts:                  index of each node's host in hosts
+    url_offsets, urls:           url of node i is
+                                 urls[url_offsets[i]:url_offsets[i + 1]] '''
+
+    def __init__(self, paths):
+        self.hosts = list()
+        host_index = dict()
+        columns = {name: list() for name in (
+            "src", "dst", "visits", "node_ids", "node_hosts", "lengths",
+            "urls")}
+        self.chunks = 0
+        for path in paths:
+            with open(os.path.join(path, "hosts.txt"), encoding="utf-8") as hosts_file:
+                local_hosts = np.array([
+                    host_index.setdefault(host, len(host_index))
+                    for host in hosts_file.read().splitlines()], dtype=np.int64)
+            for name in sorted(os.listdir(path)):
+                if name.startswith("chunk-") and name.endswith(".bin"):
+                    self._read_chunk(
+                        os.path.join(path, name), local_hosts, columns)
+        self.hosts = sorted(host_index, key=host_index.get)
+        for name, values in columns.items():
+            dtype = np.int64 if name == "node_hosts" else (
+                np.uint8 if name == "urls" else np.uint64)
+            setattr(self, name, np.concatenate(values) if values else np.zeros(0, dtype))
+        self.url_offsets = np.zeros(len(self.lengths) + 1, dtype=np.int64)
+        np.cumsum(self.lengths, out=self.url_offsets[1:])
+
+    def _read_chunk(self, path, local_hosts, columns):
+        data = np.memmap(path, dtype=np.uint8, mode="r")
+        magic, edges, visits, nodes = HEADER.unpack(bytes(data[:HEADER.size]))
+        if magic != MAGIC:
+            print(f"Skipping {path}: not a link graph chunk.", file=sys.stderr)
+            return
+        offset = HEADER.size
+        for name, count, dtype in (
+                ("src", edges, "<u8"), ("dst", edges, "<u8"),
+                ("visits", visits, "<u8"), ("node_ids", nodes, "<u8"),
+                ("node_hosts", nodes, "<u4"), ("lengths", nodes, "<u4")):
+            column = np.frombuffer(data, dtype=dtype, count=count, offset=offset)
+            offset += column.nbytes
+            if name == "node_hosts":
+                column = local_hosts[column]
+            columns[name].append(column.astype(
+                np.int64 if name == "node_hosts" else np.uint64))
+        columns["urls"].append(np.asarray(data[offset:]))
+        self.chunks += 1
+
+    def url(self, node):
+        ''' Url of row node of the node table. '''
+        start, end = self.url_offsets[node], self.url_offsets[node + 1]
+        return self.urls[start:end].tobytes().decode("utf-8")
+
+
+def pagerank(src, dst, n, damping=0.85, iterations=100, tol=1e-10):
+    ''' PageRank of the n nodes of the graph of edges src -> dst (dense
+    indices). Rank of pages without out-links is spread over every page.
+    Returns the ranks and the number of iterations run. '''
+    out_degree = np.bincount(src, minlength=n).astype(np.float64)
+    # Column stochastic: M[d, s] = 1 / out_degree[s].
+    matrix = scipy.sparse.csr_matrix(
+        (1.0 / out_degree[src], (dst, src)), shape=(n, n))
+    dangling = out_degree == 0
+    rank = np.full(n, 1.0 / n)
+    for iteration in range(1, iterations + 1):
+        new_rank = damping * (matrix @ rank + rank[dangling].sum() / n)
+        new_rank += (1.0 - damping) / n
+        delta = np.abs(new_rank - rank).sum()
+        rank = new_rank
+        if delta < tol:
+            break
+    return rank, iteration
+
+
+class LinkGraphStats(object):
+    ''' Node metrics of a LinkGraphData, indexed by dense node index. '''
+
+    def __init__(self, data, damping, iterations):
+        self.data = data
+        self.ids = np.unique(np.concatenate(
+            (data.src, data.dst, data.visits, data.node_ids)))
+        n = self.n = len(self.ids)
+        src = np.searchsorted(self.ids, data.src)
+        dst = np.searchsorted(self.ids, data.dst)
+        # Links found again after a resume or recrawl, and links of a page to
+        # itself, are counted once and not at all.
+        keys = np.unique(src * n + dst)
+        src, dst = keys // n, keys % n
+        keep = src != dst
+        self.src, self.dst = src[keep], dst[keep]
+        self.in_degree = np.bincount(self.dst, minlength=n)
+        self.out_degree = np.bincount(self.src, minlength=n)
+        self.visited = np.zeros(n, dtype=bool)
+        self.visited[np.searchsorted(self.ids, data.visits)] = True
+        # Row of each node in the node table, and its host.
+        rows = np.searchsorted(self.ids, data.node_ids)
+        self.node_row = np.full(n, -1, dtype=np.int64)
+        self.node_row[rows] = np.arange(len(rows))
+        self.host = np.full(n, -1, dtype=np.int64)
+        self.host[rows] = data.node_hosts
+        self.rank, self.iterations = pagerank(
+            self.src, self.dst, n, damping, iterations)
+
+    def url(self, node):
+        row = self.node_row[node]
+        return self.data.url(row) if row >= 0 else f"<node {self.ids[node]:016x}>"
+
+    def top(self, values, k):
+        ''' Dense indices of the k largest values, largest first. '''
+        k = min(k, len(values))
+        if not k:
+            return np.zeros(0, dtype=np.int64)
+        top = np.argpartition(-values, k - 1)[:k]
+        return top[np.argsort(-values[top], kind="stable")]
+
+    def orphans(self):
+        return np.flatnonzero(self.visited & (self.in_degree == 0))
+
+    def host_fan_out(self):
+        ''' Per host: (pages downloaded, links out, links to other hosts,
+        hosts linked to), as arrays indexed by host. '''
+        hosts = len(self.data.hosts)
+        src_host, dst_host = self.host[self.src], self.host[self.dst]
+        known = (src_host >= 0) & (dst_host >= 0)
+        src_host, dst_host = src_host[known], dst_host[known]
+        cross = src_host != dst_host
+        pairs = np.unique(src_host[cross] * hosts + dst_host[cross])
+        visited_hosts = self.host[self.visited]
+        return (
+            np.bincount(visited_hosts[visited_hosts >= 0], minlength=hosts),
+            np.bincount(src_host, minlength=hosts),
+            np.bincount(src_host[cross], minlength=hosts),
+            np.bincount(pairs // hosts, minlength=hosts))
+
+    def write_parquet(self, path):
+        import pyarrow as pa
+        import pyarrow.parquet as pq
+        os.makedirs(path, exist_ok=True)
+        data = self.data
+        urls = pa.LargeStringArray.from_buffers(
+            len(data.lengths), pa.py_buffer(data.url_offsets),
+            pa.py_buffer(data.urls))
+        rows = pa.array(self.node_row, mask=self.node_row < 0)
+        hosts = pa.array(data.hosts, type=pa.string())
+        host = pa.array(self.host, mask=self.host < 0)
+        pq.write_table(pa.table({
+            "id": self.ids,
+            "url": urls.take(rows),
+            "host": hosts.take(host),
+            "visited": self.visited,
+            "in_degree": self.in_degree,
+            "out_degree": self.out_degree,
+            "pagerank": self.rank,
+        }), os.path.join(path, "nodes.parquet"))
+        pq.write_table(pa.table({
+            "src": self.ids[self.src], "dst": self.ids[self.dst],
+        }), os.path.join(path, "edges.parquet"))
+
+
+def main(paths, top, damping, iterations, orphans_file, parquet_dir):
+    data = LinkGraphData(paths)
+    stats = LinkGraphStats(data, damping, iterations)
+    print(
+        f"{stats.n} nodes, {len(stats.src)} links ({len(data.src)} recorded), "
+        f"{int(stats.visited.sum())} pages downloaded, {len(data.hosts)} "
+        f"hosts, {data.chunks} chunks")
+    print(f"\nTop {top} by PageRank ({stats.iterations} iterations):")
+    for node in stats.top(stats.rank, top):
+        print(f"{stats.rank[node]:12.3e}  {stats.url(node)}")
+    print(f"\nTop {top} by in-degree:")
+    for node in stats.top(stats.in_degree, top):
+        print(f"{stats.in_degree[node]:12d}  {stats.url(node)}")
+    print(f"\nTop {top} hubs by out-degree:")
+    for node in stats.top(stats.out_degree, top):
+        print(f"{stats.out_degree[node]:12d}  {stats.url(node)}")
+    orphans = stats.orphans()
+    print(f"\n{len(orphans)} downloaded pages without recorded in-links:")
+    for node in orphans[:top]:
+        print(f"{'':12}  {stats.url(node)}")
+    if orphans_file:
+        with open(orphans_file, "w", encoding="utf-8") as out:
+            for node in orphans:
+                out.write(f"{stats.url(node)}\n")
+        print(f"All of them written to {orphans_file}.")
+    pages, links, cross, linked = stats.host_fan_out()
+    print(f"\nTop {top} hosts by links out:")
+    print(f"{'pages':>8} {'links':>10} {'per page':>9} {'off host':>10} {'hosts':>6}  host")
+    for host in stats.top(links, top):
+        per_page = links[host] / pages[host] if pages[host] else 0.0
+        print(
+            f"{pages[host]:8d} {links[host]:10d} {per_page:9.1f} "
+            f"{cross[host]:10d} {linked[host]:6d}  {data.hosts[host]}")
+    if parquet_dir:
+        try:
+            stats.write_parquet(parquet_dir)
+            print(f"\nWrote nodes.parquet and edges.parquet to {parquet_dir}.")
+        except ImportError:
+            print("\npyarrow is not installed, no Parquet files written.")
+
+
+if __name__ == "__main__":
+    parser = ArgumentParser()
+    parser.add_argument("paths", nargs="+", help="graph directories (SAVE.graph)")
+    parser.add_argument("--top", type=int, default=20)
+    parser.add_argument("--damping", type=float, default=0.85)
+    parser.add_argument("--iterations", type=int, default=100)
+    parser.add_argument("--orphans", default=None, help="write every orphan url here")
+    parser.add_argument("--parquet", default=None, help="directory for Parquet files")
+    args = parser.parse_args()
+    main(
+        args.paths, args.top, args.damping, args.iterations, args.orphans,
+        args.parquet)
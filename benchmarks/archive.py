@@ -0,0 +1,98 @@
+''' Measures the page archive of crawler/archive.py.
+
+Renders --pages pages of the mock site (benchmarks/mock_cache_server.py) as
+the Responses download returns, archives them with each compression, then
+reads every page back in random order the way a --replay crawl does, and
+checks the content and headers survived. Reports per compression:
+
+    write     pages/s and MB/s of page content archived (formatting and
+              compressing the records, writing segments and index)
+    ratio     record bytes / compressed bytes on disk
+    replay    pages/s read back by url (index lookup, seek, decompress,
+              parse), the rate at which a replay crawl is fed
+
+    python -m benchmarks.archive --pages 20000
+'''
+import os
+import time
+import pickle
+import random
+import logging
+import tempfile
+
+from argparse import ArgumentParser
+
+from benchmarks.mock_cache_server import (
+    CacheHandler, add_site_arguments, site_from_args, render)
+from crawler.archive import ArchiveWriter, ArchiveReader
+from utils import get_logger
+from utils.response import Response
+
+
+def make_responses(site, count):
+    responses = list()
+    for i in range(min(count, site.pages)):
+        url = site.page_url(i)
+        body = render(url, *site.page(i))
+        raw = CacheHandler._response(url, body, f'"{i:016x}"')
+        responses.append((url, Response({
+            "url": url, "status": 200, "response": pickle.dumps(raw)})))
+    return responses
+
+
+def bench(compression, responses, segment_size, logger):
+    with tempfile.TemporaryDirectory() as path:
+        # Unpickled up front, as the worker has by the time it archives.
+        content = sum(len(resp.raw_response.content) for _, resp in responses)
+        writer = ArchiveWriter(path, segment_size, compression, logger)
+        if writer.compression != compression:
+            # zstandard is not installed.
+            writer.close()
+            return None
+        start = time.perf_counter()
+        for url, resp in responses:
+            writer.add(url, resp)
+        writer.close()
+        written = time.perf_counter() - start
+        ratio = writer.bytes_in / writer.bytes_out
+        on_disk = sum(
+            os.path.getsize(os.path.join(path, name)) for name in os.listdir(path))
+
+        reader = ArchiveReader(path, logger)
+        order = list(responses)
+        random.Random(0).shuffle(order)
+        start = time.perf_counter()
+        replayed = [(resp, reader.download(url)) for url, resp in order]
+        read = time.perf_counter() - start
+        for original, copy in replayed:
+            assert copy.status == original.status and copy.url == original.url
+            assert copy.raw_response.content == original.raw_response.content
+            assert copy.raw_response.headers["etag"] == original.raw_response.headers["etag"]
+        assert reader.download("https://nowhere.example/").raw_response is None
+    count = len(responses)
+    return count / written, content / written / 2 ** 20, ratio, on_disk, count / read
+
+
+def main(args):
+    logging.disable(logging.INFO)
+    logger = get_logger("ARCHIVE")
+    responses = make_responses(site_from_args(args), args.pages)
+    print(f"{len(responses)} pages")
+    print(f"{'':>6} {'write p/s':>10} {'MB/s':>7} {'ratio':>6} {'on disk':>10} {'replay p/s':>11}")
+    for compression in ("gzip", "zstd"):
+        result = bench(compression, responses, args.segment, logger)
+        if result is None:
+            print(f"{compression:>6} zstandard is not installed")
+            continue
+        per_sec, mb_per_sec, ratio, on_disk, replay = result
+        print(
+            f"{compression:>6} {per_sec:10.0f} {mb_per_sec:7.1f} {ratio:6.1f} "
+            f"{on_disk / 2 ** 20:8.1f}MB {replay:11.0f}")
+
+
+if __name__ == "__main__":
+    parser = ArgumentParser()
+    parser.add_argument("--segment", type=int, default=64 * 2 ** 20)
+    add_site_arguments(parser)
+    args = parser.parse_args()
+    main(args)
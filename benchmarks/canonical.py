@@ -0,0 +1,99 @@
+''' Dedup-rate benchmark of utils.canonical against the url normalization it
+replaced (scraper's scheme/port/fragment handling plus utils.normalize).
+
+The link graph is built from report_files/crawled_urls.txt: every crawled
+page is linked from --fanin other pages, and each link is written the way
+links show up in real pages (fragments, default ports, tracking params,
+reordered queries, dot segments, trailing slashes, uppercase hosts). Both
+normalizers map the links to frontier keys (get_urlhash); every distinct key
+is a fetch. Also reports urls/sec with and without the LRU memo.
+
+    python -m benchmarks.canonical --fanin 8
+'''
+import time
+import random
+
+from argparse import ArgumentParser
+from urllib.parse import urlparse, urlunparse
+
+from utils import get_urlhash
+from utils.canonical import canonicalize
+
+LINK_FORMS = [
+    lambda p: p.geturl(),
+    lambda p: p._replace(fragment="content").geturl(),
+    lambda p: p._replace(path=p.path + "/").geturl(),
+    lambda p: p._replace(
+        netloc=p.netloc + (":443" if p.scheme == "https" else ":80")).geturl(),
+    lambda p: p._replace(netloc=p.netloc.upper()).geturl(),
+    lambda p: p._replace(
+        query="&".join(filter(None, [p.query, "utm_source=newsletter"]))).geturl(),
+    lambda p: p._replace(query="&".join(reversed(p.query.split("&")))).geturl(),
+    lambda p: p._replace(path="/./" + p.path.lstrip("/")).geturl(),
+    lambda p: p._replace(path="/x/.." + p.path).geturl(),
+]
+
+
+def legacy_normalize(url):
+    ''' extract_next_links and utils.normalize before utils/canonical.py. '''
+    parsed = urlparse(url)._replace(fragment = "")
+    scheme = parsed.scheme.lower()
+    netloc = parsed.netloc.replace(":80", "").replace(":443", "")
+    url = urlunparse(parsed._replace(scheme=scheme, netloc=netloc))
+    if url.endswith("/"):
+        return url.rstrip("/")
+    return url
+
+
+def load_pages(path):
+    with open(path, encoding="utf-8") as crawled:
+        return [
+            canonicalize(line.rsplit(": ", 1)[0])
+            for line in crawled if line.strip()]
+
+
+def build_links(pages, fanin, seed=0):
+    rng = random.Random(seed)
+    links = list()
+    for page in pages:
+        parsed = urlparse(page)
+        for _ in range(fanin):
+            links.append(rng.choice(LINK_FORMS)(parsed))
+    rng.shuffle(links)
+    return links
+
+
+def count_fetches(normalize, links):
+    start = time.perf_counter()
+    keys = {get_urlhash(normalize(link)) for link in links}
+    return len(keys), time.perf_counter() - start
+
+
+def main(path, fanin):
+    pages = load_pages(path)
+    links = build_links(pages, fanin)
+    distinct = len({get_urlhash(page) for page in pages})
+    print(f"{distinct} distinct pages, {len(links)} links")
+    legacy_fetches, legacy_time = count_fetches(legacy_normalize, links)
+    uncached_fetches, uncached_time = count_fetches(canonicalize.__wrapped__, links)
+    canonicalize.cache_clear()
+    fetches, cached_time = count_fetches(canonicalize, links)
+    print(f"   legacy: {legacy_fetches:8d} fetches "
+          f"({legacy_fetches - distinct} repeated), "
+          f"{len(links) / legacy_time:10.0f} urls/sec")
+    print(f"canonical: {fetches:8d} fetches "
+          f"({fetches - distinct} repeated), "
+          f"{len(links) / uncached_time:10.0f} urls/sec, "
+          f"{len(links) / cached_time:10.0f} urls/sec memoized")
+    assert uncached_fetches == fetches
+    saved = legacy_fetches - fetches
+    print(f"    saved: {saved} fetches ({saved / legacy_fetches:.1%})")
+    print(f"     memo: {canonicalize.cache_info()}")
+
+
+if __name__ == "__main__":
+    parser = ArgumentParser()
+    parser.add_argument("--corpus", default="report_files/crawled_urls.txt")
+    parser.add_argument("--fanin", type=int, default=8)
+    args = parser.parse_args()
+    main(args.corpus, args.fanin)
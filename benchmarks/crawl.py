@@ -0,0 +1,253 @@
+''' End-to-end crawl benchmark against benchmarks/mock_cache_server.py.
+
+Starts the mock cache server once, then runs launch.py --restart in a fresh
+directory for every combination of the --grid settings, with config.ini as
+the base config and HOST/PORT/SEEDURL pointed at the mock. Reports for each
+run:
+
+    pages/sec   content and trap pages served / wall time of launch.py
+    p50, p99    per-page latency: time between two requests on the same
+                keep-alive connection, one full fetch-parse-update cycle
+    peak RSS    ru_maxrss of the launch.py process (parser processes of
+                PARSERPROCESSES are not included)
+
+    python -m benchmarks.crawl --pages 2000 --grid THREADCOUNT=1,4,8 \\
+        --grid STORAGE=shelve,log --latency 0.01
+
+With --check, every run is checked instead of timed, on a site without
+duplicates or traps: the crawl must end by itself within --timeout,
+download every content page reachable from the seeds and no other, each
+once, and report each of them once. With --interrupt, every crawl is first
+stopped after that many seconds like Ctrl+C would, then resumed from its
+save files, which may download a page twice. Exits with status 1 if a run
+failed:
+
+    python -m benchmarks.crawl --check --pages 1000 --grid SHARDS=1,3
+    python -m benchmarks.crawl --check --interrupt 5 --pages 1000 \\
+        --grid SHARDS=1,3
+'''
+import os
+import sys
+import time
+import signal
+import tempfile
+import subprocess
+
+from argparse import ArgumentParser
+from configparser import ConfigParser
+from itertools import product
+
+from benchmarks.mock_cache_server import (
+    MockCacheServer, add_site_arguments, site_from_args)
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+
+# Config of a --check run, so that every reachable page is downloaded and
+# counted: no trap detection, and only exact duplicates are skipped.
+CHECK_SETTINGS = {"TRAPS": "false", "SIMHASHDISTANCE": "-1"}
+
+
+def percentile(values, fraction):
+    if not values:
+        return 0.0
+    values = sorted(values)
+    return values[min(len(values) - 1, int(fraction * len(values)))]
+
+
+def parse_grid(grid):
+    ''' ["THREADCOUNT=1,4", "STORAGE=shelve,log"] -> list of settings dicts,
+    one per combination. '''
+    keys, values = list(), list()
+    for option in grid:
+        key, _, choices = option.partition("=")
+        keys.append(key.strip().upper())
+        values.append([choice.strip() for choice in choices.split(",")])
+    return [dict(zip(keys, combination)) for combination in product(*values)]
+
+
+def write_config(base_file, path, settings):
+    cparser = ConfigParser()
+    cparser.read(base_file)
+    for key, value in settings.items():
+        for section in cparser.sections():
+            if cparser.has_option(section, key):
+                cparser.set(section, key, value)
+                break
+        else:
+            raise KeyError(f"{key} is not an option in {base_file}")
+    with open(path, "w") as config_file:
+        cparser.write(config_file)
+
+
+def launch(workdir, config_file, restart, timeout):
+    ''' Runs launch.py in workdir. Returns the wall time, exit status and
+    rusage of the crawl, and whether it was interrupted after timeout
+    seconds. '''
+    args = [sys.executable, os.path.join(ROOT, "launch.py")]
+    if restart:
+        args.append("--restart")
+    with open(os.path.join(workdir, "crawl.log"), "ab") as log:
+        start = time.perf_counter()
+        process = subprocess.Popen(
+            args + ["--config_file", config_file],
+            cwd=workdir, stdout=log, stderr=subprocess.STDOUT)
+        timer = None
+        interrupted = False
+        if timeout:
+            # Stop the crawl like Ctrl+C would; the report is still written.
+            timer = time.monotonic() + timeout
+        while True:
+            pid, status, rusage = os.wait4(process.pid, os.WNOHANG)
+            if pid:
+                break
+            if timer and time.monotonic() > timer:
+                process.send_signal(signal.SIGINT)
+                timer = None
+                interrupted = True
+            time.sleep(0.05)
+        elapsed = time.perf_counter() - start
+    return elapsed, os.waitstatus_to_exitcode(status), rusage, interrupted
+
+
+def reported_unique(workdir):
+    with open(os.path.join(workdir, "report.txt")) as report:
+        for line in report:
+            if line.startswith("Total Unique URLs:"):
+                return int(line.split(":")[1])
+    return None
+
+
+def run_crawl(server, base_file, settings, timeout):
+    workdir = tempfile.mkdtemp(prefix="crawl-bench-")
+    config_file = os.path.join(workdir, "config.ini")
+    write_config(base_file, config_file, settings)
+    server.stats.reset()
+    elapsed, returncode, rusage, _ = launch(workdir, config_file, True, timeout)
+    stats = server.stats
+    fetched = stats.pages + stats.traps
+    return {
+        "pages": fetched,
+        "traps": stats.traps,
+        "seconds": elapsed,
+        "pages_per_sec": fetched / elapsed,
+        "p50": percentile(stats.latencies, 0.5) * 1000,
+        "p99": percentile(stats.latencies, 0.99) * 1000,
+        "rss_mb": rusage.ru_maxrss / 1024,
+        "status": returncode,
+        "workdir": workdir,
+    }
+
+
+def check_crawl(server, site, base_file, settings, timeout, interrupt=None):
+    ''' Crawls site, stopped after interrupt seconds and resumed if
+    interrupt is given. Returns what went wrong, as a list of messages. '''
+    workdir = tempfile.mkdtemp(prefix="crawl-bench-")
+    config_file = os.path.join(workdir, "config.ini")
+    write_config(base_file, config_file, dict(settings, **CHECK_SETTINGS))
+    server.stats.reset()
+    restart = True
+    if interrupt:
+        launch(workdir, config_file, True, interrupt)
+        restart = False
+    _, returncode, _, interrupted = launch(
+        workdir, config_file, restart, timeout)
+    problems = list()
+    if interrupted:
+        problems.append(f"still crawling after {timeout:.0f}s")
+    elif returncode != 0:
+        problems.append(f"exit {returncode}")
+    stats = server.stats
+    expected = site.reachable()
+    missing = expected - stats.page_urls
+    if missing:
+        problems.append(
+            f"{len(missing)} of {len(expected)} pages never downloaded, "
+            f"e.g. {sorted(missing)[0]}")
+    if stats.page_urls - expected:
+        problems.append(
+            f"{len(stats.page_urls - expected)} unreachable pages downloaded")
+    if not interrupt and stats.pages != len(stats.page_urls):
+        problems.append(
+            f"{stats.pages - len(stats.page_urls)} pages downloaded twice")
+    unique = reported_unique(workdir)
+    if unique != len(expected):
+        problems.append(f"report counts {unique} of {len(expected)} pages")
+    if problems:
+        problems.append(f"see {workdir}")
+    return problems
+
+
+def check(server, site, args, fixed, runs):
+    failed = False
+    for settings in runs:
+        problems = check_crawl(
+            server, site, args.config_file, dict(fixed, **settings),
+            args.timeout, args.interrupt)
+        label = " ".join(f"{k}={v}" for k, v in settings.items())
+        print(f"{label:40s} {'FAIL: ' + '; '.join(problems) if problems else 'ok'}")
+        failed = failed or bool(problems)
+    return not failed
+
+
+def main(args):
+    if args.check:
+        args.duplicates = args.traps = 0
+    site = site_from_args(args)
+    server = MockCacheServer(
+        site, port=args.port, latency=args.latency, jitter=args.jitter,
+        errors=args.errors, dead_hosts=args.dead_hosts, hang=args.hang)
+    server.start()
+    fixed = {
+        "HOST": "127.0.0.1",
+        "PORT": str(args.port),
+        "SEEDURL": ",".join(site.seed_urls()),
+        "POLITENESS": str(args.politeness),
+    }
+    for option in args.set:
+        key, _, value = option.partition("=")
+        fixed[key.strip().upper()] = value.strip()
+    runs = parse_grid(args.grid)
+    try:
+        if args.check:
+            return check(server, site, args, fixed, runs)
+        print(f"{'settings':40s} {'pages':>7s} {'secs':>7s} {'pages/s':>8s} "
+              f"{'p50 ms':>7s} {'p99 ms':>7s} {'RSS MB':>7s}")
+        for settings in runs:
+            result = run_crawl(
+                server, args.config_file, dict(fixed, **settings), args.timeout)
+            label = " ".join(f"{k}={v}" for k, v in settings.items())
+            print(f"{label:40s} {result['pages']:7d} {result['seconds']:7.1f} "
+                  f"{result['pages_per_sec']:8.1f} {result['p50']:7.1f} "
+                  f"{result['p99']:7.1f} {result['rss_mb']:7.1f}"
+                  + ("" if result["status"] == 0 else
+                     f"  exit {result['status']}, see {result['workdir']}"))
+        return True
+    finally:
+        server.stop()
+
+
+if __name__ == "__main__":
+    parser = ArgumentParser()
+    parser.add_argument("--config_file", default=os.path.join(ROOT, "config.ini"))
+    parser.add_argument("--port", type=int, default=9100)
+    parser.add_argument(
+        "--grid", action="append",
+        help="KEY=v1,v2 config setting to vary, may be repeated")
+    parser.add_argument(
+        "--set", action="append", default=list(),
+        help="KEY=value config setting used by every run, may be repeated")
+    parser.add_argument("--politeness", type=float, default=0.0)
+    parser.add_argument(
+        "--timeout", type=float, default=600,
+        help="seconds before a crawl is interrupted")
+    parser.add_argument(
+        "--check", action="store_true",
+        help="check that every crawl downloads the whole site, see above")
+    parser.add_argument(
+        "--interrupt", type=float, default=None,
+        help="with --check, seconds before the crawl is stopped and resumed")
+    add_site_arguments(parser)
+    args = parser.parse_args()
+    if not args.grid:
+        args.grid = ["THREADCOUNT=1,4", "STORAGE=shelve,log"]
+    sys.exit(0 if main(args) else 1)
@@ -0,0 +1,122 @@
+''' Checks the fast extractor against the BeautifulSoup one and compares
+their speed and memory per page.
+
+Runs scraper.parse_page with EXTRACTOR = soup and EXTRACTOR = fast over a
+corpus of saved html pages, reports any page where the links or word counts
+differ, then the mean time and mean peak traced memory per page.
+
+The synthetic pages mix in non-ascii words and links, and are served three
+ways in turn: utf-8 with the charset in the Content-Type, utf-8 with
+neither a charset nor a <meta charset>, and windows-1252 declared only by
+a <meta charset>. Saved pages are served without a charset.
+
+    python -m benchmarks.extractor path/to/saved/pages
+    python -m benchmarks.extractor --synthetic 200
+'''
+import os
+import time
+import random
+import tracemalloc
+
+from argparse import ArgumentParser
+from types import SimpleNamespace
+
+import scraper
+
+
+def load_corpus(directory):
+    for name in sorted(os.listdir(directory)):
+        if name.endswith((".html", ".htm")):
+            with open(os.path.join(directory, name), "rb") as page_file:
+                yield f"https://www.ics.uci.edu/{name}", page_file.read(), "text/html"
+
+
+def synthetic_corpus(pages, seed=0):
+    rng = random.Random(seed)
+    words = sorted(scraper.STOP_WORDS)[:200] + [
+        f"term{chr(97 + i)}{chr(97 + j)}" for i in range(26) for j in range(26)]
+    # Misdecoded, these split into different tokens ("école" as utf-8 read
+    # as latin-1 is "Ã©cole", which has the token "cole").
+    accented = ["école", "café", "résumé", "naïve", "façade", "señor", "über"]
+    for page in range(pages):
+        kind = page % 3
+        body = list()
+        for _ in range(rng.randint(50, 400)):
+            text = " ".join(
+                rng.choice(accented if rng.random() < 0.1 else words)
+                for _ in range(rng.randint(5, 60)))
+            href = f"/dept/{rng.randint(0, 5000)}?id={rng.randint(0, 50)}"
+            if rng.random() < 0.1:
+                href = f"/{rng.choice(accented)}/{rng.randint(0, 50)}"
+            body.append(
+                f"<p>{text} <a href='{href}'>{rng.choice(words)}</a>"
+                f"<b>{rng.choice(words)}</b>&amp; {rng.choice(words)}</p>")
+            if rng.random() < 0.05:
+                body.append(f"<script>var {rng.choice(words)} = 1;</script>")
+        meta = '<meta charset="windows-1252">' if kind == 2 else ""
+        html = (
+            f"<!DOCTYPE html><html><head>{meta}<title>Page</title>"
+            "<style>p { color: red }</style></head><body>"
+            + "\n".join(body) + "<!-- comment --></body></html>")
+        if kind == 0:
+            yield (
+                f"https://www.ics.uci.edu/page/{page}", html.encode("utf-8"),
+                "text/html; charset=utf-8")
+        elif kind == 1:
+            yield f"https://www.ics.uci.edu/page/{page}", html.encode("utf-8"), "text/html"
+        else:
+            yield (
+                f"https://www.ics.uci.edu/page/{page}",
+                html.encode("windows-1252"), "text/html")
+
+
+def make_response(url, content, content_type):
+    raw_response = SimpleNamespace(
+        url=url, content=content, headers={"content-type": content_type})
+    return SimpleNamespace(url=url, status=200, error=None, raw_response=raw_response)
+
+
+def run(extractor, corpus):
+    scraper.EXTRACTOR = extractor
+    results, elapsed, peaks = list(), 0.0, 0
+    for url, content, content_type in corpus:
+        resp = make_response(url, content, content_type)
+        start = time.perf_counter()
+        scraper.parse_page(url, resp)
+        elapsed += time.perf_counter() - start
+        tracemalloc.start()
+        results.append(scraper.parse_page(url, resp))
+        peaks += tracemalloc.get_traced_memory()[1]
+        tracemalloc.stop()
+    return results, elapsed, peaks
+
+
+def main(corpus):
+    corpus = list(corpus)
+    soup, soup_time, soup_peak = run("soup", corpus)
+    fast, fast_time, fast_peak = run("fast", corpus)
+
+    mismatches = 0
+    for (url, _, _), expected, actual in zip(corpus, soup, fast):
+        if (sorted(expected.links) != sorted(actual.links)
+                or expected.word_frequencies != actual.word_frequencies
+                or expected.low_text != actual.low_text):
+            mismatches += 1
+            print(f"Mismatch on {url}")
+
+    pages = len(corpus)
+    print(f"{pages} pages, {mismatches} mismatches")
+    for name, elapsed, peak in (
+            ("soup", soup_time, soup_peak), ("fast", fast_time, fast_peak)):
+        print(
+            f"{name:>5}: {elapsed / pages * 1000:8.2f} ms/page, "
+            f"{peak / pages / 1024:10.1f} KiB peak/page")
+    print(f"speedup: {soup_time / fast_time:.1f}x")
+
+
+if __name__ == "__main__":
+    parser = ArgumentParser()
+    parser.add_argument("corpus", nargs="?", help="directory of saved html pages")
+    parser.add_argument("--synthetic", type=int, default=100)
+    args = parser.parse_args()
+    main(load_corpus(args.corpus) if args.corpus else synthetic_corpus(args.synthetic))
@@ -0,0 +1,80 @@
+''' Compares frontier persistence strategies.
+
+Simulates a crawl where every page completes one url and discovers a number of
+new links, and reports pages/sec for the original per-url shelve sync() and
+for the batched write-behind ShelveStore.
+
+    python -m benchmarks.frontier_save --pages 2000 --links 200
+'''
+import os
+import shelve
+import time
+import logging
+import tempfile
+
+from argparse import ArgumentParser
+from hashlib import sha256
+
+from crawler.storage import ShelveStore
+
+
+def make_pages(pages, links):
+    for page in range(pages):
+        url = f"https://www.ics.uci.edu/page-{page}"
+        discovered = [f"{url}/link-{link}" for link in range(links)]
+        yield url, discovered
+
+
+def urlhash(url):
+    return sha256(url.encode("utf-8")).hexdigest()
+
+
+def run_sync(save_file, pages, links):
+    save = shelve.open(save_file)
+    start = time.perf_counter()
+    for url, discovered in make_pages(pages, links):
+        for link in discovered:
+            key = urlhash(link)
+            if key not in save:
+                save[key] = (link, False)
+                save.sync()
+        save[urlhash(url)] = (url, True)
+        save.sync()
+    save.close()
+    return time.perf_counter() - start
+
+
+def run_batched(save_file, pages, links, batch_size, interval):
+    save = ShelveStore(save_file, batch_size, interval, logging.getLogger("bench"))
+    start = time.perf_counter()
+    for url, discovered in make_pages(pages, links):
+        for link in discovered:
+            key = urlhash(link)
+            if key not in save:
+                save[key] = (link, False)
+        save[urlhash(url)] = (url, True)
+    save.close()
+    return time.perf_counter() - start
+
+
+def main(pages, links, batch_size, interval):
+    with tempfile.TemporaryDirectory() as tmp_dir:
+        results = [
+            ("per-url sync()", run_sync(
+                os.path.join(tmp_dir, "sync.shelve"), pages, links)),
+            (f"batched ({batch_size})", run_batched(
+                os.path.join(tmp_dir, "batched.shelve"), pages, links,
+                batch_size, interval)),
+        ]
+    for name, elapsed in results:
+        print(f"{name:>20}: {pages / elapsed:10.1f} pages/sec ({elapsed:.2f}s)")
+
+
+if __name__ == "__main__":
+    parser = ArgumentParser()
+    parser.add_argument("--pages", type=int, default=500)
+    parser.add_argument("--links", type=int, default=200)
+    parser.add_argument("--batch", type=int, default=1000)
+    parser.add_argument("--interval", type=float, default=5)
+    args = parser.parse_args()
+    main(args.pages, args.links, args.batch, args.interval)
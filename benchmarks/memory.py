@@ -0,0 +1,164 @@
+''' Measures the memory the crawler keeps per url.
+
+Builds the same frontier and statistics contents twice, once with plain
+Python objects (per-host heaps of (score, sequence, url) tuples, a set of hex
+or bytes digests, PageResult-like records with a __dict__) and once with the
+compact forms in utils.compact and the __slots__ records, and reports the
+bytes per url measured with tracemalloc.
+
+    python -m benchmarks.memory --urls 200000
+    python -m benchmarks.memory --file report_files/crawled_urls.txt
+
+--file reads urls from a file with one "url" or "url: status" per line.
+'''
+import heapq
+import random
+import tracemalloc
+
+from argparse import ArgumentParser
+from hashlib import blake2b
+from urllib.parse import urlparse
+
+from utils.compact import UrlCodec, DigestSet
+from scraper import PageResult
+
+HOSTS = (
+    "www.ics.uci.edu", "www.informatics.uci.edu", "www.cs.uci.edu",
+    "www.stat.uci.edu", "wics.ics.uci.edu", "ngs.ics.uci.edu",
+    "sdcl.ics.uci.edu", "isg.ics.uci.edu", "cml.ics.uci.edu",
+    "grape.ics.uci.edu", "swiki.ics.uci.edu", "intranet.ics.uci.edu")
+SECTIONS = (
+    "~eppstein", "community", "faculty", "research", "events", "wiki",
+    "doku.php", "2019", "2020", "2021", "people", "publications")
+WORDS = (
+    "news", "seminar", "alumni", "project", "talk", "paper", "course",
+    "award", "student", "lab", "notes", "archive", "software", "data")
+
+
+def make_urls(count, seed=0):
+    rng = random.Random(seed)
+    urls = list()
+    for i in range(count):
+        path = "/".join(rng.choice(WORDS) for _ in range(rng.randint(0, 3)))
+        url = (
+            f"https://{rng.choice(HOSTS)}/{rng.choice(SECTIONS)}/"
+            f"{path}-{i}.html")
+        if rng.random() < 0.2:
+            url += f"?id={rng.randint(0, 10 ** 6)}&page={rng.randint(1, 50)}"
+        urls.append(url)
+    return urls
+
+
+def read_urls(path):
+    urls = list()
+    with open(path, encoding="utf-8") as url_file:
+        for line in url_file:
+            url = line.strip().rsplit(": ", 1)[0]
+            if url:
+                urls.append(url)
+    return urls
+
+
+def measure(build):
+    ''' Bytes still allocated by build() once it returned, with its result
+    alive. '''
+    tracemalloc.start()
+    before = tracemalloc.get_traced_memory()[0]
+    result = build()
+    after = tracemalloc.get_traced_memory()[0]
+    tracemalloc.stop()
+    del result
+    return after - before
+
+
+def tuple_queues(urls):
+    def build():
+        queues = dict()
+        for sequence, url in enumerate(urls):
+            # A fresh str, as read from a page.
+            url = url.encode("utf-8").decode("utf-8")
+            queue = queues.setdefault(urlparse(url).netloc, list())
+            heapq.heappush(queue, (random.random(), sequence, url))
+        return queues
+    return build
+
+
+def compact_queues(urls):
+    def build():
+        codec = UrlCodec()
+        queues = dict()
+        for sequence, url in enumerate(urls):
+            url = url.encode("utf-8").decode("utf-8")
+            queue = queues.setdefault(urlparse(url).netloc, list())
+            heapq.heappush(queue, codec.pack(random.random(), sequence, url))
+        return codec, queues
+    return build
+
+
+def digest(url):
+    return blake2b(url.encode("utf-8"), digest_size=8).digest()
+
+
+def hex_set(urls):
+    return lambda: {blake2b(url.encode("utf-8")).hexdigest() for url in urls}
+
+
+def bytes_set(urls):
+    return lambda: {digest(url) for url in urls}
+
+
+def digest_set(urls):
+    def build():
+        digests = DigestSet(8)
+        for url in urls:
+            digests.add(digest(url))
+        return digests
+    return build
+
+
+class DictPageResult(object):
+    ''' PageResult without __slots__. '''
+    __init__ = PageResult.__init__
+
+
+def records(cls, urls):
+    return lambda: [cls(url, None, None, False) for url in urls]
+
+
+def check(urls):
+    ''' Makes sure the compact forms hold the same data. '''
+    codec = UrlCodec()
+    entries = [codec.pack(i / 7.0 - 3, i, url) for i, url in enumerate(urls)]
+    heapq.heapify(entries)
+    decoded = [codec.unpack(heapq.heappop(entries)) for _ in range(len(urls))]
+    expected = sorted((i / 7.0 - 3, url) for i, url in enumerate(urls))
+    assert decoded == expected, "compact queue entries do not round trip"
+    digests = DigestSet.from_bytes(digest_set(urls)().to_bytes())
+    assert set(digests) == bytes_set(urls)(), "digest set lost digests"
+
+
+def main(urls):
+    check(urls[:5000])
+    count = len(urls)
+    rows = [
+        ("queued urls", tuple_queues(urls), compact_queues(urls)),
+        ("unique urls (hex)", hex_set(urls), digest_set(urls)),
+        ("unique urls (bytes)", bytes_set(urls), digest_set(urls)),
+        ("page records", records(DictPageResult, urls),
+         records(PageResult, urls)),
+    ]
+    print(f"{count} urls, {sum(map(len, urls)) / count:.1f} characters on average")
+    print(f"{'':>20} {'before':>12} {'after':>12}")
+    for name, before, after in rows:
+        before, after = measure(before) / count, measure(after) / count
+        print(
+            f"{name:>20} {before:8.1f} B/url {after:8.1f} B/url "
+            f"({before / after:.1f}x)")
+
+
+if __name__ == "__main__":
+    parser = ArgumentParser()
+    parser.add_argument("--urls", type=int, default=200000)
+    parser.add_argument("--file", default=None)
+    args = parser.parse_args()
+    main(read_urls(args.file) if args.file else make_urls(args.urls))
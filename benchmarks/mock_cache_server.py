@@ -0,0 +1,361 @@
+''' Local stand-in for the spacetime cache server.
+
+Speaks both protocols the crawler uses: the spacetime Register handshake of
+utils/server_registration.py (through a root spacetime dataframe that hands
+out the address of the HTTP server as the load balancer), and the cache's
+GET /?q=<url>&u=<useragent> that returns a CBOR dict with a pickled
+requests.Response, as read by utils/download.py.
+
+The pages are a synthetic site graph, generated deterministically from the
+url so nothing is stored:
+
+    https://<host>/p/<i>        content page i of --pages, spread over hosts
+    https://<host>/trap/<i>/<k> endless chain of low text pages
+    https://<host>/robots.txt   404, everything is allowed
+
+Content pages have --min-words to --max-words words from a Zipf-like
+vocabulary and --links links to random pages. A --duplicates fraction of them
+copy the text of another page (half exactly, half with a few words changed),
+and a --traps fraction link into a trap chain. Every reply is delayed by
+--latency seconds, +/- --jitter of it. ETag/If-None-Match is supported, a
+matching request gets a 304.
+
+To exercise the crawler's retries and circuit breakers, an --errors fraction
+of the requests (picked at random, so a retry may succeed) get a 503, and the
+last --dead-hosts hosts of the site only answer with a 503 after --hang
+seconds.
+
+Run on its own and point config.ini's HOST/PORT at it:
+
+    python -m benchmarks.mock_cache_server --port 9000 --pages 5000
+'''
+import time
+import pickle
+import random
+
+from argparse import ArgumentParser
+from bisect import bisect
+from hashlib import blake2b
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from itertools import accumulate
+from multiprocessing import Process
+from threading import Lock, Thread
+from urllib.parse import urlsplit, parse_qs
+
+import cbor
+from requests import Response
+from requests.structures import CaseInsensitiveDict
+from spacetime import Node
+
+from utils.pcc_models import Register
+
+SEED_HOSTS = [
+    "www.ics.uci.edu",
+    "www.cs.uci.edu",
+    "www.informatics.uci.edu",
+    "www.stat.uci.edu",
+]
+
+
+def register_crawlers(df, load_balancer):
+    ''' Root of the registration handshake: every Register pushed by a
+    crawler gets load_balancer, the (host, port) of the cache. '''
+    while True:
+        df.checkout_await()
+        for reg in df.read_all(Register):
+            if not reg.load_balancer:
+                reg.load_balancer = load_balancer
+        df.commit()
+
+
+class SiteGraph(object):
+    ''' Deterministic synthetic site. Page contents are derived from the page
+    number, so any page can be generated on demand. '''
+
+    VOCABULARY = 5000
+    LETTERS = "abcdefghijklmnopqrstuvwxyz"
+
+    def __init__(self, pages, hosts, links, min_words, max_words,
+                 duplicates, traps, seed=0):
+        self.pages = pages
+        self.hosts = SEED_HOSTS + [
+            f"site{i}.ics.uci.edu" for i in range(max(0, hosts - len(SEED_HOSTS)))]
+        self.links = links
+        self.min_words = min_words
+        self.max_words = max_words
+        self.duplicates = duplicates
+        self.traps = traps
+        self.seed = seed
+        rng = random.Random(seed)
+        self.vocabulary = [
+            "".join(rng.choice(self.LETTERS) for _ in range(rng.randint(3, 10)))
+            for _ in range(self.VOCABULARY)]
+        self.cum_weights = list(accumulate(
+            1 / rank for rank in range(1, self.VOCABULARY + 1)))
+
+    def seed_urls(self):
+        # Page i lives on host i % len(hosts), so the first pages are one
+        # page per host.
+        return [self.page_url(i) for i in range(min(len(self.hosts), self.pages))]
+
+    def page_url(self, i):
+        return f"https://{self.hosts[i % len(self.hosts)]}/p/{i}"
+
+    def _rng(self, *key):
+        # Not hash(), which changes between runs for strings.
+        digest = blake2b(repr((self.seed,) + key).encode("utf-8"), digest_size=8)
+        return random.Random(int.from_bytes(digest.digest(), "little"))
+
+    def _words(self, i, count):
+        rng = self._rng("words", i)
+        total = self.cum_weights[-1]
+        return [
+            self.vocabulary[bisect(self.cum_weights, rng.random() * total)]
+            for _ in range(count)]
+
+    def page(self, i):
+        ''' Returns (text, links) of content page i. '''
+        rng = self._rng("page", i)
+        count = rng.randint(self.min_words, self.max_words)
+        kind = rng.random()
+        if kind < self.duplicates:
+            original = rng.randrange(self.pages)
+            words = self._words(original, self._rng("page", original).randint(
+                self.min_words, self.max_words))
+            if kind < self.duplicates / 2:
+                # Near duplicate: a few words changed.
+                for _ in range(3):
+                    words[rng.randrange(len(words))] = rng.choice(self.vocabulary)
+        else:
+            words = self._words(i, count)
+        links = [self.page_url(rng.randrange(self.pages)) for _ in range(self.links)]
+        if rng.random() < self.traps:
+            links.append(f"https://{self.hosts[i % len(self.hosts)]}/trap/{i}/1")
+        return " ".join(words), links
+
+    def reachable(self):
+        ''' Urls of the content pages linked to from the seeds, directly or
+        not, which a crawl of the site must download. '''
+        seen = set(self.seed_urls())
+        stack = list(seen)
+        while stack:
+            _, links = self.lookup(stack.pop())
+            for link in links:
+                if "/p/" in link and link not in seen:
+                    seen.add(link)
+                    stack.append(link)
+        return seen
+
+    def trap(self, i, k):
+        rng = self._rng("trap", i, k)
+        host = self.hosts[i % len(self.hosts)]
+        text = " ".join(rng.choice(self.vocabulary) for _ in range(20))
+        return text, [
+            f"https://{host}/trap/{i}/{k + 1}", f"https://{host}/trap/{i}/{k + 2}"]
+
+    def lookup(self, url):
+        ''' Returns (text, links) for url, or None if it is not in the site. '''
+        parsed = urlsplit(url)
+        host = parsed.netloc.lower()
+        if host not in self.hosts:
+            return None
+        parts = parsed.path.strip("/").split("/")
+        try:
+            if len(parts) == 2 and parts[0] == "p":
+                i = int(parts[1])
+                if 0 <= i < self.pages and self.page_url(i) == f"https://{host}/p/{i}":
+                    return self.page(i)
+            elif len(parts) == 3 and parts[0] == "trap":
+                return self.trap(int(parts[1]), int(parts[2]))
+        except ValueError:
+            pass
+        return None
+
+
+def render(url, text, links):
+    anchors = "\n".join(f'<a href="{link}">{link}</a>' for link in links)
+    return (
+        f"<html><head><title>{url}</title>"
+        f"<style>body {{ font-family: serif; }}</style>"
+        f"<script>var page = '{url}';</script></head>\n"
+        f"<body><p>{text}</p>\n{anchors}\n</body></html>").encode("utf-8")
+
+
+class CacheStats(object):
+    ''' What the cache served. latencies holds the time between two requests
+    on the same keep-alive connection, which is one full worker cycle
+    (download, parse, frontier update) for a threaded crawler. '''
+
+    def __init__(self):
+        self.lock = Lock()
+        self.reset()
+
+    def reset(self):
+        with self.lock:
+            self.pages = 0
+            self.traps = 0
+            self.not_modified = 0
+            self.not_found = 0
+            self.errors = 0
+            self.page_urls = set() # distinct content pages served
+            self.latencies = list()
+            self.first = self.last = None
+
+    def record(self, kind, latency, url=None):
+        now = time.monotonic()
+        with self.lock:
+            if kind == "page":
+                self.pages += 1
+                self.page_urls.add(url)
+            elif kind == "trap":
+                self.traps += 1
+            elif kind == "not_modified":
+                self.not_modified += 1
+            elif kind == "error":
+                self.errors += 1
+            else:
+                self.not_found += 1
+            if latency is not None:
+                self.latencies.append(latency)
+            if self.first is None:
+                self.first = now
+            self.last = now
+
+
+class CacheHandler(BaseHTTPRequestHandler):
+    protocol_version = "HTTP/1.1"
+
+    def log_message(self, format, *args):
+        pass
+
+    def handle(self):
+        try:
+            super().handle()
+        except (BrokenPipeError, ConnectionResetError):
+            # The crawler hung up on a reply over its MAXPAGESIZE.
+            pass
+
+    def do_GET(self):
+        server = self.server
+        started = time.monotonic()
+        previous = getattr(self, "previous_request", None)
+        self.previous_request = started
+        url = parse_qs(urlsplit(self.path).query).get("q", [""])[0]
+        if server.latency:
+            time.sleep(server.latency * (
+                1 + random.uniform(-server.jitter, server.jitter)))
+
+        page = server.site.lookup(url)
+        if urlsplit(url).netloc.lower() in server.dead_hosts:
+            time.sleep(server.hang)
+            kind, reply = "error", {"url": url, "status": 503}
+        elif server.errors and random.random() < server.errors:
+            kind, reply = "error", {"url": url, "status": 503}
+        elif page is None:
+            kind, reply = "not_found", {"url": url, "status": 404}
+        else:
+            body = render(url, *page)
+            etag = f'"{blake2b(body, digest_size=8).hexdigest()}"'
+            if self.headers.get("If-None-Match") == etag:
+                kind, reply = "not_modified", {"url": url, "status": 304}
+            else:
+                kind = "trap" if "/trap/" in url else "page"
+                reply = {
+                    "url": url, "status": 200,
+                    "response": pickle.dumps(self._response(url, body, etag))}
+        data = cbor.dumps(reply)
+        self.send_response(200)
+        self.send_header("Content-Type", "application/cbor")
+        self.send_header("Content-Length", str(len(data)))
+        self.end_headers()
+        self.wfile.write(data)
+        server.stats.record(
+            kind, started - previous if previous is not None else None, url)
+
+    @staticmethod
+    def _response(url, body, etag):
+        resp = Response()
+        resp.status_code = 200
+        resp.url = url
+        resp._content = body
+        resp.encoding = "utf-8"
+        resp.headers = CaseInsensitiveDict({
+            "Content-Type": "text/html; charset=utf-8",
+            "Content-Length": str(len(body)),
+            "ETag": etag,
+        })
+        return resp
+
+
+class MockCacheServer(object):
+    ''' The HTTP cache and the registration dataframe, started together. '''
+
+    def __init__(self, site, host="127.0.0.1", port=9000, http_port=0,
+                 latency=0.0, jitter=0.0, errors=0.0, dead_hosts=0, hang=0.0):
+        self.http = ThreadingHTTPServer((host, http_port), CacheHandler)
+        self.http.daemon_threads = True
+        self.http.site = site
+        self.http.latency = latency
+        self.http.jitter = jitter
+        self.http.errors = errors
+        self.http.dead_hosts = set(site.hosts[len(site.hosts) - dead_hosts:])
+        self.http.hang = hang
+        self.http.stats = self.stats = CacheStats()
+        self.cache_server = (host, self.http.server_address[1])
+        self.registration = Node(
+            register_crawlers, Types=[Register], server_port=port)
+        self.port = port
+
+    def start(self):
+        Thread(target=self.http.serve_forever, daemon=True).start()
+        self.registration.start_async(self.cache_server)
+
+    def stop(self):
+        self.http.shutdown()
+        self.http.server_close()
+        self.registration.terminate()
+        # App.join waits for the return value of register_crawlers, which
+        # never returns; wait for the process alone.
+        Process.join(self.registration)
+
+
+def add_site_arguments(parser):
+    parser.add_argument("--pages", type=int, default=2000)
+    parser.add_argument("--hosts", type=int, default=8)
+    parser.add_argument("--links", type=int, default=10)
+    parser.add_argument("--min-words", type=int, default=50)
+    parser.add_argument("--max-words", type=int, default=1500)
+    parser.add_argument("--duplicates", type=float, default=0.05)
+    parser.add_argument("--traps", type=float, default=0.02)
+    parser.add_argument("--latency", type=float, default=0.0)
+    parser.add_argument("--jitter", type=float, default=0.5)
+    parser.add_argument("--errors", type=float, default=0.0)
+    parser.add_argument("--dead-hosts", type=int, default=0)
+    parser.add_argument("--hang", type=float, default=2.0)
+
+
+def site_from_args(args):
+    return SiteGraph(
+        args.pages, args.hosts, args.links, args.min_words, args.max_words,
+        args.duplicates, args.traps)
+
+
+if __name__ == "__main__":
+    parser = ArgumentParser()
+    parser.add_argument("--port", type=int, default=9000)
+    parser.add_argument("--http-port", type=int, default=0)
+    add_site_arguments(parser)
+    args = parser.parse_args()
+    site = site_from_args(args)
+    server = MockCacheServer(
+        site, port=args.port, http_port=args.http_port,
+        latency=args.latency, jitter=args.jitter, errors=args.errors,
+        dead_hosts=args.dead_hosts, hang=args.hang)
+    server.start()
+    print(f"Registration on port {args.port}, cache on {server.cache_server}.")
+    print(f"SEEDURL = {','.join(site.seed_urls())}")
+    try:
+        while True:
+            time.sleep(60)
+    except KeyboardInterrupt:
+        server.stop()
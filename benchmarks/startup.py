@@ -0,0 +1,132 @@
+''' Measures how long the crawler takes to start.
+
+    imports   wall time of "import launch" in a fresh interpreter, and of the
+              same with the dependencies it defers (bs4, lxml, requests,
+              cbor, spacetime, asyncio, ...) imported up front as they used
+              to be
+    workers   time to create THREADCOUNT workers, which check scraper.py's
+              source once per process
+    resume    time to build the Frontier of a saved crawl of --urls urls
+              (half of them completed), from the SAVE.pending snapshot and
+              by walking the save file, for each storage
+
+    python -m benchmarks.startup --urls 100000 --repeat 5
+'''
+import os
+import sys
+import time
+import logging
+import tempfile
+import statistics
+import subprocess
+
+from argparse import ArgumentParser
+from configparser import ConfigParser
+
+from utils import get_urldigest
+from utils.config import Config
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+
+DEFERRED = (
+    "bs4", "lxml.etree", "requests", "cbor", "spacetime", "asyncio",
+    "concurrent.futures", "multiprocessing", "urllib.robotparser",
+    "http.server")
+
+
+def time_import(extra, repeat):
+    code = (
+        "import time\n"
+        "start = time.perf_counter()\n"
+        "import launch\n"
+        + "".join(f"import {module}\n" for module in extra)
+        + "print(time.perf_counter() - start)\n")
+    times = list()
+    for _ in range(repeat):
+        output = subprocess.run(
+            [sys.executable, "-c", code], cwd=ROOT, check=True,
+            capture_output=True, text=True).stdout
+        times.append(float(output.split()[-1]))
+    return statistics.median(times)
+
+
+def make_config(tmp_dir, storage, urls):
+    cparser = ConfigParser()
+    cparser.read(os.path.join(ROOT, "config.ini"))
+    cparser.set("LOCAL PROPERTIES", "SAVE", os.path.join(tmp_dir, f"{storage}.save"))
+    cparser.set("LOCAL PROPERTIES", "STORAGE", storage)
+    cparser.set("LOCAL PROPERTIES", "BLOOMCAPACITY", str(urls))
+    cparser.set("LOCAL PROPERTIES", "SNAPSHOTINTERVAL", "0")
+    cparser.set("CRAWLER", "ROBOTS", "false")
+    cparser.set("CRAWLER", "TRAPS", "false")
+    return Config(cparser)
+
+
+def make_urls(count):
+    return [
+        f"https://www{i % 50}.ics.uci.edu/section-{i % 7}/page-{i}.html"
+        for i in range(count)]
+
+
+def time_workers(config, frontier):
+    from crawler.worker import Worker
+    start = time.perf_counter()
+    for worker_id in range(config.threads_count):
+        Worker(worker_id, config, frontier)
+    return time.perf_counter() - start
+
+
+def time_resume(config, repeat, snapshot):
+    from crawler.frontier import Frontier
+    times = list()
+    for _ in range(repeat):
+        if not snapshot and os.path.exists(f"{config.save_file}.pending"):
+            os.remove(f"{config.save_file}.pending")
+        start = time.perf_counter()
+        frontier = Frontier(config, False)
+        times.append(time.perf_counter() - start)
+        queued = frontier.tbd_count
+        frontier.close()
+    return statistics.median(times), queued
+
+
+def bench_resume(storage, urls, repeat):
+    from crawler.frontier import Frontier
+    with tempfile.TemporaryDirectory() as tmp_dir:
+        config = make_config(tmp_dir, storage, urls)
+        config.seed_urls = list()
+        frontier = Frontier(config, True)
+        for i, url in enumerate(make_urls(urls)):
+            if i % 2:
+                frontier.save[get_urldigest(url)] = (url, True, 1)
+            else:
+                frontier.add_url(url, score=1)
+        workers = time_workers(config, frontier)
+        frontier.close()
+        walked, walked_count = time_resume(config, repeat, snapshot=False)
+        loaded, loaded_count = time_resume(config, repeat, snapshot=True)
+        assert walked_count == loaded_count, (walked_count, loaded_count)
+    return workers, walked, loaded, loaded_count
+
+
+def main(urls, repeat):
+    # The frontier logs every start.
+    logging.disable(logging.INFO)
+    lazy, eager = time_import((), repeat), time_import(DEFERRED, repeat)
+    print(f"{'import launch':>28}: {lazy * 1000:8.1f} ms")
+    print(f"{'... with deferred imports':>28}: {eager * 1000:8.1f} ms")
+    for storage in ("shelve", "log"):
+        workers, walked, loaded, count = bench_resume(storage, urls, repeat)
+        print(
+            f"{storage:>8}: {count} pending urls, resume {walked:.3f}s "
+            f"walking the save file, {loaded:.3f}s from the snapshot "
+            f"({walked / loaded:.1f}x); workers created in "
+            f"{workers * 1000:.1f} ms")
+
+
+if __name__ == "__main__":
+    parser = ArgumentParser()
+    parser.add_argument("--urls", type=int, default=100000)
+    parser.add_argument("--repeat", type=int, default=3)
+    args = parser.parse_args()
+    main(args.urls, args.repeat)
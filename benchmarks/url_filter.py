@@ -0,0 +1,174 @@
+''' Microbenchmark of scraper.is_valid against the per-call regex version it
+replaced.
+
+The corpus is every url in report_files/crawled_urls.txt plus variants of
+each one that hit the different rules (query traps, file extensions, dates,
+repeated directories, other domains), repeated until it has --size urls.
+Reports urls/sec for both functions, any url they disagree on, and the
+per-rule hit counters of URL_FILTER.
+
+    python -m benchmarks.url_filter --size 500000
+'''
+import re
+import time
+import random
+
+from argparse import ArgumentParser
+from urllib.parse import urlparse, parse_qs
+
+import scraper
+
+VALID_DOMAINS = [
+    "ics.uci.edu",
+    "cs.uci.edu",
+    "informatics.uci.edu",
+    "stat.uci.edu",
+]
+
+def legacy_is_valid(url):
+    ''' scraper.is_valid before the rules were compiled into URL_FILTER. '''
+    try:
+        parsed = urlparse(url)
+        if parsed.scheme not in set(["http", "https"]):
+            return False
+        parsedDomain = parsed.netloc.split(':')[0]
+        for domain in VALID_DOMAINS:
+            if parsedDomain.endswith(domain):
+                break
+        else:
+            return False
+
+        # block GitLab repositories (UI-heavy, non-informational, trap-prone)
+        if parsedDomain.endswith("gitlab.ics.uci.edu"):
+            return False
+
+        # block pagination paths like /page/2, /page/40
+        if re.search(r"/page/\d+", parsed.path.lower()):
+            return False
+
+        # block pagination via query params (?paged=40)
+        params = parse_qs(parsed.query)
+        if "paged" in params:
+            return False
+
+        # block WordPress auth / admin pages
+        if re.search(r"/wp-(login|admin)", parsed.path.lower()):
+            return False
+
+        BAD_QUERIES = {
+            'eventDate', 'tribe-bar-date', 'ical',
+            'do', 'tab_files', 'tab_details', 'image',
+            'rev', 'idx', "outlook-ical", "date", "year",
+            "month", "day", "redirect_to", "action", "loggedout"
+        }
+
+        if any(param in params for param in BAD_QUERIES):
+            return False
+
+        # handle case of very long query strings that usually indicate UI/state traps
+        if len(parsed.query) > 100:
+            return False
+
+        DATE_IN_PATH = re.compile(r"/\d{4}-\d{2}(?:-\d{2})?(?:/|$)")
+        parsedPath = parsed.path.lower()
+        if DATE_IN_PATH.search(parsedPath):
+            return False
+
+        # a long path depth is most likely a trap
+        if parsedPath.count("/") > 10:
+            return False
+
+        # block Grape wiki revision/history UI (infinite version trap)
+        if parsed.netloc.endswith("grape.ics.uci.edu"):
+            return False
+
+        # block photo gallery directories (many HTML pages, little text)
+        if "/pix/" in parsed.path.lower():
+            return False
+
+        # heuristic to detect repeating directory patterns which often indicate
+        # crawler traps such as calendar or pagination loops.
+        if re.match(r"^.?(/.+?/).?\1.$|^.?/(.+?/)\2.*$", parsedPath):
+            return False
+
+        return not re.match(
+            r".*\.(css|js|bmp|gif|jpe?g|ico"
+            + r"|png|tiff?|mid|mp2|mp3|mp4"
+            + r"|wav|avi|mov|mpeg|ram|m4v|mkv|ogg|ogv|pdf"
+            + r"|ps|eps|tex|ppt|pptx|doc|docx|xls|xlsx|names"
+            + r"|data|dat|exe|bz2|tar|msi|bin|7z|psd|dmg|iso"
+            + r"|epub|dll|cnf|tgz|sha1"
+            + r"|thmx|mso|arff|rtf|jar|csv"
+            + r"|rm|smil|wmv|swf|wma|zip|rar|gz)$", parsed.path.lower())
+
+    except TypeError:
+        print ("TypeError for ", parsed)
+        raise
+
+
+VARIANTS = [
+    "{url}",
+    "{url}/",
+    "{url}?paged=3",
+    "{url}?eventDate=2020-01-01&x=1",
+    "{url}?ical=1",
+    "{url}?q=search&page_id=12",
+    "{url}/page/4",
+    "{url}/2019-05-12/",
+    "{url}/file.PDF",
+    "{url}/archive.tar.gz",
+    "{url}/wp-login.php?redirect_to=x",
+    "{url}/a/b/a/b/c",
+    "{url}/pix/img",
+    "{url}?" + "x=1&" * 40,
+    "ftp://www.ics.uci.edu/pub",
+    "https://gitlab.ics.uci.edu/group/project/-/tree/main",
+    "https://www.uci.edu/about",
+    "https://grape.ics.uci.edu/wiki/asterix/wiki/stats?version=3",
+]
+
+
+def load_corpus(path, size, seed=0):
+    with open(path, encoding="utf-8") as crawled:
+        urls = [line.rsplit(": ", 1)[0] for line in crawled if line.strip()]
+    rng = random.Random(seed)
+    corpus = [
+        variant.format(url=url) for url in urls for variant in VARIANTS
+        if "{url}" in variant or rng.random() < 0.01]
+    rng.shuffle(corpus)
+    while len(corpus) < size:
+        corpus.extend(corpus[:size - len(corpus)])
+    return corpus[:size]
+
+
+def measure(function, corpus):
+    start = time.perf_counter()
+    results = [function(url) for url in corpus]
+    return results, time.perf_counter() - start
+
+
+def main(path, size):
+    corpus = load_corpus(path, size)
+    expected, legacy_time = measure(legacy_is_valid, corpus)
+    scraper.URL_FILTER.hits.clear()
+    actual, compiled_time = measure(scraper.is_valid, corpus)
+
+    disagreements = sorted({
+        url for url, old, new in zip(corpus, expected, actual) if old != new})
+    for url in disagreements[:20]:
+        print(f"disagree: {url} (legacy {legacy_is_valid(url)})")
+    print(f"{len(corpus)} urls, {len(disagreements)} distinct disagreements")
+    print(f"  legacy: {len(corpus) / legacy_time:12.0f} urls/sec")
+    print(f"compiled: {len(corpus) / compiled_time:12.0f} urls/sec")
+    print(f" speedup: {legacy_time / compiled_time:.1f}x")
+    print("rule hits:")
+    for rule, hits in scraper.URL_FILTER.hits.most_common():
+        print(f"  {rule}: {hits}")
+
+
+if __name__ == "__main__":
+    parser = ArgumentParser()
+    parser.add_argument("--corpus", default="report_files/crawled_urls.txt")
+    parser.add_argument("--size", type=int, default=200000)
+    args = parser.parse_args()
+    main(args.corpus, args.size)
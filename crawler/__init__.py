@@ -1,26 +1,124 @@
+import os
+
+import scraper
 from utils import get_logger
+from utils.metrics import METRICS
+from utils.stats import CrawlStats
 from crawler.frontier import Frontier
+from crawler.shards import ShardedFrontier
 from crawler.worker import Worker
 
 class Crawler(object):
     def __init__(self, config, restart, frontier_factory=Frontier, worker_factory=Worker):
         self.config = config
         self.logger = get_logger("CRAWLER")
+        scraper.configure(config)
+        # Report statistics and the pages seen by the duplicate detector are
+        # checkpointed next to the save file and restored along with the
+        # frontier.
+        self.stats_file = f"{config.save_file}.stats"
+        self.duplicates_file = f"{config.save_file}.duplicates"
+        if restart:
+            CrawlStats.remove(self.stats_file)
+        elif scraper.REPORT.load(self.stats_file):
+            self.logger.info(
+                f"Restored report statistics from {self.stats_file}.")
+        if restart or config.recrawl:
+            # A recrawl starts over too: a page that changed a little would
+            # be skipped as a near duplicate of its own last download.
+            if os.path.exists(self.duplicates_file):
+                os.remove(self.duplicates_file)
+        elif scraper.DUPLICATES.load(self.duplicates_file):
+            self.logger.info(
+                f"Restored the pages seen by the duplicate detector "
+                f"from {self.duplicates_file}.")
+        scraper.REPORT.start_checkpoints(self.stats_file)
+        scraper.DUPLICATES.start_checkpoints(self.duplicates_file)
+        if config.shard is not None and frontier_factory is Frontier:
+            # One shard of a crawl split over several processes.
+            frontier_factory = ShardedFrontier
         self.frontier = frontier_factory(config, restart)
+        # Checkpointed whenever completed urls are flushed to the save file:
+        # the statistics before, so a crash never loses those of a page saved
+        # as complete that will not be downloaded again, and the fingerprints
+        # after, so a page downloaded again is never a duplicate of itself.
+        self.frontier.save.before_flush = scraper.REPORT.checkpoint
+        self.frontier.save.after_flush = scraper.DUPLICATES.checkpoint
         self.workers = list()
+        if config.fetch_mode == "async" and worker_factory is Worker:
+            # Each worker thread runs an event loop with many downloads
+            # outstanding instead of one blocking download. Imported only
+            # then, with asyncio.
+            from crawler.async_worker import AsyncWorker
+            worker_factory = AsyncWorker
         self.worker_factory = worker_factory
+        self.parser = None
+        if config.parser_processes > 0:
+            from crawler.pipeline import ParsePipeline
+            self.parser = ParsePipeline(config, self.frontier)
+        # Downloaded pages are written to the archive, or, when replaying,
+        # read from it instead of the cache server.
+        self.archive = self.replay = None
+        if config.archive:
+            from crawler.archive import ArchiveWriter
+            self.archive = ArchiveWriter(
+                config.archive_dir, config.archive_segment,
+                config.archive_compression, self.logger)
+        if config.replay:
+            from crawler.archive import ArchiveReader
+            self.replay = ArchiveReader(config.archive_dir, self.logger)
+        METRICS.enabled = config.metrics
+        self.metrics_logger = get_logger("METRICS")
 
     def start_async(self):
+        # The report is rewritten on a timer instead of after every page.
+        scraper.REPORT.start_snapshots(
+            scraper.REPORT_FILE, self.config.report_interval)
+        if self.config.metrics:
+            self._start_metrics()
+        kwargs = {
+            name: value for name, value in (
+                ("parser", self.parser), ("archive", self.archive),
+                ("replay", self.replay))
+            if value is not None}
         self.workers = [
-            self.worker_factory(worker_id, self.config, self.frontier)
+            self.worker_factory(worker_id, self.config, self.frontier, **kwargs)
             for worker_id in range(self.config.threads_count)]
         for worker in self.workers:
             worker.start()
 
+    def _start_metrics(self):
+        if self.config.metrics_port:
+            try:
+                host, port = METRICS.serve(self.config.metrics_port)
+                self.logger.info(f"Serving metrics on http://{host}:{port}/metrics.")
+            except OSError as e:
+                self.logger.warning(
+                    f"Cannot serve metrics on port {self.config.metrics_port}: {e}")
+        if self.config.metrics_interval > 0:
+            METRICS.start_summaries(
+                self.config.metrics_interval, self.metrics_logger)
+
     def start(self):
         self.start_async()
         self.join()
 
     def join(self):
-        for worker in self.workers:
-            worker.join()
+        try:
+            for worker in self.workers:
+                worker.join()
+        finally:
+            if self.parser:
+                self.parser.close()
+            if self.archive:
+                self.archive.close()
+            self.frontier.close()
+            # Pages completed after the last flush.
+            scraper.DUPLICATES.checkpoint()
+            scraper.REPORT.stop()
+            with METRICS.time("report"):
+                scraper.REPORT.save(self.stats_file)
+                scraper.print_report()
+            if self.config.metrics:
+                self.metrics_logger.info(f"Metrics: {METRICS.summary()}")
+            METRICS.stop()
@@ -0,0 +1,269 @@
+import os
+import gzip
+import uuid
+import struct
+
+from datetime import datetime, timezone
+from http import HTTPStatus
+from threading import Lock, local
+
+from utils import get_urldigest
+from utils.response import Response
+
+# One row per record: sha256 digest of the url (utils.get_urldigest), segment
+# number, offset of the record in the segment and its compressed length.
+INDEX = struct.Struct("<32sIQI")
+INDEX_FILE = "index.bin"
+
+# Status of the Response for a url that is not in the archive when replaying.
+NOT_ARCHIVED = 404
+
+EXTENSIONS = {"gzip": ".warc.gz", "zstd": ".warc.zst"}
+
+# Headers that described the bytes on the wire, not the decoded content that
+# is archived.
+WIRE_HEADERS = {"content-encoding", "transfer-encoding", "content-length"}
+
+
+def get_archive_dir(archive_dir, shard):
+    return archive_dir if shard is None else os.path.join(archive_dir, f"shard{shard}")
+
+
+def _zstandard():
+    import zstandard
+    return zstandard
+
+
+def _compress(data, compression):
+    if compression == "zstd":
+        return _zstandard().compress(data, 3)
+    return gzip.compress(data, 6)
+
+
+def _decompress(data, compression):
+    if compression == "zstd":
+        return _zstandard().decompress(data)
+    return gzip.decompress(data)
+
+
+def configure_replay(config):
+    ''' Makes config the config of a crawl that reads its pages from the
+    archive in config.archive_dir: no cache server, politeness or robots.txt
+    (the pages were fetched under them already), and nothing archived
+    again. Call before anything is created from config. '''
+    config.replay = True
+    config.archive = False
+    config.time_delay = 0
+    config.robots = False
+    config.fetch_mode = "threads"
+    config.cache_server = None
+
+
+def _format_record(url, resp):
+    ''' The WARC response record of a downloaded page: the WARC headers, then
+    the HTTP reply with the decoded content. '''
+    raw = resp.raw_response
+    content = raw.content or b""
+    reason = raw.reason
+    if not reason:
+        try:
+            reason = HTTPStatus(raw.status_code).phrase
+        except ValueError:
+            reason = ""
+    lines = [f"HTTP/1.1 {raw.status_code} {reason}"]
+    for name, value in raw.headers.items():
+        if name.lower() not in WIRE_HEADERS:
+            value = " ".join(str(value).splitlines())
+            lines.append(f"{name}: {value}")
+    lines.append(f"Content-Length: {len(content)}")
+    http = ("\r\n".join(lines) + "\r\n\r\n").encode("utf-8") + content
+    warc = [
+        "WARC/1.1",
+        "WARC-Type: response",
+        f"WARC-Record-ID: <urn:uuid:{uuid.uuid4()}>",
+        f"WARC-Date: {datetime.now(timezone.utc).strftime('%Y-%m-%dT%H:%M:%SZ')}",
+        f"WARC-Target-URI: {url}",
+        f"WARC-Crawler-Status: {resp.status}",
+    ]
+    if resp.url != url:
+        warc.append(f"WARC-Crawler-Url: {resp.url}")
+    if raw.url and raw.url != url:
+        warc.append(f"WARC-Crawler-Raw-Url: {raw.url}")
+    warc.append("Content-Type: application/http;msgtype=response")
+    warc.append(f"Content-Length: {len(http)}")
+    return ("\r\n".join(warc) + "\r\n\r\n").encode("utf-8") + http + b"\r\n\r\n"
+
+
+def _parse_headers(block):
+    headers = list()
+    for line in block.decode("utf-8", errors="replace").split("\r\n")[1:]:
+        name, _, value = line.partition(":")
+        headers.append((name.strip(), value.strip()))
+    return headers
+
+
+def parse_record(url, record):
+    ''' The Response of a record written by _format_record, as download
+    would have returned it. '''
+    from requests import Response as RawResponse
+    from requests.structures import CaseInsensitiveDict
+    warc_block, _, rest = record.partition(b"\r\n\r\n")
+    warc = dict(_parse_headers(warc_block))
+    http = rest[:int(warc["Content-Length"])]
+    http_block, _, content = http.partition(b"\r\n\r\n")
+    status_line = http_block.split(b"\r\n", 1)[0].decode("latin-1").split(" ", 2)
+    raw = RawResponse()
+    raw.status_code = int(status_line[1])
+    raw.reason = status_line[2] if len(status_line) > 2 else ""
+    raw.url = warc.get("WARC-Crawler-Raw-Url", url)
+    raw.headers = CaseInsensitiveDict(_parse_headers(http_block))
+    raw._content = content
+    resp = Response({
+        "url": warc.get("WARC-Crawler-Url", url),
+        "status": int(warc["WARC-Crawler-Status"])})
+    resp.raw_response = raw
+    return resp
+
+
+class ArchiveWriter(object):
+    ''' Appends downloaded pages to a WARC-style archive in path:
+
+        segment-<n>.warc.gz   (or .warc.zst) response records, each
+                              compressed on its own (a gzip member or zstd
+                              frame), so any record can be read alone
+        index.bin             INDEX rows: url digest, segment, offset, length
+
+    A segment is closed and the next one started once it reaches
+    segment_size bytes. Every writer starts a new segment, and the index
+    rows of a batch are only written after its records are, so a crash
+    leaves at most records without index rows. Records are compressed in
+    the calling thread, outside the lock. '''
+
+    def __init__(self, path, segment_size, compression, logger, flush_every=64):
+        self.path = path
+        self.segment_size = segment_size
+        self.logger = logger
+        if compression == "zstd":
+            try:
+                _zstandard()
+            except ImportError:
+                logger.warning(
+                    "zstandard is not installed, archiving with gzip instead.")
+                compression = "gzip"
+        self.compression = compression
+        self.flush_every = flush_every
+        self.lock = Lock()
+        os.makedirs(path, exist_ok=True)
+        numbers = [
+            int(name.split("-")[1].split(".")[0]) for name in os.listdir(path)
+            if name.startswith("segment-")]
+        self.segment = max(numbers) + 1 if numbers else 0
+        self.segment_file = None
+        self.index_file = open(os.path.join(path, INDEX_FILE), "ab")
+        self.rows = list()
+        self.records = 0
+        self.bytes_in = self.bytes_out = 0
+
+    def _open_segment(self):
+        name = f"segment-{self.segment:06d}{EXTENSIONS[self.compression]}"
+        self.segment_file = open(os.path.join(self.path, name), "wb")
+        self.offset = 0
+
+    def add(self, url, resp):
+        ''' Archives resp, the download of url, if it has content. '''
+        raw = resp.raw_response
+        if raw is None or not raw.content:
+            return
+        record = _format_record(url, resp)
+        data = _compress(record, self.compression)
+        with self.lock:
+            if self.segment_file is None:
+                self._open_segment()
+            self.segment_file.write(data)
+            self.rows.append(INDEX.pack(
+                get_urldigest(url), self.segment, self.offset, len(data)))
+            self.offset += len(data)
+            self.records += 1
+            self.bytes_in += len(record)
+            self.bytes_out += len(data)
+            if len(self.rows) >= self.flush_every:
+                self._flush()
+            if self.offset >= self.segment_size:
+                self._flush()
+                self.segment_file.close()
+                self.segment_file = None
+                self.segment += 1
+
+    def _flush(self):
+        if self.segment_file is not None:
+            self.segment_file.flush()
+        self.index_file.write(b"".join(self.rows))
+        self.index_file.flush()
+        self.rows = list()
+
+    def close(self):
+        with self.lock:
+            self._flush()
+            if self.segment_file is not None:
+                self.segment_file.close()
+                self.segment_file = None
+            self.index_file.close()
+            ratio = self.bytes_in / self.bytes_out if self.bytes_out else 0
+            self.logger.info(
+                f"Archived {self.records} pages to {self.path}, "
+                f"{self.bytes_out} bytes ({ratio:.1f}x {self.compression}).")
+
+
+class ArchiveReader(object):
+    ''' Reads pages back from the archives written by ArchiveWriter in path
+    and in its shard<n> subdirectories. download has the signature of
+    utils.download.download; the last record of a url wins. Each thread
+    keeps its own open segment files. '''
+
+    def __init__(self, path, logger):
+        self.logger = logger
+        self.records = dict() # url digest -> (segment path, offset, length)
+        self.files = local()
+        if os.path.isdir(path):
+            self._load_index(path)
+            for name in sorted(os.listdir(path)):
+                if name.startswith("shard"):
+                    self._load_index(os.path.join(path, name))
+        self.logger.info(f"Replaying {len(self.records)} archived pages from {path}.")
+
+    def _load_index(self, archive_dir):
+        index_path = os.path.join(archive_dir, INDEX_FILE)
+        if not os.path.exists(index_path):
+            return
+        segments = dict()
+        for name in os.listdir(archive_dir):
+            if name.startswith("segment-"):
+                segments[int(name.split("-")[1].split(".")[0])] = os.path.join(
+                    archive_dir, name)
+        with open(index_path, "rb") as index_file:
+            data = index_file.read()
+        # A partial row at the end was being written when the crawl stopped.
+        data = data[:len(data) - len(data) % INDEX.size]
+        for digest, segment, offset, length in INDEX.iter_unpack(data):
+            if segment in segments:
+                self.records[digest] = (segments[segment], offset, length)
+
+    def _read(self, path, offset, length):
+        files = getattr(self.files, "open", None)
+        if files is None:
+            files = self.files.open = dict()
+        segment_file = files.get(path)
+        if segment_file is None:
+            segment_file = files[path] = open(path, "rb")
+        segment_file.seek(offset)
+        data = segment_file.read(length)
+        return _decompress(data, "zstd" if path.endswith(".zst") else "gzip")
+
+    def download(self, url, config=None, logger=None, validators=None):
+        record = self.records.get(get_urldigest(url))
+        if record is None:
+            return Response({
+                "url": url,
+                "status": NOT_ARCHIVED,
+                "error": f"{url} is not in the archive."})
+        return parse_record(url, self._read(*record))
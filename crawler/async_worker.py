@@ -0,0 +1,61 @@
+import asyncio
+
+from concurrent.futures import ThreadPoolExecutor
+
+from utils.async_download import AsyncDownloader
+from utils.metrics import METRICS
+from crawler.worker import Worker
+
+
+class AsyncWorker(Worker):
+    ''' Worker that keeps up to config.async_requests downloads outstanding
+    from a single thread, on an asyncio event loop.
+
+    One dispatcher pulls urls from the frontier (blocking in a helper thread,
+    since get_tbd_url waits on politeness) and hands them to a fixed set of
+    fetch tasks. Scraping and frontier updates run in a small thread pool so
+    they do not stall the event loop. '''
+
+    def run(self):
+        asyncio.run(self._crawl())
+
+    async def _crawl(self):
+        loop = asyncio.get_running_loop()
+        in_flight = self.config.async_requests
+        downloader = AsyncDownloader(self.config, in_flight)
+        queue = asyncio.Queue(maxsize=in_flight)
+        with ThreadPoolExecutor(1) as dispatcher, ThreadPoolExecutor(4) as processors:
+            fetchers = [
+                asyncio.create_task(
+                    self._fetch(queue, downloader, processors))
+                for _ in range(in_flight)]
+            while True:
+                with METRICS.time("wait"):
+                    tbd_url = await loop.run_in_executor(
+                        dispatcher, self.frontier.get_tbd_url)
+                if not tbd_url:
+                    self.logger.info("Frontier is empty. Stopping Crawler.")
+                    break
+                await queue.put(tbd_url)
+            for _ in fetchers:
+                await queue.put(None)
+            await asyncio.gather(*fetchers)
+        await downloader.close()
+
+    async def _fetch(self, queue, downloader, processors):
+        loop = asyncio.get_running_loop()
+        while True:
+            tbd_url = await queue.get()
+            if tbd_url is None:
+                return
+            try:
+                with METRICS.time("download"):
+                    resp = await downloader.download(
+                        tbd_url, self.logger,
+                        self.frontier.get_validators(tbd_url))
+                await loop.run_in_executor(
+                    processors, self.process, tbd_url, resp)
+            except Exception:
+                # Release the url's host so the rest of the crawl can go on.
+                self.logger.exception(f"Failed to crawl {tbd_url}.")
+                self.frontier.mark_url_complete(tbd_url)
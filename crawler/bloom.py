@@ -0,0 +1,76 @@
+import os
+import math
+import struct
+
+
+class BloomFilter(object):
+    ''' Bloom filter over raw url digests.
+
+    The bit positions are derived from the digest itself (double hashing on
+    two 64 bit words), so no extra hashing is done per lookup. add() answers
+    whether the digest may have been added before: False means definitely
+    new, True means maybe seen. '''
+
+    HEADER = struct.Struct("<8sQQQ")
+    MAGIC = b"FRBLOOM1"
+
+    def __init__(self, capacity, error_rate):
+        self.capacity = capacity
+        self.size = max(8, int(-capacity * math.log(error_rate) / math.log(2) ** 2))
+        self.hashes = max(1, round(self.size / capacity * math.log(2)))
+        self.bits = bytearray((self.size + 7) // 8)
+        self.count = 0
+
+    def _positions(self, digest):
+        h1 = int.from_bytes(digest[:8], "little")
+        h2 = int.from_bytes(digest[8:16], "little") | 1
+        for i in range(self.hashes):
+            yield (h1 + i * h2) % self.size
+
+    def __contains__(self, digest):
+        bits = self.bits
+        return all(
+            bits[pos >> 3] & (1 << (pos & 7)) for pos in self._positions(digest))
+
+    def add(self, digest):
+        bits = self.bits
+        seen = True
+        for pos in self._positions(digest):
+            mask = 1 << (pos & 7)
+            if not bits[pos >> 3] & mask:
+                bits[pos >> 3] |= mask
+                seen = False
+        if not seen:
+            self.count += 1
+        return seen
+
+    def save(self, path, entries):
+        ''' Writes the filter to path atomically. entries is the number of
+        entries in the backing store it was built from, used by load to detect
+        a filter that is out of date. '''
+        tmp_path = f"{path}.tmp"
+        with open(tmp_path, "wb") as bloom_file:
+            bloom_file.write(self.HEADER.pack(
+                self.MAGIC, self.size, self.hashes, entries))
+            bloom_file.write(self.bits)
+        os.replace(tmp_path, path)
+
+    def load(self, path, entries):
+        ''' Loads the filter from path. Returns False if the file is missing
+        or does not match the current parameters or the backing store. '''
+        if not os.path.exists(path):
+            return False
+        with open(path, "rb") as bloom_file:
+            header = bloom_file.read(self.HEADER.size)
+            if len(header) < self.HEADER.size:
+                return False
+            magic, size, hashes, saved_entries = self.HEADER.unpack(header)
+            if (magic, size, hashes, saved_entries) != (
+                    self.MAGIC, self.size, self.hashes, entries):
+                return False
+            bits = bloom_file.read()
+        if len(bits) != len(self.bits):
+            return False
+        self.bits = bytearray(bits)
+        self.count = entries
+        return True
@@ -1,30 +1,139 @@
-import os
-import shelve
+import re
+import time
+import heapq
 
-from threading import Thread, RLock
-from queue import Queue, Empty
+from threading import Thread, RLock, Condition, Event
+from urllib.parse import urlparse
 
-from utils import get_logger, get_urlhash, normalize
+from utils import get_logger, get_urldigest
+from utils.canonical import canonicalize
+from crawler.storage import STORES, ShelveStore
+from crawler.bloom import BloomFilter
+from crawler.traps import TrapDetector
+from crawler.scoring import SCORERS
+from crawler.snapshot import save_snapshot, load_snapshot, remove_snapshot
+from crawler.graph import LinkGraph, get_graph_dir
+from crawler.health import HostHealth, is_failure, MAX_TRIPS
+from utils.robots import RobotsCache
+from utils.metrics import METRICS
+from utils.compact import UrlCodec, SCORE_SIZE, pack_score
 from scraper import is_valid
 
+# The netloc of an absolute url, as urlparse would split it, several times
+# faster.
+NETLOC = re.compile(r"[^:/?#]+://([^/?#]*)")
+
 class Frontier(object):
     def __init__(self, config, restart):
         self.logger = get_logger("FRONTIER")
         self.config = config
-        self.to_be_downloaded = list()
-        
-        if not os.path.exists(self.config.save_file) and not restart:
+
+        # Scheduling state, all guarded by self.lock.
+        #   host_queues: host -> heap of urls waiting to be downloaded,
+        #                lowest score first. Entries are the bytes of
+        #                self.urls.pack(score, sequence, url), which sort
+        #                like the tuple and cost a fraction of it.
+        #   ready_hosts: heap of (next allowed fetch time, host) for hosts
+        #                that have queued urls and no download in flight.
+        #   runnable_hosts: heap of (best queued score key, sequence, host) for
+        #                hosts whose politeness window has passed. Entries
+        #                whose score is no longer the host's best are stale
+        #                and skipped; runnable holds the hosts really in it.
+        #   busy_hosts: hosts with a download in flight. A host is only
+        #               rescheduled once its url is marked complete, so
+        #               each host is fetched by at most one worker at a time.
+        #   fetch_scores: url -> score for the urls being downloaded, used
+        #               to score the links found on them.
+        self.lock = RLock()
+        self.has_work = Condition(self.lock)
+        self.urls = UrlCodec()
+        self.host_queues = dict()
+        self.ready_hosts = list()
+        self.runnable_hosts = list()
+        self.runnable = set()
+        self.busy_hosts = dict()
+        self.next_fetch = dict()
+        self.fetch_scores = dict()
+        self.sequence = 0
+        self.scorer = SCORERS[self.config.scorer]()
+        self.tbd_count = 0
+        self.in_flight = 0
+        self.robots = None
+        if self.config.robots:
+            self.robots = RobotsCache(
+                self.config, self.logger, self.config.robots_cache_size,
+                self.config.robots_ttl)
+        self.robots_blocked = 0
+        self.traps_skipped = 0
+        # Failed downloads are retried with a backoff, and hosts that keep
+        # failing are parked by their circuit breaker. retries: url -> failed
+        # attempts so far, for the urls queued again.
+        self.health = HostHealth(
+            self.config.breaker_window, self.config.breaker_error_rate,
+            self.config.breaker_cooldown, self.config.retry_backoff,
+            self.logger)
+        self.retries = dict()
+        self.given_up = 0
+        METRICS.gauge(
+            "frontier_queued", "Urls waiting to be downloaded.",
+            lambda: self.tbd_count)
+        METRICS.gauge(
+            "frontier_in_flight", "Urls being downloaded or parsed.",
+            lambda: self.in_flight)
+        METRICS.gauge(
+            "frontier_hosts", "Hosts with queued urls.",
+            lambda: len(self.host_queues))
+        METRICS.gauge(
+            "frontier_polite_hosts",
+            "Hosts with queued urls waiting for their politeness window.",
+            lambda: len(self.ready_hosts))
+        METRICS.gauge(
+            "frontier_parked_hosts",
+            "Hosts parked by their circuit breaker.",
+            lambda: self.health.parked())
+
+        # Pending urls with their scores, written at checkpoints and when the
+        # crawl stops, so a resumed crawl loads its queue in one read.
+        self.snapshot_file = f"{self.config.save_file}.pending"
+        store = STORES[self.config.storage]
+        if not store.exists(self.config.save_file) and not restart:
             # Save file does not exist, but request to load save.
             self.logger.info(
                 f"Did not find save file {self.config.save_file}, "
                 f"starting from seed.")
-        elif os.path.exists(self.config.save_file) and restart:
+        elif store.exists(self.config.save_file) and restart:
             # Save file does exists, but request to start from seed.
             self.logger.info(
                 f"Found save file {self.config.save_file}, deleting it.")
-            os.remove(self.config.save_file)
+            store.remove(self.config.save_file)
+            TrapDetector.remove(f"{self.config.save_file}.traps")
+            ShelveStore.remove(f"{self.config.save_file}.validators")
+            remove_snapshot(self.snapshot_file)
         # Load existing save file, or create one if it does not exist.
-        self.save = shelve.open(self.config.save_file)
+        self.save = store(
+            self.config.save_file, self.config.save_batch,
+            self.config.save_interval, self.logger)
+        if self.config.recrawl and not restart:
+            self._reset_for_recrawl(store)
+        # ETag, Last-Modified and content hash of every downloaded page.
+        self.validators = ShelveStore(
+            f"{self.config.save_file}.validators", self.config.save_batch,
+            self.config.save_interval, self.logger)
+        self.unchanged_count = 0
+        self._load_seen_filter()
+        self.graph = None
+        if self.config.link_graph:
+            graph_dir = get_graph_dir(self.config.save_file)
+            if restart:
+                LinkGraph.remove(graph_dir)
+            self.graph = LinkGraph(
+                graph_dir, self.config.link_graph_chunk, self.logger)
+        self.traps = None
+        if self.config.traps:
+            self.traps = TrapDetector(
+                f"{self.config.save_file}.traps", self.logger,
+                self.config.trap_min_pages, self.config.trap_throttle_rate,
+                self.config.trap_drop_rate, self.config.trap_sample)
         if restart:
             for url in self.config.seed_urls:
                 self.add_url(url)
@@ -34,39 +143,447 @@ class Frontier(object):
             if not self.save:
                 for url in self.config.seed_urls:
                     self.add_url(url)
+        self.snapshots_stopped = Event()
+        self.snapshotter = None
+        if self.config.snapshot_interval > 0:
+            self.snapshotter = Thread(
+                target=self._snapshot_periodically, daemon=True)
+            self.snapshotter.start()
 
     def _parse_save_file(self):
         ''' This function can be overridden for alternate saving techniques. '''
+        if self._load_snapshot():
+            return
         total_count = len(self.save)
         tbd_count = 0
-        for url, completed in self.save.values():
-            if not completed and is_valid(url):
-                self.to_be_downloaded.append(url)
+        for url, score in self.save.pending():
+            if is_valid(url) and (not self.traps or self.traps.allows(url)):
+                if score is None:
+                    # Saved before urls had scores.
+                    score = self.scorer.score(url, None, None)
+                else:
+                    self.scorer.restore(url, score)
+                self._enqueue(url, score)
                 tbd_count += 1
         self.logger.info(
             f"Found {tbd_count} urls to be downloaded from {total_count} "
             f"total urls discovered.")
 
+    def _load_snapshot(self):
+        ''' Queues the pending urls of the last snapshot, if the save file did
+        not change since it was taken or the store can tell what changed.
+        Skips revalidating every saved url. Returns False if the save file
+        has to be walked instead. '''
+        snapshot = load_snapshot(self.snapshot_file)
+        if snapshot is None:
+            return False
+        stamp, entries = snapshot
+        if stamp != self.save.stamp():
+            changes = self.save.changes_since(stamp)
+            if changes is None:
+                self.logger.info(
+                    f"Snapshot {self.snapshot_file} is older than the save "
+                    f"file, reading the save file instead.")
+                return False
+            completed = set()
+            for urlhash, url, score in changes:
+                if url is None:
+                    completed.add(urlhash)
+                else:
+                    # Admitted by add_url under the same rules.
+                    entries.append((url, score))
+            if completed:
+                entries = [
+                    (url, score) for url, score in entries
+                    if get_urldigest(url) not in completed]
+            self.logger.info(
+                f"Applied {len(changes)} changes saved after snapshot "
+                f"{self.snapshot_file}.")
+        self._enqueue_all(entries)
+        self.logger.info(
+            f"Found {len(entries)} urls to be downloaded in snapshot "
+            f"{self.snapshot_file}, from {len(self.save)} total urls "
+            f"discovered.")
+        return True
+
+    def _write_snapshot(self):
+        with self.lock:
+            stamp = self.save.stamp()
+            queued = [entry for queue in self.host_queues.values() for entry in queue]
+            in_flight = [
+                (url, self.fetch_scores[url]) for url in self.busy_hosts.values()
+                if self.fetch_scores.get(url) is not None]
+        # Decoded and written without the lock: the entries are immutable
+        # and the codec only ever adds prefixes.
+        entries = in_flight
+        for entry in queued:
+            score, url = self.urls.unpack(entry)
+            entries.append((url, score))
+        save_snapshot(self.snapshot_file, stamp, entries)
+
+    def _snapshot_periodically(self):
+        while not self.snapshots_stopped.wait(self.config.snapshot_interval):
+            try:
+                self._write_snapshot()
+            except Exception as e:
+                self.logger.error(f"Could not write {self.snapshot_file}: {e}")
+
+    def _reset_for_recrawl(self, store):
+        ''' Makes every saved url pending again, keeping its score. Pages that
+        did not change since they were saved are skipped by the workers, and
+        the links of the others were saved already. '''
+        entries = list(self.save.entries())
+        self.save.close()
+        store.remove(self.config.save_file)
+        self.save = store(
+            self.config.save_file, self.config.save_batch,
+            self.config.save_interval, self.logger)
+        for url, score in entries:
+            self.save[get_urldigest(url)] = (
+                (url, False) if score is None else (url, False, score))
+        self.save.flush()
+        remove_snapshot(self.snapshot_file)
+        self.logger.info(f"Recrawling {len(entries)} saved urls.")
+
+    def _load_seen_filter(self):
+        # The seen filter answers "definitely new" without touching the save
+        # file; only "maybe seen" answers are checked against it.
+        self.seen = BloomFilter(
+            self.config.bloom_capacity, self.config.bloom_error_rate)
+        self.seen_file = f"{self.config.save_file}.bloom"
+        self.seen_new = self.seen_hits = self.seen_false_positives = 0
+        if not self.seen.load(self.seen_file, len(self.save)):
+            for urlhash in self.save.digests():
+                self.seen.add(urlhash)
+            self.logger.info(
+                f"Rebuilt seen filter from {self.seen.count} saved urls.")
+
+    def _log_seen_filter(self):
+        self.logger.info(
+            f"Seen filter: {self.seen_new} definitely new, "
+            f"{self.seen_hits} seen, {self.seen_false_positives} false "
+            f"positives, {self.seen.count} urls in filter, "
+            f"{self.robots_blocked} disallowed by robots.txt, "
+            f"{self.unchanged_count} unchanged pages, "
+            f"{len(self.retries)} urls waiting for a retry, "
+            f"{self.given_up} given up on, {self.health.trips} circuit "
+            f"breaker trips.")
+        if self.traps:
+            self.logger.info(
+                f"Trap detector: {self.traps.blocked} urls not admitted, "
+                f"{self.traps_skipped} queued urls skipped, "
+                f"{len(self.traps.states)} templates or hosts throttled or "
+                f"dropped.")
+        if self.seen.count > self.seen.capacity:
+            self.logger.warning(
+                f"Seen filter holds {self.seen.count} urls, more than its "
+                f"capacity of {self.seen.capacity}. Raise BLOOMCAPACITY.")
+
+    @staticmethod
+    def _get_host(url):
+        match = NETLOC.match(url)
+        return match.group(1).lower() if match else ""
+
+    def _next_sequence(self):
+        self.sequence += 1
+        return self.sequence
+
+    def _enqueue(self, url, score):
+        host = self._get_host(url)
+        with self.lock:
+            queue = self.host_queues.get(host)
+            if queue is None:
+                queue = self.host_queues[host] = list()
+            was_empty = not queue
+            heapq.heappush(
+                queue, self.urls.pack(score, self._next_sequence(), url))
+            self.tbd_count += 1
+            if host in self.busy_hosts:
+                return
+            if was_empty:
+                # Host was idle, make it eligible for scheduling again.
+                heapq.heappush(
+                    self.ready_hosts, (self.next_fetch.get(host, 0), host))
+                self.has_work.notify()
+            elif (host in self.runnable
+                    and queue[0][:SCORE_SIZE] == pack_score(score)):
+                # The host's best score improved.
+                self._push_runnable(host)
+
+    def _enqueue_all(self, entries):
+        ''' Queues (url, score) entries in bulk, with one heapify per host
+        instead of a push per url. Only for a frontier with nothing queued
+        yet. '''
+        with self.lock:
+            for url, score in entries:
+                if score is None:
+                    # Saved before urls had scores.
+                    score = self.scorer.score(url, None, None)
+                else:
+                    self.scorer.restore(url, score)
+                host = self._get_host(url)
+                queue = self.host_queues.get(host)
+                if queue is None:
+                    queue = self.host_queues[host] = list()
+                queue.append(self.urls.pack(score, self._next_sequence(), url))
+            for host, queue in self.host_queues.items():
+                heapq.heapify(queue)
+                self.ready_hosts.append((self.next_fetch.get(host, 0), host))
+            heapq.heapify(self.ready_hosts)
+            self.tbd_count += len(entries)
+            self.has_work.notify_all()
+
+    def _push_runnable(self, host):
+        self.runnable.add(host)
+        heapq.heappush(
+            self.runnable_hosts,
+            (self.host_queues[host][0][:SCORE_SIZE], self._next_sequence(),
+             host))
+        self.has_work.notify()
+
+    def _pop_runnable(self):
+        ''' Takes the runnable host with the best queued url, or returns None. '''
+        now = time.monotonic()
+        while self.ready_hosts and self.ready_hosts[0][0] <= now:
+            _, host = heapq.heappop(self.ready_hosts)
+            self._push_runnable(host)
+        while self.runnable_hosts:
+            key, _, host = heapq.heappop(self.runnable_hosts)
+            if (host in self.runnable
+                    and self.host_queues[host][0][:SCORE_SIZE] == key):
+                self.runnable.discard(host)
+                return host
+        return None
+
     def get_tbd_url(self):
-        try:
-            return self.to_be_downloaded.pop()
-        except IndexError:
+        ''' Blocks until a url whose host is outside its politeness window is
+        available, and returns the best scored one of those. Returns None once
+        nothing is queued or being downloaded. '''
+        with self.lock:
+            while True:
+                host = self._pop_runnable()
+                if host is not None:
+                    queue = self.host_queues[host]
+                    score, url = self.urls.unpack(heapq.heappop(queue))
+                    self.tbd_count -= 1
+                    if self.traps and not self.traps.allows(url):
+                        # Dropped after it was queued, never fetch it.
+                        self.save[get_urldigest(url)] = (url, True)
+                        self.traps_skipped += 1
+                        self.retries.pop(url, None)
+                        if queue:
+                            self._push_runnable(host)
+                        else:
+                            del self.host_queues[host]
+                        continue
+                    self.in_flight += 1
+                    self.busy_hosts[host] = url
+                    self.fetch_scores[url] = score
+                    return url
+                if self.ready_hosts:
+                    self.has_work.wait(self.ready_hosts[0][0] - time.monotonic())
+                elif self.in_flight:
+                    # Downloads in flight may still discover new urls.
+                    self.has_work.wait()
+                elif self._finished():
+                    self.has_work.notify_all()
+                    return None
+                else:
+                    # Urls may still come from elsewhere (another shard).
+                    self.has_work.wait(self.config.spool_interval)
+
+    def _finished(self):
+        ''' Called with the lock held once nothing is queued or being
+        downloaded. Returns whether the crawl is over. '''
+        return True
+
+    def add_url(self, url, parent=None, page=None, score=None):
+        ''' Adds url if it has not been seen. parent is the url it was found
+        on, as returned by get_tbd_url, and page the parent's
+        scraper.PageResult; both are used to score url. A given score is
+        used instead of asking the scorer, for urls scored elsewhere. '''
+        url = canonicalize(url)
+        self._record_link(parent, url)
+        urlhash = get_urldigest(url)
+        rules = None
+        while True:
+            with self.lock:
+                maybe_seen = urlhash in self.seen
+                if maybe_seen and urlhash in self.save:
+                    self.seen_hits += 1
+                    return
+                allowed = True
+                if rules is not None:
+                    allowed = rules.can_fetch(self.config.user_agent, url)
+                elif self.robots:
+                    # Only answers from cached rules while holding the lock.
+                    allowed = self.robots.allowed(url, fetch=False)
+                if allowed is not None:
+                    if maybe_seen:
+                        self.seen_false_positives += 1
+                    else:
+                        self.seen_new += 1
+                    if not allowed:
+                        self.robots_blocked += 1
+                        return
+                    if self.traps and not self.traps.admit(url):
+                        return
+                    if score is None:
+                        score = self.scorer.score(
+                            url, self.fetch_scores.get(parent), page)
+                    else:
+                        self.scorer.restore(url, score)
+                    self.seen.add(urlhash)
+                    self.save[urlhash] = (url, False, score)
+                    self._enqueue(url, score)
+                    if (self.seen_new + self.seen_false_positives) % 10000 == 0:
+                        self._log_seen_filter()
+                    return
+            # The host's robots.txt is not cached. Fetch it without holding
+            # the lock, then check the url again against the rules fetched,
+            # which may already have left the cache (ROBOTSTTL = 0, or
+            # evicted by other hosts).
+            parsed = urlparse(url)
+            with METRICS.time("robots"):
+                rules = self.robots.fetch(parsed.scheme, parsed.netloc.lower())
+
+    def _record_link(self, parent, url):
+        if self.graph is not None and parent is not None:
+            self.graph.add_link(parent, url)
+
+    def mark_url_complete(self, url, page=None, validators=None):
+        ''' page is the url's scraper.PageResult, if it was parsed. It is
+        fed back to the trap detector. validators are the page's, from
+        page.validators, saved only now that its links are in the frontier
+        so a crash before this leaves it to be downloaded in full again. '''
+        urlhash = get_urldigest(url)
+        with self.lock:
+            if urlhash not in self.save:
+                # This should not happen.
+                self.logger.error(
+                    f"Completed url {url}, but have not seen it before.")
+
+            # Keep the score, a recrawl queues the url again with it.
+            score = self.fetch_scores.pop(url, None)
+            self.save[urlhash] = (
+                (url, True) if score is None else (url, True, score))
+            if validators is not None:
+                self.validators[urlhash] = validators
+            host = self._get_host(url)
+            if self.busy_hosts.get(host) == url:
+                # Not if url was completed already, and its host is busy
+                # with another url.
+                self._release_host(host)
+        if self.traps and self.traps.record(url, page):
+            # Save decisions as soon as they are made.
+            self.traps.save()
+        if self.graph is not None and page is not None:
+            self.graph.add_visit(url)
+
+    def retry_failed(self, url, resp):
+        ''' Records the outcome of url's download with its host's health. If
+        it failed in a way worth retrying (see crawler.health.is_failure)
+        and has retries left, queues url again and holds its host back for
+        the backoff, and returns True: url is not complete. '''
+        host = self._get_host(url)
+        with self.lock:
+            if self.health.record(host, resp.status):
+                METRICS.count("breaker_trips", host)
+                if self.health.dead(host):
+                    self._drop_host_queue(host)
+            if not is_failure(resp.status):
+                self.retries.pop(url, None)
+                return False
+            attempt = self.retries.pop(url, 0) + 1
+            if attempt > self.config.max_retries or self.health.dead(host):
+                self.given_up += 1
+                self.logger.info(
+                    f"Giving up on {url} after {attempt} attempts, status "
+                    f"<{resp.status}>.")
+                return False
+            self.retries[url] = attempt
+            score = self.fetch_scores.pop(url, None)
+            if score is None:
+                score = self.scorer.score(url, None, None)
+            self._enqueue(url, score)
+            self._release_host(host, self.health.retry_delay(attempt))
+        METRICS.count("retries", host)
+        return True
+
+    def _drop_host_queue(self, host):
+        ''' Gives up on every url queued for host, which is being downloaded
+        from, so it is in none of the scheduling heaps. '''
+        queue = self.host_queues.get(host, ())
+        for entry in queue:
+            score, url = self.urls.unpack(entry)
+            self.save[get_urldigest(url)] = (url, True, score)
+            self.retries.pop(url, None)
+        self.logger.warning(
+            f"Giving up on {host} after {MAX_TRIPS} circuit breaker trips "
+            f"in a row, dropped {len(queue)} queued urls.")
+        self.tbd_count -= len(queue)
+        self.given_up += len(queue)
+        self.host_queues[host] = list()
+
+    def get_validators(self, url):
+        ''' (ETag, Last-Modified, content hash) of url from its last download,
+        or None. Only a recrawl uses them. '''
+        if not self.config.recrawl:
+            return None
+        urlhash = get_urldigest(url)
+        if urlhash not in self.validators:
             return None
+        return self.validators[urlhash]
 
-    def add_url(self, url):
-        url = normalize(url)
-        urlhash = get_urlhash(url)
-        if urlhash not in self.save:
-            self.save[urlhash] = (url, False)
-            self.save.sync()
-            self.to_be_downloaded.append(url)
-    
-    def mark_url_complete(self, url):
-        urlhash = get_urlhash(url)
-        if urlhash not in self.save:
-            # This should not happen.
-            self.logger.error(
-                f"Completed url {url}, but have not seen it before.")
-
-        self.save[urlhash] = (url, True)
-        self.save.sync()
+    def unchanged(self, url, status, validators=None):
+        ''' Whether a recrawled page is the same as at its previous download:
+        status is that of the download, validators those of its parsed page
+        (scraper.PageResult.validators). Always False outside a recrawl. '''
+        if not self.config.recrawl:
+            return False
+        old = self.get_validators(url)
+        if status == 304:
+            changed = old is None
+        elif validators is None:
+            return False
+        else:
+            changed = old is None or old[2] != validators[2]
+        if not changed:
+            with self.lock:
+                self.unchanged_count += 1
+        return not changed
+
+    def close(self):
+        ''' Flushes buffered progress to the save file. '''
+        if self.snapshotter:
+            self.snapshots_stopped.set()
+            self.snapshotter.join()
+        with self.lock:
+            self._log_seen_filter()
+            self.seen.save(self.seen_file, len(self.save))
+            if self.traps:
+                self.traps.save()
+            self._write_snapshot()
+            self.save.close()
+            if self.graph is not None:
+                self.graph.close()
+            self.validators.close()
+
+    def _release_host(self, host, backoff=0):
+        if self.busy_hosts.pop(host, None) is None:
+            return
+        self.in_flight -= 1
+        # The politeness window starts when the download finished, and is
+        # stretched to the host's robots.txt Crawl-delay if it has one, the
+        # backoff of a retry, or the cooldown of its circuit breaker.
+        delay = max(
+            self.config.time_delay, backoff, self.health.parked_for(host))
+        if self.robots:
+            delay = max(delay, self.robots.crawl_delay(host) or 0)
+        ready_at = time.monotonic() + delay
+        self.next_fetch[host] = ready_at
+        if self.host_queues[host]:
+            heapq.heappush(self.ready_hosts, (ready_at, host))
+        else:
+            del self.host_queues[host]
+        self.has_work.notify_all()
@@ -0,0 +1,136 @@
+import os
+import sys
+import shutil
+import struct
+
+from array import array
+from hashlib import blake2b
+from threading import Lock
+
+from utils.compact import DigestSet
+
+# Magic, then the number of edges, visits and nodes in the chunk.
+HEADER = struct.Struct("<8sQQQ")
+MAGIC = b"LGCHNK01"
+SWAP = sys.byteorder != "little"
+
+
+def get_graph_dir(save_file):
+    return f"{save_file}.graph"
+
+
+class LinkGraph(object):
+    ''' Records the links the crawl follows as a graph of integer node ids,
+    in append-only chunk files in path:
+
+        hosts.txt            one host per line, referred to by line number
+        chunk-<n>.bin        HEADER, then fixed width little endian columns:
+                               src, dst   uint64 x edges   link src -> dst
+                               visits     uint64 x visits  pages downloaded
+                               ids        uint64 x nodes   nodes first seen
+                               hosts      uint32 x nodes   their host
+                               lengths    uint32 x nodes   utf-8 url lengths
+                             and the urls of the new nodes, concatenated
+
+    A node's id is the first 8 bytes of the blake2b digest of its url, so
+    every process (and shard) gives a url the same id without sharing a
+    table. The columns can be mapped straight into arrays (numpy.frombuffer),
+    see analysis/linkgraph.py. A chunk is written, under a temporary name
+    and renamed, once chunk_size edges are buffered and when the graph is
+    closed; a crash loses at most the edges of one chunk. Nodes are written
+    once per process, so a resumed crawl may write a node again. '''
+
+    def __init__(self, path, chunk_size, logger):
+        self.path = path
+        self.chunk_size = chunk_size
+        self.logger = logger
+        self.lock = Lock()
+        os.makedirs(path, exist_ok=True)
+        self.hosts_file = os.path.join(path, "hosts.txt")
+        self.hosts = dict()
+        if os.path.exists(self.hosts_file):
+            with open(self.hosts_file, encoding="utf-8") as hosts_file:
+                for line in hosts_file:
+                    self.hosts[line.rstrip("\n")] = len(self.hosts)
+        self.new_hosts = list()
+        self.chunks = sum(
+            1 for name in os.listdir(path)
+            if name.startswith("chunk-") and name.endswith(".bin"))
+        self.seen = DigestSet(8)
+        self._reset()
+
+    @staticmethod
+    def remove(path):
+        if os.path.exists(path):
+            shutil.rmtree(path)
+
+    def _reset(self):
+        self.src = array("Q")
+        self.dst = array("Q")
+        self.visits = array("Q")
+        self.node_ids = array("Q")
+        self.node_hosts = array("I")
+        self.node_lengths = array("I")
+        self.node_urls = list()
+
+    def _node(self, url):
+        ''' The id of url, added to the chunk's nodes if it is new. '''
+        digest = blake2b(url.encode("utf-8"), digest_size=8).digest()
+        url_id = int.from_bytes(digest, "little")
+        if self.seen.add(digest):
+            start = url.find("://")
+            host = url[start + 3:].split("/", 1)[0].split("?", 1)[0].lower()
+            host_index = self.hosts.get(host)
+            if host_index is None:
+                host_index = self.hosts[host] = len(self.hosts)
+                self.new_hosts.append(host)
+            encoded = url.encode("utf-8")
+            self.node_ids.append(url_id)
+            self.node_hosts.append(host_index)
+            self.node_lengths.append(len(encoded))
+            self.node_urls.append(encoded)
+        return url_id
+
+    def add_link(self, src, dst):
+        with self.lock:
+            self.src.append(self._node(src))
+            self.dst.append(self._node(dst))
+            if len(self.src) >= self.chunk_size:
+                self._write_chunk()
+
+    def add_visit(self, url):
+        ''' Records that url was downloaded, so pages without links in or
+        out are in the graph too. '''
+        with self.lock:
+            self.visits.append(self._node(url))
+
+    def _write_chunk(self):
+        if not (self.src or self.visits or self.node_ids):
+            return
+        if self.new_hosts:
+            # Before the chunk that refers to them.
+            with open(self.hosts_file, "a", encoding="utf-8") as hosts_file:
+                hosts_file.write("".join(f"{host}\n" for host in self.new_hosts))
+            self.new_hosts = list()
+        path = os.path.join(self.path, f"chunk-{self.chunks:06d}.bin")
+        with open(f"{path}.tmp", "wb") as chunk_file:
+            chunk_file.write(HEADER.pack(
+                MAGIC, len(self.src), len(self.visits), len(self.node_ids)))
+            for column in (
+                    self.src, self.dst, self.visits, self.node_ids,
+                    self.node_hosts, self.node_lengths):
+                if SWAP:
+                    column = array(column.typecode, column)
+                    column.byteswap()
+                chunk_file.write(column.tobytes())
+            chunk_file.write(b"".join(self.node_urls))
+        os.replace(f"{path}.tmp", path)
+        self.chunks += 1
+        self._reset()
+
+    def close(self):
+        with self.lock:
+            self._write_chunk()
+            self.logger.info(
+                f"Link graph: {self.chunks} chunks, {len(self.seen)} nodes "
+                f"seen by this process, {len(self.hosts)} hosts in {self.path}.")
@@ -0,0 +1,129 @@
+import time
+
+from collections import deque
+
+from utils.download import TIMED_OUT
+
+# How much longer a host is parked each time its breaker trips again right
+# after a cooldown, at most.
+MAX_COOLDOWN_FACTOR = 16
+# Breaker trips in a row after which a host is given up on.
+MAX_TRIPS = 5
+
+
+def is_failure(status):
+    ''' Whether a download with this status failed in a way that may go away
+    if it is tried again later: timeouts, rate limiting, server errors and
+    the cache server not answering. Cache server errors (600-608) and other
+    4xx are final. '''
+    return status in (408, 429) or (500 <= status < 600 and status not in (501, 505))
+
+
+def is_timeout(status):
+    return status in (408, TIMED_OUT)
+
+
+class HostState(object):
+    __slots__ = ("outcomes", "timeouts", "trips", "parked_until", "probing")
+
+    def __init__(self, window):
+        self.outcomes = deque(maxlen=window) # True for each failed download
+        self.timeouts = 0 # consecutive
+        self.trips = 0 # consecutive, reset by a successful probe
+        self.parked_until = 0
+        self.probing = False
+
+
+class HostHealth(object):
+    ''' Outcome of the recent downloads of every host, and a circuit breaker
+    per host.
+
+    A host's breaker trips (opens) once error_rate of its last window
+    downloads failed, with at least a quarter of the window seen, or after
+    max_timeouts timeouts in a row. The frontier then parks the host's queue
+    for cooldown seconds, doubled every time the breaker trips again, up to
+    MAX_COOLDOWN_FACTOR times. When the cooldown is over the breaker is half
+    open: the next download of the host is a probe, which closes the breaker
+    if it succeeds and trips it again if it fails. After MAX_TRIPS trips in a
+    row the host is dead, and the frontier drops what it has queued for it.
+
+    Retries of a failed url wait backoff * 2 ** (attempt - 1) seconds, at
+    most cooldown. Not thread safe, used under the frontier's lock. '''
+
+    def __init__(self, window, error_rate, cooldown, backoff, logger,
+                 max_timeouts=3):
+        self.window = max(1, window)
+        self.error_rate = error_rate
+        self.cooldown = cooldown
+        self.backoff = backoff
+        self.logger = logger
+        self.max_timeouts = max_timeouts
+        self.min_samples = min(self.window, max(3, self.window // 4))
+        self.states = dict()
+        self.trips = 0
+
+    def record(self, host, status):
+        ''' Records a download of host. Returns whether it tripped the
+        host's breaker. '''
+        failed = is_failure(status)
+        state = self.states.get(host)
+        if state is None:
+            if not failed:
+                # Healthy hosts are not tracked until they fail.
+                return False
+            state = self.states[host] = HostState(self.window)
+        state.outcomes.append(failed)
+        state.timeouts = state.timeouts + 1 if is_timeout(status) else 0
+        if state.probing:
+            state.probing = False
+            if not failed:
+                self.logger.info(f"Circuit breaker of {host} closed.")
+                del self.states[host]
+                return False
+            return self._trip(host, state, "probe failed")
+        if not failed:
+            if not any(state.outcomes):
+                del self.states[host]
+            return False
+        failures = sum(state.outcomes)
+        if state.timeouts >= self.max_timeouts:
+            return self._trip(host, state, f"{state.timeouts} timeouts in a row")
+        if (len(state.outcomes) >= self.min_samples
+                and failures >= self.error_rate * len(state.outcomes)):
+            return self._trip(
+                host, state,
+                f"{failures} of its last {len(state.outcomes)} downloads failed")
+        return False
+
+    def _trip(self, host, state, reason):
+        cooldown = self.cooldown * min(2 ** state.trips, MAX_COOLDOWN_FACTOR)
+        state.trips += 1
+        state.parked_until = time.monotonic() + cooldown
+        state.probing = True
+        state.outcomes.clear()
+        state.timeouts = 0
+        self.trips += 1
+        self.logger.warning(
+            f"Circuit breaker of {host} open, {reason}. Parked for "
+            f"{cooldown:.0f}s.")
+        return True
+
+    def dead(self, host):
+        state = self.states.get(host)
+        return state is not None and state.trips >= MAX_TRIPS
+
+    def parked_for(self, host):
+        ''' Seconds until host's breaker is half open, 0 if it is closed. '''
+        state = self.states.get(host)
+        if state is None:
+            return 0
+        return max(0, state.parked_until - time.monotonic())
+
+    def parked(self):
+        now = time.monotonic()
+        return sum(
+            1 for state in list(self.states.values())
+            if state.parked_until > now)
+
+    def retry_delay(self, attempt):
+        return min(self.backoff * 2 ** (attempt - 1), self.cooldown)
@@ -0,0 +1,90 @@
+import time
+
+from concurrent.futures import ProcessPoolExecutor
+from functools import partial
+from multiprocessing import get_context
+from threading import BoundedSemaphore, Lock
+
+import scraper
+from utils import get_logger
+from utils.metrics import METRICS
+
+
+def parse(url, resp):
+    ''' Runs in a parser process: everything CPU bound about a page.
+    Returns the page and the seconds spent parsing it and filtering its
+    links, which are recorded in the crawler process. '''
+    start = time.perf_counter()
+    page = scraper.parse_page(url, resp)
+    parsed = time.perf_counter()
+    if page is not None:
+        page.links = [link for link in page.links if scraper.is_valid(link)]
+    return page, parsed - start, time.perf_counter() - parsed
+
+
+class ParsePipeline(object):
+    ''' Parses downloaded pages in a pool of processes.
+
+    Fetching workers submit (url, Response) pairs and go back to fetching.
+    At most config.parser_backlog pages are queued or being parsed; submit
+    blocks once the backlog is full, which throttles the fetchers. Parsed
+    pages are recorded in the report and their links added to the frontier
+    from the pool's result thread, then the url is marked complete. '''
+
+    def __init__(self, config, frontier):
+        self.logger = get_logger("PARSER")
+        self.frontier = frontier
+        self.backlog = BoundedSemaphore(config.parser_backlog)
+        self.pending_lock = Lock()
+        self.pending = 0
+        METRICS.gauge(
+            "parser_backlog", "Pages queued or being parsed.",
+            lambda: self.pending)
+        # Workers are threads, so the parser processes are spawned rather
+        # than forked from a multi-threaded process.
+        self.executor = ProcessPoolExecutor(
+            config.parser_processes, mp_context=get_context("spawn"),
+            initializer=scraper.configure, initargs=(config,))
+
+    def submit(self, url, resp):
+        self.backlog.acquire()
+        try:
+            future = self.executor.submit(parse, url, resp)
+        except BaseException:
+            self.backlog.release()
+            raise
+        with self.pending_lock:
+            self.pending += 1
+        future.add_done_callback(partial(self._done, url, resp.status))
+
+    def _done(self, url, status, future):
+        page = validators = None
+        try:
+            page, parse_seconds, filter_seconds = future.result()
+            METRICS.observe("parse", parse_seconds)
+            METRICS.observe("is_valid", filter_seconds)
+            if page is not None and self.frontier.unchanged(
+                    url, status, page.validators):
+                # Same content as at the last crawl.
+                page = None
+            else:
+                with METRICS.time("record"):
+                    scraped_urls = scraper.record_page(page)
+                with METRICS.time("add_url"):
+                    for scraped_url in scraped_urls:
+                        self.frontier.add_url(scraped_url, url, page)
+                # Only saved once the links are added, so after a failure
+                # the next recrawl downloads the page in full.
+                validators = page.validators if page is not None else None
+        except Exception:
+            self.logger.exception(f"Failed to parse {url}.")
+        finally:
+            with METRICS.time("mark_complete"):
+                self.frontier.mark_url_complete(url, page, validators)
+            scraper.page_completed(page)
+            with self.pending_lock:
+                self.pending -= 1
+            self.backlog.release()
+
+    def close(self):
+        self.executor.shutdown(wait=True)
@@ -0,0 +1,67 @@
+from urllib.parse import urlparse
+
+
+class Scorer(object):
+    ''' Orders the frontier. Urls with a lower score are downloaded first.
+
+    score is called once for every url admitted to the frontier, with the
+    frontier lock held. parent_score and page describe the page the url was
+    found on: its score and its scraper.PageResult. Both are None for seed
+    urls, and page is None for urls restored from a save file that was
+    written without scores. '''
+
+    def score(self, url, parent_score, page):
+        raise NotImplementedError
+
+    def restore(self, url, score):
+        ''' Called for every pending url reloaded from the save file with its
+        saved score, so scorers with state can rebuild it. '''
+        pass
+
+
+class DepthScorer(Scorer):
+    ''' Breadth first: the score is the number of links from a seed. '''
+
+    def score(self, url, parent_score, page):
+        return 0 if parent_score is None else parent_score + 1
+
+
+class FairnessScorer(Scorer):
+    ''' Spreads the crawl over hosts: the score is the number of urls already
+    admitted for the url's host, so hosts with few pages go first. '''
+
+    def __init__(self):
+        self.host_counts = dict()
+
+    def score(self, url, parent_score, page):
+        host = urlparse(url).netloc.lower()
+        count = self.host_counts.get(host, 0)
+        self.host_counts[host] = count + 1
+        return count
+
+    def restore(self, url, score):
+        host = urlparse(url).netloc.lower()
+        self.host_counts[host] = max(self.host_counts.get(host, 0), score + 1)
+
+
+class QualityScorer(Scorer):
+    ''' Depth weighted by the quality of the parent page. A link costs 1 from
+    a page with at least RICH_WORDS words, and up to 3 from a page with
+    little or no text, so links on content pages are followed first. '''
+
+    RICH_WORDS = 1000
+
+    def score(self, url, parent_score, page):
+        if parent_score is None:
+            return 0
+        if page is None or page.low_text:
+            return parent_score + 3
+        words = sum(page.word_frequencies.values())
+        return parent_score + 1 + 2 * max(0, 1 - words / self.RICH_WORDS)
+
+
+SCORERS = {
+    "depth": DepthScorer,
+    "fairness": FairnessScorer,
+    "quality": QualityScorer,
+}
@@ -0,0 +1,299 @@
+import os
+import time
+import shutil
+
+from hashlib import blake2b
+from threading import Thread, Event
+
+import utils
+from utils.canonical import canonicalize
+from utils.compact import DigestSet
+from utils.metrics import METRICS
+from crawler.frontier import Frontier
+from crawler.archive import get_archive_dir
+
+
+def get_shard(host, shards):
+    ''' The shard that owns host. All urls of a host belong to one shard,
+    so its politeness window is kept by a single process. '''
+    digest = blake2b(host.encode("utf-8"), digest_size=8).digest()
+    return int.from_bytes(digest, "little") % shards
+
+
+def get_spool_dir(save_file):
+    return f"{save_file}.spool"
+
+
+def get_shard_save_file(save_file, shard):
+    return f"{save_file}.shard{shard}"
+
+
+def configure_shard(config, shard):
+    ''' Makes config the config of one shard of config.shards: its own save
+    file (and with it its own stats, bloom, traps and validators files),
+    report, logs, archive and metrics port, and the spool directory shared
+    by all shards. Call before anything is created from config. '''
+    config.shard = shard
+    config.spool_dir = get_spool_dir(config.save_file)
+    config.save_file = get_shard_save_file(config.save_file, shard)
+    if config.archive:
+        # A replay reads every shard's archive.
+        config.archive_dir = get_archive_dir(config.archive_dir, shard)
+    if config.metrics_port:
+        config.metrics_port += shard
+    utils.LOG_DIR = os.path.join(utils.LOG_DIR, f"shard{shard}")
+
+
+class Spool(object):
+    ''' Shared directory through which shards hand each other urls.
+
+        <path>/<shard>/<sender>-<time>-<n>.urls   batches of "score<TAB>url"
+                                                  lines for shard to admit
+        <path>/state.<shard>                      "<idle> <run> <version>"
+        <path>/done                               written once all shards
+                                                  are done
+
+    Batches are written under a temporary name and renamed, so readers only
+    see complete files. A shard writes its state whenever it goes from busy
+    to idle or back, and goes busy before it deletes a batch it admitted
+    urls from. So the crawl is over once every shard is idle and no batch is
+    waiting, and no state changed while that was checked. '''
+
+    def __init__(self, path, shard, shards):
+        self.path = path
+        self.shard = shard
+        self.shards = shards
+        self.inbox_dir = os.path.join(path, str(shard))
+        for i in range(shards):
+            os.makedirs(os.path.join(path, str(i)), exist_ok=True)
+        self.state_file = os.path.join(path, f"state.{shard}")
+        self.done_file = os.path.join(path, "done")
+        # A new run id on every start, so a restarted shard never looks
+        # unchanged to a check that began before the restart.
+        self.run = os.urandom(4).hex()
+        self.version = 0
+        self.sent = 0
+
+    @staticmethod
+    def reset(path):
+        ''' Removes the states and done marker of an earlier crawl, keeping
+        waiting batches. '''
+        if not os.path.exists(path):
+            return
+        for name in os.listdir(path):
+            if name.startswith("state.") or name == "done":
+                os.remove(os.path.join(path, name))
+
+    @staticmethod
+    def remove(path):
+        if os.path.exists(path):
+            shutil.rmtree(path)
+
+    def _write(self, path, data):
+        tmp_path = f"{path}.{self.shard}.tmp"
+        with open(tmp_path, "w", encoding="utf-8") as spool_file:
+            spool_file.write(data)
+        os.replace(tmp_path, path)
+
+    def send(self, shard, entries):
+        ''' Writes a batch of (url, score) for shard. '''
+        self.sent += 1
+        name = f"{self.shard}-{time.time_ns()}-{self.sent}.urls"
+        self._write(
+            os.path.join(self.path, str(shard), name),
+            "".join(f"{score!r}\t{url}\n" for url, score in entries))
+
+    def inbox(self):
+        ''' Paths of the batches waiting for this shard, oldest first. '''
+        return [
+            os.path.join(self.inbox_dir, name)
+            for name in sorted(os.listdir(self.inbox_dir))
+            if name.endswith(".urls")]
+
+    @staticmethod
+    def read(path):
+        ''' The (url, score) entries of a batch, or an empty list if another
+        thread took it already. '''
+        try:
+            with open(path, encoding="utf-8") as spool_file:
+                lines = spool_file.read().splitlines()
+        except FileNotFoundError:
+            return list()
+        entries = list()
+        for line in lines:
+            score, _, url = line.partition("\t")
+            entries.append((url, float(score)))
+        return entries
+
+    @staticmethod
+    def delete(path):
+        try:
+            os.remove(path)
+        except FileNotFoundError:
+            pass
+
+    def set_state(self, idle):
+        self.version += 1
+        self._write(self.state_file, f"{int(idle)} {self.run} {self.version}")
+
+    def _read_states(self):
+        states = list()
+        for i in range(self.shards):
+            try:
+                with open(os.path.join(self.path, f"state.{i}")) as state_file:
+                    states.append(state_file.read())
+            except FileNotFoundError:
+                # Not started yet.
+                return None
+        return states
+
+    def _in_transit(self):
+        return any(
+            name.endswith(".urls")
+            for i in range(self.shards)
+            for name in os.listdir(os.path.join(self.path, str(i))))
+
+    def finished(self):
+        ''' Whether every shard is done. Called by an idle shard. '''
+        if os.path.exists(self.done_file):
+            return True
+        states = self._read_states()
+        if states is None or not all(state.startswith("1 ") for state in states):
+            return False
+        if self._in_transit() or self._read_states() != states:
+            return False
+        self._write(self.done_file, f"{self.shard}")
+        return True
+
+
+class ShardedFrontier(Frontier):
+    ''' The frontier of one shard of a crawl split over config.shards
+    processes by get_shard of the url's host.
+
+    Urls of hosts this shard owns go through Frontier.add_url. The others
+    are scored here, collected per owner, and written to the spool in
+    batches of config.spool_batch urls, or every config.spool_interval
+    seconds by the exchange thread, which also admits the batches other
+    shards sent. Each url is forwarded once, tracked by an 8 byte digest
+    in a DigestSet (it is forwarded again after a resume), and the owner
+    dedups forwarded urls with its own seen filter.
+    get_tbd_url only returns None once every shard is idle with nothing in
+    transit. '''
+
+    def __init__(self, config, restart):
+        self.shard = config.shard
+        self.shards = config.shards
+        self.spool = Spool(config.spool_dir, self.shard, self.shards)
+        self.outbox = [list() for _ in range(self.shards)]
+        self.sent = DigestSet(8)
+        self.forwarded = 0
+        self.not_forwarded = 0
+        self.received = 0
+        self.idle = False
+        self.spool.set_state(False)
+        super().__init__(config, restart)
+        METRICS.gauge(
+            "spool_outbox", "Urls waiting to be forwarded to other shards.",
+            lambda: sum(len(outbox) for outbox in self.outbox))
+        self.stopped = Event()
+        self.exchanger = Thread(target=self._exchange_periodically, daemon=True)
+        self.exchanger.start()
+
+    def owns(self, url):
+        return get_shard(self._get_host(url), self.shards) == self.shard
+
+    def add_url(self, url, parent=None, page=None, score=None):
+        url = canonicalize(url)
+        owner = get_shard(self._get_host(url), self.shards)
+        if owner == self.shard:
+            return super().add_url(url, parent, page, score)
+        # The link is recorded and scored by the shard that found it, which
+        # has the parent.
+        self._record_link(parent, url)
+        digest = blake2b(url.encode("utf-8"), digest_size=8).digest()
+        with self.lock:
+            if not self.sent.add(digest):
+                # Already forwarded to its owner.
+                self.not_forwarded += 1
+                return
+            if score is None:
+                score = self.scorer.score(
+                    url, self.fetch_scores.get(parent), page)
+            outbox = self.outbox[owner]
+            outbox.append((url, score))
+            if len(outbox) >= self.config.spool_batch:
+                self._send(owner)
+        METRICS.count("forwarded", owner)
+
+    def _send(self, owner):
+        # Called with the lock held, so a shard never looks idle while a
+        # batch it took from its outbox is not written yet.
+        self.spool.send(owner, self.outbox[owner])
+        self.forwarded += len(self.outbox[owner])
+        self.outbox[owner] = list()
+
+    def _flush_outbox(self):
+        with self.lock:
+            for owner, outbox in enumerate(self.outbox):
+                if outbox:
+                    self._send(owner)
+
+    def _receive(self):
+        ''' Admits the urls of every waiting batch. Returns how many. '''
+        count = 0
+        for path in self.spool.inbox():
+            for url, score in self.spool.read(path):
+                if self.owns(url):
+                    super().add_url(url, score=score)
+                count += 1
+            # Only deleted once its urls are queued, and _enqueue made this
+            # shard busy if they were new.
+            self.spool.delete(path)
+        with self.lock:
+            self.received += count
+        return count
+
+    def _enqueue(self, url, score):
+        with self.lock:
+            if self.idle:
+                self.idle = False
+                self.spool.set_state(False)
+            super()._enqueue(url, score)
+
+    def _finished(self):
+        self._flush_outbox()
+        # Waiting batches are admitted by the exchange thread: admitting them
+        # here, with the frontier's lock held, would fetch robots.txt and
+        # block every worker during the download.
+        if self.tbd_count or self.spool.inbox():
+            return False
+        if not self.idle:
+            self.idle = True
+            self.spool.set_state(True)
+        return self.spool.finished()
+
+    def _exchange_periodically(self):
+        while not self.stopped.wait(self.config.spool_interval):
+            self._flush_outbox()
+            self._receive()
+
+    def _log_seen_filter(self):
+        super()._log_seen_filter()
+        self.logger.info(
+            f"Shard {self.shard} of {self.shards}: {self.forwarded} urls "
+            f"forwarded to other shards, {self.not_forwarded} not forwarded "
+            f"again, {self.received} received.")
+
+    def close(self):
+        self.stopped.set()
+        self.exchanger.join()
+        self._flush_outbox()
+        super().close()
+
+
+def merge_reports(stats, save_file, shards, logger=None):
+    ''' Adds the statistics checkpointed by every shard to stats. '''
+    for shard in range(shards):
+        path = f"{get_shard_save_file(save_file, shard)}.stats"
+        if not stats.merge(path) and logger:
+            logger.warning(f"No report statistics for shard {shard} in {path}.")
@@ -0,0 +1,71 @@
+import os
+import zlib
+import struct
+
+from array import array
+from functools import lru_cache
+from hashlib import blake2b
+
+import scraper
+
+# Magic, stamp of the save file it matches, digest of scraper.py, url count.
+HEADER = struct.Struct("<8sQ16sQ")
+MAGIC = b"FRSNAP01"
+
+
+@lru_cache(maxsize=None)
+def rules_digest():
+    ''' Digest of scraper.py, whose is_valid decided which urls were queued.
+    A snapshot taken under other rules is not used. '''
+    with open(scraper.__file__, "rb") as scraper_file:
+        return blake2b(scraper_file.read(), digest_size=16).digest()
+
+
+def save_snapshot(path, stamp, entries):
+    ''' Writes the (url, score) of every pending url to path atomically, as
+    the scores, the lengths of the urls and the urls joined, compressed. '''
+    scores = array("d")
+    lengths = array("I")
+    urls = list()
+    for url, score in entries:
+        scores.append(score)
+        lengths.append(len(url))
+        urls.append(url)
+    body = zlib.compress(
+        scores.tobytes() + lengths.tobytes() + "".join(urls).encode("utf-8"), 1)
+    tmp_path = f"{path}.tmp"
+    with open(tmp_path, "wb") as snapshot_file:
+        snapshot_file.write(HEADER.pack(MAGIC, stamp, rules_digest(), len(urls)))
+        snapshot_file.write(body)
+    os.replace(tmp_path, path)
+
+
+def load_snapshot(path):
+    ''' Returns (stamp, entries) from a snapshot written by save_snapshot, or
+    None if there is none, or it is damaged or was taken under other rules. '''
+    try:
+        with open(path, "rb") as snapshot_file:
+            data = snapshot_file.read()
+        magic, stamp, rules, count = HEADER.unpack_from(data)
+        if magic != MAGIC or rules != rules_digest():
+            return None
+        body = zlib.decompress(data[HEADER.size:])
+    except (OSError, struct.error, zlib.error):
+        return None
+    scores = array("d")
+    scores.frombytes(body[:count * scores.itemsize])
+    lengths = array("I")
+    start = count * scores.itemsize
+    lengths.frombytes(body[start:start + count * lengths.itemsize])
+    text = body[start + count * lengths.itemsize:].decode("utf-8")
+    entries = list()
+    offset = 0
+    for score, length in zip(scores, lengths):
+        entries.append((text[offset:offset + length], score))
+        offset += length
+    return stamp, entries
+
+
+def remove_snapshot(path):
+    if os.path.exists(path):
+        os.remove(path)
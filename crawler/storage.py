@@ -0,0 +1,485 @@
+import os
+import mmap
+import pickle
+import shelve
+import struct
+
+from threading import Thread, RLock, Event
+
+
+class _WriteBehindStore(object):
+    ''' Common batching for the frontier stores. Subclasses implement _flush,
+    which is called once batch_size updates are pending or every interval
+    seconds, and always with self.lock held. before_flush and after_flush,
+    if set, are called right before and right after each _flush, to
+    checkpoint state that must be at least as recent (before) or no more
+    recent (after) than the saved entries. '''
+
+    def __init__(self, batch_size, interval, logger):
+        self.batch_size = batch_size
+        self.interval = interval
+        self.logger = logger
+        self.lock = RLock()
+        self.unflushed = 0
+        self.closed = Event()
+        self.before_flush = self.after_flush = None
+
+    def _start_flusher(self):
+        if self.interval > 0:
+            Thread(target=self._flush_periodically, daemon=True).start()
+
+    def _flush_periodically(self):
+        while not self.closed.wait(self.interval):
+            self.flush()
+
+    def _updated(self):
+        self.unflushed += 1
+        if self.unflushed >= self.batch_size:
+            self.flush()
+
+    def flush(self):
+        with self.lock:
+            if self.unflushed and not self.closed.is_set():
+                if self.before_flush:
+                    self.before_flush()
+                self._flush()
+                if self.after_flush:
+                    self.after_flush()
+                self.unflushed = 0
+
+    def close(self):
+        with self.lock:
+            self.flush()
+            self.closed.set()
+            self._close()
+
+    def __bool__(self):
+        return len(self) > 0
+
+    def stamp(self):
+        ''' Flushes, and returns a number that changes whenever the saved
+        entries change, to tell whether a snapshot of them is current. '''
+        raise NotImplementedError
+
+    def changes_since(self, stamp):
+        ''' Returns the (digest, url, score) of every url saved since stamp
+        was taken, with url None for urls completed since, or None if the
+        store cannot tell. '''
+        return None
+
+
+class ShelveStore(_WriteBehindStore):
+    ''' Write-behind wrapper around the shelve save file, keyed on the hex of
+    the url digest. Values are (url, completed) or (url, completed, score).
+
+    Discovered and completed entries are buffered in memory and written to
+    the shelve in bulk, either when the buffer holds batch_size entries or
+    every interval seconds. Each batch is first written to a journal file, so
+    a crash while the shelve is being updated is repaired on the next start.
+    A crash can lose at most the entries buffered since the last flush.
+
+    The number of batches ever applied is kept in {save_file}.generation,
+    which is bumped before each batch reaches the shelve, as its stamp. '''
+
+    def __init__(self, save_file, batch_size, interval, logger):
+        super().__init__(batch_size, interval, logger)
+        self.journal_file = f"{save_file}.journal"
+        self.generation_file = f"{save_file}.generation"
+        self.generation = self._read_generation()
+        self.buffer = dict()
+        self.save = shelve.open(save_file)
+        self._replay_journal()
+        self._start_flusher()
+
+    @staticmethod
+    def _shelve_files(save_file):
+        # The dbm module behind shelve decides the file names: dbm.gnu uses
+        # save_file itself, dbm.ndbm adds .db, dbm.dumb .dat, .dir and .bak.
+        return [save_file + suffix for suffix in ("", ".db", ".dat", ".dir", ".bak")]
+
+    @staticmethod
+    def exists(save_file):
+        return any(
+            os.path.exists(path) for path in ShelveStore._shelve_files(save_file))
+
+    @staticmethod
+    def remove(save_file):
+        for path in ShelveStore._shelve_files(save_file) + [
+                f"{save_file}.journal", f"{save_file}.generation"]:
+            if os.path.exists(path):
+                os.remove(path)
+
+    def _read_generation(self):
+        try:
+            with open(self.generation_file) as generation_file:
+                return int(generation_file.read())
+        except (OSError, ValueError):
+            return 0
+
+    def _replay_journal(self):
+        # A journal left behind was written completely (it is renamed into
+        # place atomically) but may not have reached the shelve.
+        if os.path.exists(f"{self.journal_file}.tmp"):
+            os.remove(f"{self.journal_file}.tmp")
+        if not os.path.exists(self.journal_file):
+            return
+        with open(self.journal_file, "rb") as journal:
+            batch = pickle.load(journal)
+        self.logger.info(
+            f"Replaying {len(batch)} entries from {self.journal_file}.")
+        self._apply(batch)
+
+    def _apply(self, batch):
+        self.generation += 1
+        with open(self.generation_file, "w") as generation_file:
+            generation_file.write(str(self.generation))
+        self.save.update(batch)
+        self.save.sync()
+        os.remove(self.journal_file)
+
+    def _write_journal(self, batch):
+        tmp_file = f"{self.journal_file}.tmp"
+        with open(tmp_file, "wb") as journal:
+            pickle.dump(batch, journal, protocol=pickle.HIGHEST_PROTOCOL)
+            journal.flush()
+            os.fsync(journal.fileno())
+        os.replace(tmp_file, self.journal_file)
+
+    def _flush(self):
+        batch, self.buffer = self.buffer, dict()
+        self._write_journal(batch)
+        self._apply(batch)
+
+    def _close(self):
+        self.save.close()
+
+    def stamp(self):
+        with self.lock:
+            self.flush()
+            return self.generation
+
+    def __contains__(self, digest):
+        urlhash = digest.hex()
+        with self.lock:
+            return urlhash in self.buffer or urlhash in self.save
+
+    def __getitem__(self, digest):
+        urlhash = digest.hex()
+        with self.lock:
+            if urlhash in self.buffer:
+                return self.buffer[urlhash]
+            return self.save[urlhash]
+
+    def __setitem__(self, digest, value):
+        with self.lock:
+            self.buffer[digest.hex()] = value
+            self._updated()
+
+    def __len__(self):
+        with self.lock:
+            self.flush()
+            return len(self.save)
+
+    def pending(self):
+        ''' Yields (url, score) for the urls not completed yet. '''
+        with self.lock:
+            self.flush()
+            for value in self.save.values():
+                if not value[1]:
+                    # Entries saved before urls had scores are 2-tuples.
+                    yield value[0], value[2] if len(value) > 2 else None
+
+    def entries(self):
+        ''' Yields (url, score) for every saved url. '''
+        with self.lock:
+            self.flush()
+            for value in self.save.values():
+                yield value[0], value[2] if len(value) > 2 else None
+
+    def digests(self):
+        with self.lock:
+            self.flush()
+            for urlhash in self.save.keys():
+                yield bytes.fromhex(urlhash)
+
+
+class LogStore(_WriteBehindStore):
+    ''' Frontier state as an append-only record log plus a memory-mapped hash
+    index, keyed on the raw 32 byte url digest.
+
+    The log ({save_file}.log) holds one record per event: a url being
+    discovered (with its frontier score, if it has one), or a url being
+    completed. The index ({save_file}.idx) is an
+    open addressing table of (digest, log offset << 1 | completed) slots, so
+    membership checks and the completed flag never touch the log. Only the
+    urls of pending entries are read back from the log at startup.
+
+    Appends are fsync'd in batches like ShelveStore. The index is trusted
+    only if it was closed cleanly and covers the whole log; otherwise it is
+    rebuilt with one sequential pass over the log. The size of the log is
+    its stamp, and the records after it are the changes since. '''
+
+    RECORD = struct.Struct("<B32sI")
+    ADDED, COMPLETED, ADDED_SCORED = 0, 1, 2
+    # ADDED_SCORED payloads start with the score, followed by the url.
+    SCORE = struct.Struct("<d")
+
+    HEADER = struct.Struct("<8sQQQ?")
+    MAGIC = b"FRIDX001"
+    SLOT = struct.Struct("<32sQ")
+    EMPTY = bytes(32)
+    INITIAL_CAPACITY = 1 << 16
+
+    def __init__(self, save_file, batch_size, interval, logger):
+        super().__init__(batch_size, interval, logger)
+        self.log_file = f"{save_file}.log"
+        self.index_file = f"{save_file}.idx"
+        self.log = open(self.log_file, "ab")
+        self.log_size = self.log.tell()
+        self.reader = open(self.log_file, "rb")
+        if not self._open_index():
+            self._rebuild_index()
+        # Mark the index dirty until it is closed cleanly again.
+        self._write_header(clean=False)
+        self._start_flusher()
+
+    @staticmethod
+    def exists(save_file):
+        return os.path.exists(f"{save_file}.log")
+
+    @staticmethod
+    def remove(save_file):
+        for path in (f"{save_file}.log", f"{save_file}.idx"):
+            if os.path.exists(path):
+                os.remove(path)
+
+    def _open_index(self):
+        if not os.path.exists(self.index_file):
+            return False
+        self.index_fd = open(self.index_file, "r+b")
+        self.index = mmap.mmap(self.index_fd.fileno(), 0)
+        magic, capacity, count, log_size, clean = self.HEADER.unpack_from(
+            self.index)
+        if (magic != self.MAGIC or not clean or log_size != self.log_size
+                or len(self.index) != self.HEADER.size + capacity * self.SLOT.size):
+            self.logger.info(
+                f"Index {self.index_file} is stale, rebuilding it from "
+                f"{self.log_file}.")
+            self.index.close()
+            self.index_fd.close()
+            return False
+        self.capacity, self.count = capacity, count
+        return True
+
+    def _create_index(self, path, capacity):
+        with open(path, "wb") as index_fd:
+            index_fd.truncate(self.HEADER.size + capacity * self.SLOT.size)
+        index_fd = open(path, "r+b")
+        return index_fd, mmap.mmap(index_fd.fileno(), 0)
+
+    def _rebuild_index(self):
+        self.index_fd, self.index = self._create_index(
+            self.index_file, self.INITIAL_CAPACITY)
+        self.capacity, self.count = self.INITIAL_CAPACITY, 0
+        valid_size = 0
+        for offset, kind, digest, _ in self._scan_log():
+            if kind != self.COMPLETED:
+                self._insert(digest, offset << 1)
+            else:
+                slot = self._find(digest)
+                if slot is not None:
+                    _, value = self.SLOT.unpack_from(self.index, slot)
+                    self.SLOT.pack_into(self.index, slot, digest, value | 1)
+            valid_size = self.reader.tell()
+        if valid_size != self.log_size:
+            # Drop a partially written record at the end of the log.
+            self.log.truncate(valid_size)
+            self.log.seek(valid_size)
+            self.log_size = valid_size
+
+    def _scan_log(self, start=0):
+        self.reader.seek(start)
+        while True:
+            offset = self.reader.tell()
+            header = self.reader.read(self.RECORD.size)
+            if len(header) < self.RECORD.size:
+                return
+            kind, digest, length = self.RECORD.unpack(header)
+            payload = self.reader.read(length)
+            if len(payload) < length:
+                return
+            yield offset, kind, digest, payload
+
+    def _write_header(self, clean):
+        self.HEADER.pack_into(
+            self.index, 0, self.MAGIC, self.capacity, self.count,
+            self.log_size, clean)
+
+    def _slot_offset(self, i):
+        return self.HEADER.size + i * self.SLOT.size
+
+    def _probe(self, digest):
+        ''' Returns the offset of the slot holding digest, or of the empty
+        slot where it would be inserted. '''
+        i = int.from_bytes(digest[:8], "little") % self.capacity
+        while True:
+            slot = self._slot_offset(i)
+            key = self.index[slot:slot + 32]
+            if key == digest or key == self.EMPTY:
+                return slot
+            i = (i + 1) % self.capacity
+
+    def _find(self, digest):
+        slot = self._probe(digest)
+        if self.index[slot:slot + 32] == self.EMPTY:
+            return None
+        return slot
+
+    def _insert(self, digest, value):
+        slot = self._probe(digest)
+        if self.index[slot:slot + 32] == self.EMPTY:
+            self.count += 1
+        self.SLOT.pack_into(self.index, slot, digest, value)
+        if self.count * 2 > self.capacity:
+            self._grow()
+
+    def _grow(self):
+        old_index, old_fd, old_capacity = self.index, self.index_fd, self.capacity
+        tmp_file = f"{self.index_file}.tmp"
+        self.index_fd, self.index = self._create_index(
+            tmp_file, old_capacity * 2)
+        self.capacity, self.count = old_capacity * 2, 0
+        for i in range(old_capacity):
+            digest, value = self.SLOT.unpack_from(
+                old_index, self._slot_offset(i))
+            if digest != self.EMPTY:
+                self._insert(digest, value)
+        old_index.close()
+        old_fd.close()
+        os.replace(tmp_file, self.index_file)
+
+    def _append(self, kind, digest, payload=b""):
+        offset = self.log_size
+        self.log.write(self.RECORD.pack(kind, digest, len(payload)))
+        self.log.write(payload)
+        self.log_size += self.RECORD.size + len(payload)
+        return offset
+
+    def _read_entry(self, offset):
+        ''' Returns (url, score) from the discovery record at offset. '''
+        kind, _, length = self.RECORD.unpack(
+            os.pread(self.reader.fileno(), self.RECORD.size, offset))
+        payload = os.pread(
+            self.reader.fileno(), length, offset + self.RECORD.size)
+        if kind == self.ADDED_SCORED:
+            score, = self.SCORE.unpack_from(payload)
+            return payload[self.SCORE.size:].decode("utf-8"), score
+        return payload.decode("utf-8"), None
+
+    def _flush(self):
+        self.log.flush()
+        os.fsync(self.log.fileno())
+
+    def _close(self):
+        self.log.close()
+        self.reader.close()
+        self._write_header(clean=True)
+        self.index.flush()
+        self.index.close()
+        self.index_fd.close()
+
+    def __contains__(self, digest):
+        with self.lock:
+            return self._find(digest) is not None
+
+    def __getitem__(self, digest):
+        with self.lock:
+            slot = self._find(digest)
+            if slot is None:
+                raise KeyError(digest)
+            _, value = self.SLOT.unpack_from(self.index, slot)
+            self.log.flush()
+            return self._read_entry(value >> 1)[0], bool(value & 1)
+
+    def __setitem__(self, digest, value):
+        url, completed, *score = value
+        with self.lock:
+            slot = self._find(digest)
+            if slot is None:
+                if score:
+                    offset = self._append(
+                        self.ADDED_SCORED, digest,
+                        self.SCORE.pack(score[0]) + url.encode("utf-8"))
+                else:
+                    offset = self._append(
+                        self.ADDED, digest, url.encode("utf-8"))
+                self._insert(digest, offset << 1)
+                self._updated()
+                slot = self._find(digest)
+            _, current = self.SLOT.unpack_from(self.index, slot)
+            if completed and not current & 1:
+                self._append(self.COMPLETED, digest)
+                self.SLOT.pack_into(self.index, slot, digest, current | 1)
+                self._updated()
+
+    def __len__(self):
+        return self.count
+
+    def stamp(self):
+        with self.lock:
+            self.flush()
+            return self.log_size
+
+    def changes_since(self, stamp):
+        with self.lock:
+            if stamp > self.log_size:
+                return None
+            self.log.flush()
+            changes = list()
+            for offset, kind, digest, payload in self._scan_log(stamp):
+                if offset >= self.log_size:
+                    break
+                if kind == self.COMPLETED:
+                    changes.append((digest, None, None))
+                elif kind == self.ADDED_SCORED:
+                    score, = self.SCORE.unpack_from(payload)
+                    changes.append((
+                        digest, payload[self.SCORE.size:].decode("utf-8"),
+                        score))
+                else:
+                    changes.append((digest, payload.decode("utf-8"), None))
+            return changes
+
+    def pending(self):
+        ''' Yields (url, score) for the urls not completed yet. '''
+        with self.lock:
+            self.log.flush()
+            for i in range(self.capacity):
+                digest, value = self.SLOT.unpack_from(
+                    self.index, self._slot_offset(i))
+                if digest != self.EMPTY and not value & 1:
+                    yield self._read_entry(value >> 1)
+
+    def entries(self):
+        ''' Yields (url, score) for every saved url. '''
+        with self.lock:
+            self.log.flush()
+            for i in range(self.capacity):
+                digest, value = self.SLOT.unpack_from(
+                    self.index, self._slot_offset(i))
+                if digest != self.EMPTY:
+                    yield self._read_entry(value >> 1)
+
+    def digests(self):
+        with self.lock:
+            for i in range(self.capacity):
+                digest, _ = self.SLOT.unpack_from(
+                    self.index, self._slot_offset(i))
+                if digest != self.EMPTY:
+                    yield digest
+
+
+STORES = {
+    "shelve": ShelveStore,
+    "log": LogStore,
+}
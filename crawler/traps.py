@@ -0,0 +1,166 @@
+import os
+import re
+import json
+
+from threading import Lock
+from urllib.parse import urlsplit
+
+# Path segments that only differ in dates or numbers are collapsed into the
+# same template: /events/2019-04-01/ and /events/2020-11-30/ are both
+# /events/{date}/, /post/123 and /post/456 are both /post/{n}.
+DATE = re.compile(r"(?<!\d)(?:19|20)\d{2}[-_/]?[01]\d(?:[-_/]?[0-3]\d)?(?!\d)")
+NUMBER = re.compile(r"\d+")
+
+# Indices into a template's or host's counts.
+DISCOVERED, FETCHED, LOW_TEXT, DUPLICATE = range(4)
+
+OK, THROTTLED, DROPPED = "ok", "throttled", "dropped"
+
+
+def get_template(url):
+    ''' Returns (host, template) for url. The template is the host, the path
+    with dates and numbers collapsed, and the sorted query keys. '''
+    parsed = urlsplit(url)
+    host = parsed.netloc.lower()
+    path = NUMBER.sub("{n}", DATE.sub("{date}", parsed.path.lower()))
+    keys = sorted({
+        pair.partition("=")[0] for pair in parsed.query.split("&") if pair})
+    return host, f"{host}{path}?{'&'.join(keys)}"
+
+
+class TrapDetector(object):
+    ''' Online trap detection for the frontier.
+
+    Counts how many urls of each path template and each host were discovered
+    and fetched, and how many of the fetched pages had little text or were
+    duplicates of another page. Once a template has min_pages fetched pages,
+    a useless rate (low text or duplicate) of throttle_rate throttles it: only
+    one of every sample newly discovered urls is admitted. A rate of drop_rate
+    drops it: nothing more is admitted, and its queued urls are skipped. Hosts
+    are judged the same way once they have host_factor times as many pages.
+
+    Dropping is permanent; a throttled template goes back to ok if its rates
+    improve. Every decision is logged and saved to path along with the
+    counts, so they survive a resume. '''
+
+    def __init__(self, path, logger, min_pages, throttle_rate, drop_rate,
+                 sample, host_factor=10):
+        self.path = path
+        self.logger = logger
+        self.min_pages = min_pages
+        self.throttle_rate = throttle_rate
+        self.drop_rate = drop_rate
+        self.sample = sample
+        self.host_factor = host_factor
+        self.lock = Lock()
+        self.counts = dict() # template or host -> [discovered, fetched, low text, duplicate]
+        self.states = dict() # template or host -> THROTTLED or DROPPED
+        self.blocked = 0
+        self._load()
+
+    def _load(self):
+        if not os.path.exists(self.path):
+            return
+        with open(self.path, encoding="utf-8") as traps_file:
+            state = json.load(traps_file)
+        self.counts = state["counts"]
+        self.states = state["states"]
+        self.logger.info(
+            f"Loaded {len(self.states)} trap decisions from {self.path}.")
+
+    def save(self):
+        ''' Writes the counts and decisions to path atomically. '''
+        with self.lock:
+            data = json.dumps({"counts": self.counts, "states": self.states})
+        tmp_path = f"{self.path}.tmp"
+        with open(tmp_path, "w", encoding="utf-8") as traps_file:
+            traps_file.write(data)
+        os.replace(tmp_path, self.path)
+
+    @staticmethod
+    def remove(path):
+        if os.path.exists(path):
+            os.remove(path)
+
+    def _counts(self, key):
+        counts = self.counts.get(key)
+        if counts is None:
+            counts = self.counts[key] = [0, 0, 0, 0]
+        return counts
+
+    def admit(self, url):
+        ''' Counts a newly discovered url and returns whether it should be
+        added to the frontier. '''
+        host, template = get_template(url)
+        with self.lock:
+            host_counts = self._counts(host)
+            counts = self._counts(template)
+            host_counts[DISCOVERED] += 1
+            counts[DISCOVERED] += 1
+            admitted = True
+            for key, key_counts in ((host, host_counts), (template, counts)):
+                state = self.states.get(key, OK)
+                if state == DROPPED or (
+                        state == THROTTLED
+                        and key_counts[DISCOVERED] % self.sample):
+                    admitted = False
+            if not admitted:
+                self.blocked += 1
+            return admitted
+
+    def allows(self, url):
+        ''' Whether url's template and host are not dropped. '''
+        host, template = get_template(url)
+        with self.lock:
+            return DROPPED not in (
+                self.states.get(host), self.states.get(template))
+
+    def record(self, url, page):
+        ''' Counts a fetched url. page is its scraper.PageResult, or None if
+        it had nothing to parse. Returns True if a decision changed.
+
+        Pages that were not parsed (errors, non html) are not counted, so an
+        outage of the cache server does not get hosts dropped. '''
+        if page is None:
+            return False
+        host, template = get_template(url)
+        with self.lock:
+            changed = False
+            for key, min_pages in (
+                    (host, self.min_pages * self.host_factor),
+                    (template, self.min_pages)):
+                counts = self._counts(key)
+                counts[FETCHED] += 1
+                if page.low_text:
+                    counts[LOW_TEXT] += 1
+                elif page.duplicate:
+                    counts[DUPLICATE] += 1
+                if counts[FETCHED] >= min_pages:
+                    changed |= self._judge(key, counts)
+            return changed
+
+    def _judge(self, key, counts):
+        state = self.states.get(key, OK)
+        if state == DROPPED:
+            return False
+        fetched = counts[FETCHED]
+        rate = max(counts[LOW_TEXT], counts[DUPLICATE]) / fetched
+        if rate >= self.drop_rate:
+            new_state = DROPPED
+        elif rate >= self.throttle_rate:
+            new_state = THROTTLED
+        else:
+            new_state = OK
+        if new_state == state:
+            return False
+        if new_state == OK:
+            del self.states[key]
+        else:
+            self.states[key] = new_state
+        useful = fetched - counts[LOW_TEXT] - counts[DUPLICATE]
+        self.logger.info(
+            f"Trap detector: {key} is now {new_state} after "
+            f"{counts[DISCOVERED]} discovered, {fetched} fetched, {useful} "
+            f"useful, {counts[LOW_TEXT]} low text, {counts[DUPLICATE]} "
+            f"duplicate pages.")
+        return True
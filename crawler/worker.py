@@ -1,37 +1,102 @@
 from threading import Thread
 
+from functools import lru_cache
 from inspect import getsource
+from urllib.parse import urlparse
 from utils.download import download
+from utils.metrics import METRICS
 from utils import get_logger
 import scraper
-import time
-from scraper import print_report
+
+
+@lru_cache(maxsize=None)
+def check_scraper():
+    ''' Basic check for requests in scraper. Reads its source once per
+    process, not once per worker. '''
+    source = getsource(scraper)
+    assert {source.find(req) for req in {"from requests import", "import requests"}} == {-1}, "Do not use requests in scraper.py"
+    assert {source.find(req) for req in {"from urllib.request import", "import urllib.request"}} == {-1}, "Do not use urllib.request in scraper.py"
+    return True
 
 
 class Worker(Thread):
-    def __init__(self, worker_id, config, frontier):
+    def __init__(self, worker_id, config, frontier, parser=None, archive=None,
+                 replay=None):
         self.logger = get_logger(f"Worker-{worker_id}", "Worker")
         self.config = config
         self.frontier = frontier
-        # basic check for requests in scraper
-        assert {getsource(scraper).find(req) for req in {"from requests import", "import requests"}} == {-1}, "Do not use requests in scraper.py"
-        assert {getsource(scraper).find(req) for req in {"from urllib.request import", "import urllib.request"}} == {-1}, "Do not use urllib.request in scraper.py"
+        # Optional crawler.pipeline.ParsePipeline that parses pages in
+        # separate processes.
+        self.parser = parser
+        # Optional crawler.archive.ArchiveWriter the downloaded pages are
+        # written to, and ArchiveReader they are read from instead of the
+        # cache server when replaying.
+        self.archive = archive
+        self.replay = replay
+        self.source = (
+            "the archive" if replay else f"cache {self.config.cache_server}")
+        check_scraper()
         super().__init__(daemon=True)
         
     def run(self):
         while True:
-            tbd_url = self.frontier.get_tbd_url()
+            # Includes waiting for a host's politeness window.
+            with METRICS.time("wait"):
+                tbd_url = self.frontier.get_tbd_url()
             if not tbd_url:
                 self.logger.info("Frontier is empty. Stopping Crawler.")
                 break
-            resp = download(tbd_url, self.config, self.logger)
-            self.logger.info(
-                f"Downloaded {tbd_url}, status <{resp.status}>, "
-                f"using cache {self.config.cache_server}.")
-            scraped_urls = scraper.scraper(tbd_url, resp)
-            # BOOKKEEPING: Update report
-            print_report()
-            for scraped_url in scraped_urls:
-                self.frontier.add_url(scraped_url)
+            try:
+                with METRICS.time("download"):
+                    if self.replay:
+                        resp = self.replay.download(tbd_url)
+                    else:
+                        resp = download(
+                            tbd_url, self.config, self.logger,
+                            self.frontier.get_validators(tbd_url))
+                self.process(tbd_url, resp)
+            except Exception:
+                # Release the url's host so the rest of the crawl can go on.
+                self.logger.exception(f"Failed to crawl {tbd_url}.")
+                self.frontier.mark_url_complete(tbd_url)
+
+    def process(self, tbd_url, resp):
+        self.logger.info(
+            f"Downloaded {tbd_url}, status <{resp.status}>, "
+            f"using {self.source}.")
+        METRICS.count("fetches", urlparse(tbd_url).netloc.lower())
+        METRICS.count("responses", resp.status)
+        if self.frontier.retry_failed(tbd_url, resp):
+            # Queued again, to be downloaded after a backoff.
+            return
+        if self.frontier.unchanged(tbd_url, resp.status):
+            # Not modified since the last crawl: already counted in the
+            # report and its links are already in the frontier.
+            self.frontier.mark_url_complete(tbd_url)
+            return
+        if self.archive:
+            with METRICS.time("archive"):
+                self.archive.add(tbd_url, resp)
+        if self.parser:
+            # The pipeline adds the links and marks the url complete.
+            with METRICS.time("submit"):
+                self.parser.submit(tbd_url, resp)
+            return
+        # Same as scraper.scraper, but keeps the parsed page for the frontier.
+        with METRICS.time("parse"):
+            page = scraper.parse_page(tbd_url, resp)
+        validators = page.validators if page is not None else None
+        if self.frontier.unchanged(tbd_url, resp.status, validators):
+            # Same content as at the last crawl.
             self.frontier.mark_url_complete(tbd_url)
-            time.sleep(self.config.time_delay)
+            return
+        with METRICS.time("record"):
+            scraped_urls = scraper.record_page(page)
+        with METRICS.time("is_valid"):
+            scraped_urls = [url for url in scraped_urls if scraper.is_valid(url)]
+        with METRICS.time("add_url"):
+            for scraped_url in scraped_urls:
+                self.frontier.add_url(scraped_url, tbd_url, page)
+        with METRICS.time("mark_complete"):
+            self.frontier.mark_url_complete(tbd_url, page, validators)
+        scraper.page_completed(page)
@@ -4,19 +4,79 @@ from argparse import ArgumentParser
 from utils.server_registration import get_cache_server
 from utils.config import Config
 from crawler import Crawler
-from scraper import print_report
+from crawler.archive import configure_replay
+from crawler.shards import (
+    Spool, configure_shard, get_spool_dir, merge_reports)
+from scraper import print_report, REPORT
+import os
+import sys
 import time
+import signal
+import subprocess
 
 def format_duration(seconds):
     hours, rem = divmod(int(seconds), 3600)
     minutes, secs = divmod(rem, 60)
     return f"{hours:02d}:{minutes:02d}:{secs:02d}"
 
-def main(config_file, restart):
+def launch_shards(config, config_file, restart, recrawl, replay):
+    ''' Runs config.shards crawler processes that split the hosts between
+    them, then merges their report statistics. '''
+    spool_dir = get_spool_dir(config.save_file)
+    if restart:
+        Spool.remove(spool_dir)
+    else:
+        Spool.reset(spool_dir)
+    args = [
+        sys.executable, os.path.abspath(__file__),
+        "--config_file", config_file, "--shards", str(config.shards)]
+    if config.cache_server:
+        host, port = config.cache_server
+        args += ["--cache_server", f"{host}:{port}"]
+    if restart:
+        args.append("--restart")
+    if recrawl:
+        args.append("--recrawl")
+    if replay:
+        args.append("--replay")
+    shards = [
+        subprocess.Popen(args + ["--shard", str(shard)])
+        for shard in range(config.shards)]
+    try:
+        for shard in shards:
+            shard.wait()
+    except KeyboardInterrupt:
+        # Stop the shards too (from a terminal they got the interrupt
+        # already), and let them save their progress.
+        for shard in shards:
+            if shard.poll() is None:
+                shard.send_signal(signal.SIGINT)
+        for shard in shards:
+            shard.wait()
+    merge_reports(REPORT, config.save_file, config.shards)
+
+def main(config_file, restart, recrawl=False, shards=None, shard=None,
+         cache_server=None, replay=False):
     cparser = ConfigParser()
     cparser.read(config_file)
     config = Config(cparser)
-    config.cache_server = get_cache_server(config, restart)
+    config.recrawl = recrawl
+    if shards is not None:
+        config.shards = shards
+    if replay:
+        # Pages are read from the archive, the cache server is not used.
+        configure_replay(config)
+    elif cache_server:
+        # Registered once by the process that started the shards.
+        host, port = cache_server.rsplit(":", 1)
+        config.cache_server = (host, int(port))
+    else:
+        config.cache_server = get_cache_server(config, restart)
+    if shard is None and config.shards > 1:
+        launch_shards(config, config_file, restart, recrawl, replay)
+        return
+    if shard is not None:
+        configure_shard(config, shard)
     crawler = Crawler(config, restart)
     crawler.start()
 
@@ -24,11 +84,25 @@ def main(config_file, restart):
 if __name__ == "__main__":
     parser = ArgumentParser()
     parser.add_argument("--restart", action="store_true", default=False)
+    parser.add_argument("--recrawl", action="store_true", default=False)
     parser.add_argument("--config_file", type=str, default="config.ini")
+    parser.add_argument(
+        "--shards", type=int, default=None,
+        help="number of crawler processes, overrides SHARDS")
+    parser.add_argument(
+        "--shard", type=int, default=None,
+        help="run only this shard of --shards")
+    parser.add_argument(
+        "--cache_server", type=str, default=None,
+        help="host:port of the cache server, skips registration")
+    parser.add_argument(
+        "--replay", action="store_true", default=False,
+        help="read pages from the ARCHIVEDIR archive instead of downloading")
     args = parser.parse_args()
 
     start = time.perf_counter()
-    main(args.config_file, args.restart)
+    main(args.config_file, args.restart, args.recrawl, args.shards,
+         args.shard, args.cache_server, args.replay)
     end = time.perf_counter()
 
     elapsed = end - start
@@ -1,11 +1,14 @@
-import re
 import sys
-from urllib.parse import urlparse, urlunparse, parse_qs, urljoin
-from urllib.robotparser import RobotFileParser
-from bs4 import BeautifulSoup
+from typing import Iterable
+from urllib.parse import urlparse, urlunparse, urljoin
 from configparser import ConfigParser
 from utils.config import Config
-from utils.download import download
+from utils.download import download, page_validators
+from utils.canonical import canonicalize
+from utils.extract import PageHandler, iter_text, iter_tokens
+from utils.simhash import DuplicateDetector, checksum, simhash
+from utils.stats import CrawlStats
+from utils.urlfilter import UrlFilter
 
 STOP_WORDS = {
     "a", "able", "about", "above", "abst", "accordance", "according",
@@ -96,29 +99,34 @@ STOP_WORDS = {
     "yourself", "yourselves", "you've", "z", "zero"
 }
 
-valid_domains = [
-    "ics.uci.edu",
-    "cs.uci.edu",
-    "informatics.uci.edu",
-    "stat.uci.edu",
-]
+#Global statistics for creating the report, safe to update from any thread
+REPORT = CrawlStats(top_k=50)
+REPORT_FILE = "report.txt"
 
-#Global variables for creating the report
-UNIQUE_URLS = set()
-WORD_FREQUENCIES = {} # dictionary of (word: frequency) for all pages crawled
-LONGEST_PAGE = ("", 0) # tuple of (url, word count)
-SUBDOMAIN_COUNTS = {} # dictionary of (subdomain: page count)
+# "soup" builds a BeautifulSoup tree, "fast" extracts links and text in one
+# streaming pass (see utils/extract.py). Set from config by configure().
+EXTRACTOR = "soup"
 
-# dictionary of robots.txt urls to robotparser objects
-ROBOTS_DIC = {}
+# Fingerprints of the pages recorded so far. A page with the same text as an
+# earlier page, or a SimHash within SIMHASHDISTANCE bits of one, is a duplicate:
+# it is not counted in the report and its links are not followed.
+DUPLICATES = DuplicateDetector(max_distance=3)
 
-def computeWordFrequencies(tokenList: list[str]) -> dict[str, int]:
+def configure(config):
+    global EXTRACTOR, DUPLICATES, REPORT_FILE
+    EXTRACTOR = config.extractor
+    DUPLICATES = DuplicateDetector(config.simhash_distance)
+    if config.shard is not None:
+        # launch.py merges the shard reports into report.txt.
+        REPORT_FILE = f"report.shard{config.shard}.txt"
+
+def computeWordFrequencies(tokenList: Iterable[str]) -> dict[str, int]:
     """
-    Takes a list of tokens and returns a dictionary of each Token and 
-    its frequency in the token list.
+    Takes a list (or any iterable) of tokens and returns a dictionary of each
+    Token and its frequency in the token list.
     
     :param tokenList: list of Token objects
-    :type tokenList: list[Token]
+    :type tokenList: Iterable[Token]
     :return: dictionary of (Token: frequency)
     :rtype: dict[Token, int]
     """
@@ -130,6 +138,29 @@ def computeWordFrequencies(tokenList: list[str]) -> dict[str, int]:
             tokenDict[token] = 1
     return tokenDict
 
+class PageResult(object):
+    """
+    What parse_page learned about a downloaded page. Plain data only, so it
+    can be sent back from a parser process.
+    """
+    __slots__ = (
+        "url", "links", "word_frequencies", "low_text", "checksum", "simhash",
+        "validators", "duplicate")
+
+    def __init__(self, url, links, word_frequencies, low_text,
+                 checksum=None, simhash=None, validators=None):
+        self.url = url # the actual url of the page (resp.url)
+        self.links = links
+        self.word_frequencies = word_frequencies
+        self.low_text = low_text
+        # content fingerprints, None for pages with too little text to compare
+        self.checksum = checksum
+        self.simhash = simhash
+        # (etag, last modified, content hash) of a page downloaded in full,
+        # compared and saved by the frontier for recrawls
+        self.validators = validators
+        self.duplicate = False # set by record_page
+
 def scraper(url, resp):
     links = extract_next_links(url, resp)
     return [link for link in links if is_valid(link)]
@@ -144,186 +175,194 @@ def extract_next_links(url, resp):
     #         resp.raw_response.url: the url, again
     #         resp.raw_response.content: the content of the page!
     # Return a list with the hyperlinks (as strings) scrapped from resp.raw_response.content
+    return record_page(parse_page(url, resp))
 
+def parse_page(url, resp):
+    """
+    Parses a response into a PageResult without touching the report globals.
+    Returns None for responses that should not be counted in the report.
+    """
     links = set()
 
     ## Handles cases where there is no response
     if resp is None:
-        return []
+        return None
 
     ## Handles cases where there is a response but there is or was no content
     if resp.raw_response is None:
-        return []
+        return None
 
     # Stores content of the webpage
     content = resp.raw_response.content
 
     # Handles cases of empty
     if not content:
-        return []
+        return None
 
     # Handles cases of non html junk
     headers = resp.raw_response.headers
     content_type = headers.get("content-type", "")
 
     if "text/html" not in content_type:
-        return []
-
-    soup = BeautifulSoup(resp.raw_response.content, "lxml")
-
-    for spam in soup(["script", "style"]):
-        spam.decompose()
+        return None
 
-    text = soup.get_text()
-    words = re.findall(r'\b[a-zA-Z]{2,}\b', text.lower())
-    filtered_words = [word for word in words if word not in STOP_WORDS]
-
-    word_count = len(filtered_words)
+    # words are streamed: tokens are counted as each text chunk is produced,
+    # without the full text, its lowercased copy or a list of all the words
+    if EXTRACTOR == "fast":
+        page = PageHandler()
+        words = iter_tokens(iter_text(content, page, content_type))
+    else:
+        # Imported on the first page, not at startup.
+        from bs4 import BeautifulSoup
+        soup = BeautifulSoup(content, "lxml")
+
+        for spam in soup(["script", "style"]):
+            spam.decompose()
+
+        hrefs = [a_tag.get('href') for a_tag in soup.find_all('a', href=True)]
+        # the strings get_text() would join
+        words = iter_tokens(soup.strings)
+    word_frequencies = computeWordFrequencies(
+        word for word in words if word not in STOP_WORDS)
+    if EXTRACTOR == "fast":
+        hrefs = page.hrefs # complete once the page is parsed
+
+    word_count = sum(word_frequencies.values())
     low_text = word_count < 100 # used as a flag for little word count on pages while still
                                 # allowing us to pull urls off them
 
     if(resp.status == 200):
-        for a_tag in soup.find_all('a', href=True):
+        for href in hrefs:
             try:
-                # pulls url from anchor tag
-                href = a_tag.get('href')
-                # creates an absolute path from relative paths
-                absolute = urljoin(resp.url, href)
-                # removes fragments
-                parsed = urlparse(absolute)._replace(fragment = "")
-                # normalize scheme to avoid duplicate http/https URLs
-                scheme = parsed.scheme.lower()
-                # normalize default ports to avoid duplicate URLs (:80, :443)
-                netloc = parsed.netloc.replace(":80", "").replace(":443", "")
-                # creates a canonical version of the URL by normalizing scheme and netloc
-                parsed = parsed._replace(scheme=scheme, netloc=netloc)
-                # add paths to link set
-                links.add(urlunparse(parsed))
+                # creates an absolute path from relative paths, then the
+                # canonical form shared with the frontier (see utils/canonical.py):
+                # no fragment, lowercased scheme and host, no default port,
+                # sorted query without tracking params, dot segments resolved
+                links.add(canonicalize(urljoin(resp.url, href)))
             except ValueError:
                 ## Catches URL that are weirdly formatted or malformed, such as 'YOUR_IP'
                 ## which crawler stumbled on
-                print(f"Skipping malformed URL: {parsed}")
+                print(f"Skipping malformed URL: {href}")
                 continue
     else:
         print("Error: ", resp.error)
 
+    validators = page_validators(resp.raw_response) if resp.status == 200 else None
+
+    # low text pages (navigation, empty listings) look alike without being
+    # copies of each other, so only pages with real content are fingerprinted
+    if low_text:
+        return PageResult(
+            resp.url, list(links), word_frequencies, low_text,
+            validators=validators)
+    return PageResult(
+        resp.url, list(links), word_frequencies, low_text,
+        checksum(word_frequencies), simhash(word_frequencies), validators)
+
+def record_page(page):
+    """
+    Adds a parsed page to the report statistics and returns its links.
+    """
+    if page is None:
+        return []
+
+    # skip exact and near duplicates of pages already recorded
+    if page.checksum is not None and DUPLICATES.is_duplicate(page.checksum, page.simhash):
+        page.duplicate = True
+        return []
+
     #BOOKKEEPING FOR REPORT
-    # Updating subdomain counts
-    parsed_url = urlparse(resp.url)
-    non_fragment_url = parsed_url._replace(fragment = "")
+    parsed_url = urlparse(page.url)
+    non_fragment_url = urlunparse(parsed_url._replace(fragment = ""))
     subdomain = parsed_url.netloc.split(':')[0]
 
-    if non_fragment_url not in UNIQUE_URLS:
-        UNIQUE_URLS.add(non_fragment_url)
-        SUBDOMAIN_COUNTS[subdomain] = SUBDOMAIN_COUNTS.get(subdomain, 0) + 1
+    # word frequencies and longest page only count pages with enough text
+    REPORT.record_page(
+        non_fragment_url, subdomain,
+        None if page.low_text else page.word_frequencies)
+    # END BOOKKEEPING FOR REPORT
+    return page.links
 
-    if not low_text:
-        word_frequencies = computeWordFrequencies(filtered_words)
+def page_completed(page):
+    """
+    Called once a page passed to record_page is saved as complete, so its
+    fingerprints can be checkpointed without it ever duplicating itself.
+    """
+    if page is not None and page.checksum is not None and not page.duplicate:
+        DUPLICATES.completed(page.checksum, page.simhash)
 
-        # Updating word frequencies
-        for word, freq in word_frequencies.items():
-            WORD_FREQUENCIES[word] = WORD_FREQUENCIES.get(word, 0) + freq
+# is_valid rules, compiled once at import time into URL_FILTER
+# (see utils/urlfilter.py). Rejections are counted per rule in URL_FILTER.hits.
 
-        global LONGEST_PAGE
-        # Updating longest page
-        word_count = sum(word_frequencies.values())
-        if word_count > LONGEST_PAGE[1]:
-            LONGEST_PAGE = (resp.url, word_count)
+# hosts under these domains (or equal to them) are crawled
+valid_domains = [
+    "ics.uci.edu",
+    "cs.uci.edu",
+    "informatics.uci.edu",
+    "stat.uci.edu",
+]
+
+BLOCKED_DOMAINS = [
+    # GitLab repositories (UI-heavy, non-informational, trap-prone)
+    "gitlab.ics.uci.edu",
+    # Grape wiki revision/history UI (infinite version trap)
+    "grape.ics.uci.edu",
+]
 
-        # END BOOKKEEPING FOR REPORT
-    return list(links)
+BAD_QUERIES = {
+    'eventDate', 'tribe-bar-date', 'ical',
+    'do', 'tab_files', 'tab_details', 'image',
+    'rev', 'idx', "outlook-ical", "date", "year",
+    "month", "day", "redirect_to", "action", "loggedout"
+}
+
+# query keys (with a non-empty value) that reject a url, and the rule name
+# they are counted under
+BLOCKED_QUERY_KEYS = {key: "bad_query" for key in BAD_QUERIES}
+# pagination via query params (?paged=40)
+BLOCKED_QUERY_KEYS["paged"] = "paged_query"
+
+# searched in the lowercased path
+PATH_PATTERNS = {
+    # pagination paths like /page/2, /page/40
+    "pagination": r"/page/\d+",
+    # WordPress auth / admin pages
+    "wordpress_admin": r"/wp-(?:login|admin)",
+    # calendar pages with a date in the path
+    "date_in_path": r"/\d{4}-\d{2}(?:-\d{2})?(?:/|$)",
+    # photo gallery directories (many HTML pages, little text)
+    "photo_gallery": r"/pix/",
+}
+
+BLOCKED_EXTENSIONS = [
+    "css", "js", "bmp", "gif", "jpeg", "jpg", "ico",
+    "png", "tif", "tiff", "mid", "mp2", "mp3", "mp4",
+    "wav", "avi", "mov", "mpeg", "ram", "m4v", "mkv", "ogg", "ogv", "pdf",
+    "ps", "eps", "tex", "ppt", "pptx", "doc", "docx", "xls", "xlsx", "names",
+    "data", "dat", "exe", "bz2", "tar", "msi", "bin", "7z", "psd", "dmg", "iso",
+    "epub", "dll", "cnf", "tgz", "sha1",
+    "thmx", "mso", "arff", "rtf", "jar", "csv",
+    "rm", "smil", "wmv", "swf", "wma", "zip", "rar", "gz",
+]
+
+URL_FILTER = UrlFilter(
+    valid_domains, BLOCKED_DOMAINS, BLOCKED_QUERY_KEYS, PATH_PATTERNS,
+    BLOCKED_EXTENSIONS,
+    # very long query strings usually indicate UI/state traps
+    max_query_length=100,
+    # a long path depth is most likely a trap
+    max_path_depth=10)
 
 def is_valid(url):
     # Decide whether to crawl this url or not. 
     # If you decide to crawl it, return True; otherwise return False.
-    # There are already some conditions that return False.
+    # Besides the rules above, a repeating directory pattern (which often
+    # indicates calendar or pagination loops) also returns False.
     try:
-        parsed = urlparse(url)
-        if parsed.scheme not in set(["http", "https"]):
-            return False
-        parsedDomain = parsed.netloc.split(':')[0]
-        for domain in valid_domains:
-            if parsedDomain.endswith(domain):
-                break
-        else:
-            return False
-
-        # block GitLab repositories (UI-heavy, non-informational, trap-prone)
-        if parsedDomain.endswith("gitlab.ics.uci.edu"):
-            return False
-
-        # block pagination paths like /page/2, /page/40
-        if re.search(r"/page/\d+", parsed.path.lower()):
-            return False
-
-        # block pagination via query params (?paged=40)
-        params = parse_qs(parsed.query)
-        if "paged" in params:
-            return False
-
-        # block WordPress auth / admin pages
-        if re.search(r"/wp-(login|admin)", parsed.path.lower()):
-            return False
-
-        BAD_QUERIES = {
-            'eventDate', 'tribe-bar-date', 'ical',
-            'do', 'tab_files', 'tab_details', 'image',
-            'rev', 'idx', "outlook-ical", "date", "year",
-            "month", "day", "redirect_to", "action", "loggedout"
-        }
-
-        if any(param in params for param in BAD_QUERIES):
-            return False
-
-        # handle case of very long query strings that usually indicate UI/state traps
-        if len(parsed.query) > 100:
-            return False
-
-        DATE_IN_PATH = re.compile(r"/\d{4}-\d{2}(?:-\d{2})?(?:/|$)")
-        parsedPath = parsed.path.lower()
-        if DATE_IN_PATH.search(parsedPath):
-            return False
-
-        # a long path depth is most likely a trap
-        if parsedPath.count("/") > 10:
-            return False
-
-        # block Grape wiki revision/history UI (infinite version trap)
-        if parsed.netloc.endswith("grape.ics.uci.edu"):
-            return False
-
-        # block photo gallery directories (many HTML pages, little text)
-        if "/pix/" in parsed.path.lower():
-            return False
-
-        # heuristic to detect repeating directory patterns which often indicate
-        # crawler traps such as calendar or pagination loops.
-        if re.match(r"^.?(/.+?/).?\1.$|^.?/(.+?/)\2.*$", parsedPath):
-            return False
-
-        return not re.match(
-            r".*\.(css|js|bmp|gif|jpe?g|ico"
-            + r"|png|tiff?|mid|mp2|mp3|mp4"
-            + r"|wav|avi|mov|mpeg|ram|m4v|mkv|ogg|ogv|pdf"
-            + r"|ps|eps|tex|ppt|pptx|doc|docx|xls|xlsx|names"
-            + r"|data|dat|exe|bz2|tar|msi|bin|7z|psd|dmg|iso"
-            + r"|epub|dll|cnf|tgz|sha1"
-            + r"|thmx|mso|arff|rtf|jar|csv"
-            + r"|rm|smil|wmv|swf|wma|zip|rar|gz)$", parsed.path.lower())
-
+        return URL_FILTER.is_valid(url)
     except TypeError:
-        print ("TypeError for ", parsed)
+        print ("TypeError for ", url)
         raise
 
 def print_report():
-    with open("report.txt", "w", encoding="utf-8") as f:
-        f.write(f"Total Unique URLs: {len(UNIQUE_URLS)}\n")
-        f.write(f"Longest Page: {LONGEST_PAGE[0]} with {LONGEST_PAGE[1]} words\n")
-        f.write("Subdomain Counts:\n")
-        sorted_subdomains = sorted(SUBDOMAIN_COUNTS.keys())
-        for subdomain in sorted_subdomains:
-            count = SUBDOMAIN_COUNTS[subdomain]
-            f.write(f"{subdomain}: {count} pages\n")
-        f.write("Top 50 Words:\n")
-        for word, freq in sorted(WORD_FREQUENCIES.items(), key=lambda x: x[1], reverse=True)[:50]:
-            f.write(f"{word}: {freq}\n")
+    REPORT.write_report(REPORT_FILE)
@@ -1,35 +1,59 @@
 import os
 import logging
 from hashlib import sha256
+from threading import Lock
 from urllib.parse import urlparse
 
+from utils.canonical import canonicalize
+
+# Directory of the log files. Each shard of a sharded crawl logs to its own.
+LOG_DIR = "Logs"
+
+# Handlers shared by every logger: one file handler per log file and one
+# stream handler, so each record is written once however many times
+# get_logger is called.
+_file_handlers = dict()
+_stream_handler = None
+_handlers_lock = Lock()
+
+def _get_handlers(filename):
+    global _stream_handler
+    formatter = logging.Formatter(
+       "%(asctime)s - %(name)s - %(levelname)s - %(message)s")
+    path = os.path.join(LOG_DIR, f"{filename}.log")
+    fh = _file_handlers.get(path)
+    if fh is None:
+        if not os.path.exists(LOG_DIR):
+            os.makedirs(LOG_DIR)
+        fh = _file_handlers[path] = logging.FileHandler(path)
+        fh.setLevel(logging.DEBUG)
+        fh.setFormatter(formatter)
+    if _stream_handler is None:
+        _stream_handler = logging.StreamHandler()
+        _stream_handler.setLevel(logging.INFO)
+        _stream_handler.setFormatter(formatter)
+    return fh, _stream_handler
+
 def get_logger(name, filename=None):
     logger = logging.getLogger(name)
     logger.setLevel(logging.INFO)
-    if not os.path.exists("Logs"):
-        os.makedirs("Logs")
-    fh = logging.FileHandler(f"Logs/{filename if filename else name}.log")
-    fh.setLevel(logging.DEBUG)
-    ch = logging.StreamHandler()
-    ch.setLevel(logging.INFO)
-    formatter = logging.Formatter(
-       "%(asctime)s - %(name)s - %(levelname)s - %(message)s")
-    fh.setFormatter(formatter)
-    ch.setFormatter(formatter)
-    # add the handlers to the logger
-    logger.addHandler(fh)
-    logger.addHandler(ch)
+    with _handlers_lock:
+        # add the handlers to the logger, once
+        for handler in _get_handlers(filename if filename else name):
+            if handler not in logger.handlers:
+                logger.addHandler(handler)
     return logger
 
 
-def get_urlhash(url):
+def get_urldigest(url):
     parsed = urlparse(url)
     # everything other than scheme.
     return sha256(
         f"{parsed.netloc}/{parsed.path}/{parsed.params}/"
-        f"{parsed.query}/{parsed.fragment}".encode("utf-8")).hexdigest()
+        f"{parsed.query}/{parsed.fragment}".encode("utf-8")).digest()
+
+def get_urlhash(url):
+    return get_urldigest(url).hex()
 
 def normalize(url):
-    if url.endswith("/"):
-        return url.rstrip("/")
-    return url
+    return canonicalize(url)
@@ -0,0 +1,135 @@
+import asyncio
+
+from urllib.parse import urlencode
+
+from utils.download import (
+    to_response, conditional_headers, too_large, failed, PageTooLarge,
+    TIMED_OUT, UNREACHABLE, READ_SIZE)
+
+
+class AsyncDownloader(object):
+    ''' Downloads pages from the cache server on an asyncio event loop.
+
+    Keeps a pool of keep-alive HTTP/1.1 connections to the cache server and
+    allows at most max_in_flight requests outstanding at once. download
+    returns the same Response objects as utils.download.download, including
+    for requests that get no reply within config.timeout seconds. '''
+
+    def __init__(self, config, max_in_flight):
+        self.host, self.port = config.cache_server
+        self.user_agent = config.user_agent
+        self.limit = config.max_page_size
+        self.timeout = config.timeout or None
+        self.slots = asyncio.Semaphore(max_in_flight)
+        self.idle = list()
+
+    async def download(self, url, logger=None, validators=None):
+        async with self.slots:
+            try:
+                status, content = await asyncio.wait_for(
+                    self._get(
+                        urlencode([("q", f"{url}"), ("u", f"{self.user_agent}")]),
+                        conditional_headers(validators)),
+                    self.timeout)
+            except PageTooLarge as e:
+                return too_large(url, self.limit, e.size, logger)
+            except asyncio.TimeoutError:
+                return failed(
+                    url, TIMED_OUT, f"no reply within {self.timeout}s", logger)
+            except (
+                    OSError, asyncio.IncompleteReadError,
+                    asyncio.LimitOverrunError, ValueError) as e:
+                return failed(url, UNREACHABLE, e, logger)
+        return to_response(url, status, content, logger)
+
+    async def close(self):
+        while self.idle:
+            _, writer = self.idle.pop()
+            writer.close()
+
+    async def _get(self, query, headers):
+        extra = "".join(f"{name}: {value}\r\n" for name, value in headers.items())
+        request = (
+            f"GET /?{query} HTTP/1.1\r\n"
+            f"Host: {self.host}:{self.port}\r\n"
+            f"Accept-Encoding: identity\r\n"
+            f"{extra}"
+            f"Connection: keep-alive\r\n\r\n").encode("latin-1")
+        while self.idle:
+            # An idle connection may have been closed by the server, in which
+            # case the request is retried on the next one.
+            reader, writer = self.idle.pop()
+            try:
+                return await self._send(reader, writer, request)
+            except (ConnectionError, asyncio.IncompleteReadError):
+                writer.close()
+            except BaseException:
+                # Timed out or a bad reply: the connection is in an unknown
+                # state.
+                writer.close()
+                raise
+        reader, writer = await asyncio.open_connection(self.host, self.port)
+        try:
+            return await self._send(reader, writer, request)
+        except BaseException:
+            writer.close()
+            raise
+
+    async def _send(self, reader, writer, request):
+        writer.write(request)
+        await writer.drain()
+        status_line = await reader.readuntil(b"\r\n")
+        status = int(status_line.split()[1])
+        headers = dict()
+        while True:
+            line = await reader.readuntil(b"\r\n")
+            if line == b"\r\n":
+                break
+            name, _, value = line.decode("latin-1").partition(":")
+            headers[name.strip().lower()] = value.strip()
+
+        # Replies over the limit are dropped with their connection, without
+        # reading the rest of them.
+        limit = self.limit if self.limit > 0 else None
+        if headers.get("transfer-encoding", "").lower() == "chunked":
+            chunks, total = list(), 0
+            while True:
+                size = int((await reader.readuntil(b"\r\n")).split(b";")[0], 16)
+                if size == 0:
+                    # Skip trailers up to the final empty line.
+                    while await reader.readuntil(b"\r\n") != b"\r\n":
+                        pass
+                    break
+                total += size
+                if limit and total > limit:
+                    writer.close()
+                    raise PageTooLarge()
+                chunks.append(await reader.readexactly(size))
+                await reader.readexactly(2)
+            content = b"".join(chunks)
+        elif "content-length" in headers:
+            length = int(headers["content-length"])
+            if limit and length > limit:
+                writer.close()
+                raise PageTooLarge(length)
+            content = await reader.readexactly(length)
+        else:
+            # Read to the end of the connection.
+            headers["connection"] = "close"
+            chunks, total = list(), 0
+            while True:
+                chunk = await reader.read(READ_SIZE)
+                if not chunk:
+                    break
+                total += len(chunk)
+                if limit and total > limit:
+                    writer.close()
+                    raise PageTooLarge()
+                chunks.append(chunk)
+            content = b"".join(chunks)
+
+        if headers.get("connection", "").lower() == "close":
+            writer.close()
+        else:
+            self.idle.append((reader, writer))
+        return status, content
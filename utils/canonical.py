@@ -0,0 +1,70 @@
+from functools import lru_cache
+from urllib.parse import urlsplit, urlunsplit
+
+DEFAULT_PORTS = {"http": "80", "https": "443"}
+
+# Query keys that only track where a click came from. Keys starting with
+# "utm_" are dropped as well. Compared lowercased.
+TRACKING_PARAMS = frozenset((
+    "fbclid", "gclid", "dclid", "msclkid", "yclid", "igshid", "mc_cid",
+    "mc_eid", "_ga", "_gl", "_hsenc", "_hsmi", "phpsessid", "jsessionid",
+))
+
+
+def remove_dot_segments(path):
+    ''' Resolves "." and ".." segments like RFC 3986 section 5.2.4. '''
+    if "." not in path:
+        return path
+    output = list()
+    for segment in path.split("/"):
+        if segment == "..":
+            # Never pop the empty segment before the leading "/".
+            if len(output) > 1:
+                output.pop()
+        elif segment != ".":
+            output.append(segment)
+    if path.endswith(("/.", "/..")):
+        output.append("")
+    return "/".join(output)
+
+
+def _canonical_netloc(scheme, netloc):
+    userinfo, at, hostport = netloc.rpartition("@")
+    if hostport.startswith("["):
+        # IPv6 literal, the port comes after the closing bracket.
+        end = hostport.find("]") + 1
+        host, port = hostport[:end], hostport[end + 1:]
+    else:
+        host, _, port = hostport.partition(":")
+    host = host.lower().rstrip(".")
+    if port and port != DEFAULT_PORTS.get(scheme):
+        host = f"{host}:{port}"
+    return f"{userinfo}{at}{host}"
+
+
+def _canonical_query(query):
+    pairs = [
+        pair for pair in query.split("&")
+        if pair and not _is_tracking(pair.partition("=")[0].lower())]
+    pairs.sort()
+    return "&".join(pairs)
+
+
+def _is_tracking(key):
+    return key.startswith("utm_") or key in TRACKING_PARAMS
+
+
+@lru_cache(maxsize=1 << 16)
+def canonicalize(url):
+    ''' The canonical form of an absolute url, used everywhere a url is
+    compared or hashed: lowercased scheme and host, no default port, dot
+    segments resolved, no trailing slash, query pairs sorted without
+    tracking parameters, and no fragment.
+
+    Raises ValueError for urls urlsplit cannot parse. '''
+    parsed = urlsplit(url.strip())
+    scheme = parsed.scheme.lower()
+    netloc = _canonical_netloc(scheme, parsed.netloc)
+    path = remove_dot_segments(parsed.path).rstrip("/")
+    query = _canonical_query(parsed.query) if parsed.query else ""
+    return urlunsplit((scheme, netloc, path, query, ""))
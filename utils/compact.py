@@ -0,0 +1,210 @@
+import struct
+
+from threading import Lock
+
+SCORE = struct.Struct(">Q")
+SCORE_SIZE = SCORE.size
+SEQUENCE_SIZE = 6
+SIGN = 1 << 63
+DOUBLE = struct.Struct(">d")
+
+
+def pack_score(score):
+    ''' 8 bytes that sort like score: the IEEE bits, with the sign bit flipped
+    for positive numbers and every bit flipped for negative ones. '''
+    bits = SCORE.unpack(DOUBLE.pack(score))[0]
+    return SCORE.pack(bits ^ (2 * SIGN - 1) if bits & SIGN else bits | SIGN)
+
+
+def unpack_score(data):
+    bits = SCORE.unpack_from(data)[0]
+    return DOUBLE.unpack(
+        SCORE.pack(bits ^ SIGN if bits & SIGN else bits ^ (2 * SIGN - 1)))[0]
+
+
+def _write_varint(value):
+    out = bytearray()
+    while value > 0x7f:
+        out.append(value & 0x7f | 0x80)
+        value >>= 7
+    out.append(value)
+    return bytes(out)
+
+
+def _read_varint(data, offset=0):
+    value = shift = 0
+    while True:
+        byte = data[offset]
+        offset += 1
+        value |= (byte & 0x7f) << shift
+        if byte < 0x80:
+            return value, offset
+        shift += 7
+
+
+def _split(url):
+    ''' Splits url after the scheme, host and first path segment, the part
+    shared by most urls of a site section ("https://host/~user/"). '''
+    start = url.find("://")
+    slash = url.find("/", start + 3) if start >= 0 else -1
+    if slash < 0:
+        return url, ""
+    end = len(url)
+    for separator in "?#":
+        found = url.find(separator, slash)
+        if found >= 0:
+            end = min(end, found)
+    second = url.find("/", slash + 1, end)
+    cut = (second if second >= 0 else slash) + 1
+    return url[:cut], url[cut:]
+
+
+class UrlCodec(object):
+    ''' Compact byte strings for urls.
+
+    The scheme, host and first path segment of a url are interned once, and
+    a url is stored as the varint id of that prefix followed by the utf-8
+    rest. So a queued url costs one bytes object of its path tail instead of
+    a full str, and the host is kept once however many urls it has.
+
+    pack adds a key in front so that entries sort like (score, sequence)
+    tuples, for heaps of queued urls. '''
+
+    def __init__(self):
+        self.lock = Lock()
+        self.prefixes = list()
+        self.prefix_ids = dict()
+
+    def _prefix_id(self, prefix):
+        prefix_id = self.prefix_ids.get(prefix)
+        if prefix_id is None:
+            with self.lock:
+                prefix_id = self.prefix_ids.get(prefix)
+                if prefix_id is None:
+                    prefix_id = len(self.prefixes)
+                    self.prefixes.append(prefix)
+                    self.prefix_ids[prefix] = prefix_id
+        return prefix_id
+
+    def encode(self, url):
+        prefix, rest = _split(url)
+        return _write_varint(self._prefix_id(prefix)) + rest.encode("utf-8")
+
+    def decode(self, data, offset=0):
+        prefix_id, offset = _read_varint(data, offset)
+        return self.prefixes[prefix_id] + bytes(data[offset:]).decode("utf-8")
+
+    def pack(self, score, sequence, url):
+        ''' Heap entry for url. Entries compare like (score, sequence); the
+        score key is entry[:SCORE_SIZE]. '''
+        return (
+            pack_score(score) + sequence.to_bytes(SEQUENCE_SIZE, "big")
+            + self.encode(url))
+
+    def unpack(self, entry):
+        ''' Returns (score, url) of a heap entry. '''
+        return (
+            unpack_score(entry),
+            self.decode(entry, SCORE_SIZE + SEQUENCE_SIZE))
+
+
+class DigestSet(object):
+    ''' Set of fixed width digests (such as 8 or 16 byte blake2b digests) in
+    a single open addressing table. Costs width / load bytes per digest,
+    12 to 24 for 8 byte digests, against about 90 for a set of bytes.
+
+    The digests are expected to be uniformly distributed: their first bytes
+    are used as the hash. The all-zero digest marks an empty slot, so it is
+    kept in a flag instead. Not thread safe. '''
+
+    MAX_LOAD = 2 / 3
+
+    def __init__(self, width=8, capacity=1024):
+        self.width = width
+        self.empty = bytes(width)
+        self.has_empty = False
+        self.count = 0
+        self._allocate(max(16, 1 << (int(capacity / self.MAX_LOAD) - 1).bit_length()))
+
+    def _allocate(self, slots):
+        self.slots = slots
+        self.mask = slots - 1
+        self.table = bytearray(slots * self.width)
+
+    def _find(self, digest):
+        ''' Offset of digest's slot, or of the empty slot it would go in. '''
+        width, table, mask = self.width, self.table, self.mask
+        i = int.from_bytes(digest[:8], "little") & mask
+        while True:
+            offset = i * width
+            slot = table[offset:offset + width]
+            if slot == digest or slot == self.empty:
+                return offset
+            i = (i + 1) & mask
+
+    def __contains__(self, digest):
+        if digest == self.empty:
+            return self.has_empty
+        offset = self._find(digest)
+        return self.table[offset:offset + self.width] == digest
+
+    def add(self, digest):
+        ''' Adds digest. Returns False if it was in the set already. '''
+        if len(digest) != self.width:
+            raise ValueError(f"Digest of {len(digest)} bytes, expected {self.width}.")
+        if digest == self.empty:
+            added, self.has_empty = not self.has_empty, True
+            return added
+        offset = self._find(digest)
+        if self.table[offset:offset + self.width] == digest:
+            return False
+        self.table[offset:offset + self.width] = digest
+        self.count += 1
+        if self.count > self.slots * self.MAX_LOAD:
+            self._grow()
+        return True
+
+    def _grow(self):
+        old = self.table
+        self._allocate(self.slots * 2)
+        width = self.width
+        for offset in range(0, len(old), width):
+            digest = bytes(old[offset:offset + width])
+            if digest != self.empty:
+                new = self._find(digest)
+                self.table[new:new + width] = digest
+
+    def update(self, digests):
+        for digest in digests:
+            self.add(digest)
+
+    def __len__(self):
+        return self.count + self.has_empty
+
+    def __iter__(self):
+        width, table = self.width, self.table
+        if self.has_empty:
+            yield self.empty
+        for offset in range(0, len(table), width):
+            digest = bytes(table[offset:offset + width])
+            if digest != self.empty:
+                yield digest
+
+    def to_bytes(self):
+        ''' The digests concatenated, for saving. '''
+        return b"".join(self)
+
+    def copy(self):
+        other = DigestSet.__new__(DigestSet)
+        other.width, other.empty = self.width, self.empty
+        other.has_empty, other.count = self.has_empty, self.count
+        other.slots, other.mask = self.slots, self.mask
+        other.table = bytearray(self.table)
+        return other
+
+    @classmethod
+    def from_bytes(cls, data, width=8):
+        digests = cls(width, len(data) // width)
+        for offset in range(0, len(data), width):
+            digests.add(data[offset:offset + width])
+        return digests
@@ -8,12 +8,60 @@ class Config(object):
         assert self.user_agent != "DEFAULT AGENT", "Set useragent in config.ini"
         assert re.match(r"^[a-zA-Z0-9_ ,]+$", self.user_agent), "User agent should not have any special characters outside '_', ',' and 'space'"
         self.threads_count = int(config["LOCAL PROPERTIES"]["THREADCOUNT"])
+        self.fetch_mode = config.get("LOCAL PROPERTIES", "FETCHMODE", fallback="threads")
+        self.async_requests = config.getint("LOCAL PROPERTIES", "ASYNCREQUESTS", fallback=200)
+        self.extractor = config.get("LOCAL PROPERTIES", "EXTRACTOR", fallback="soup")
+        self.parser_processes = config.getint("LOCAL PROPERTIES", "PARSERPROCESSES", fallback=0)
+        self.parser_backlog = config.getint("LOCAL PROPERTIES", "PARSERBACKLOG", fallback=64)
         self.save_file = config["LOCAL PROPERTIES"]["SAVE"]
+        self.storage = config.get("LOCAL PROPERTIES", "STORAGE", fallback="shelve")
+        self.bloom_capacity = config.getint("LOCAL PROPERTIES", "BLOOMCAPACITY", fallback=10000000)
+        self.bloom_error_rate = config.getfloat("LOCAL PROPERTIES", "BLOOMERRORRATE", fallback=0.001)
+        self.report_interval = config.getfloat("LOCAL PROPERTIES", "REPORTINTERVAL", fallback=60)
+        self.save_batch = config.getint("LOCAL PROPERTIES", "SAVEBATCH", fallback=1000)
+        self.save_interval = config.getfloat("LOCAL PROPERTIES", "SAVEINTERVAL", fallback=5)
+        self.snapshot_interval = config.getfloat("LOCAL PROPERTIES", "SNAPSHOTINTERVAL", fallback=300)
+        self.metrics = config.getboolean("LOCAL PROPERTIES", "METRICS", fallback=True)
+        self.metrics_port = config.getint("LOCAL PROPERTIES", "METRICSPORT", fallback=0)
+        self.metrics_interval = config.getfloat("LOCAL PROPERTIES", "METRICSINTERVAL", fallback=60)
+        self.shards = config.getint("LOCAL PROPERTIES", "SHARDS", fallback=1)
+        self.spool_batch = config.getint("LOCAL PROPERTIES", "SPOOLBATCH", fallback=500)
+        self.spool_interval = config.getfloat("LOCAL PROPERTIES", "SPOOLINTERVAL", fallback=1)
+        self.link_graph = config.getboolean("LOCAL PROPERTIES", "LINKGRAPH", fallback=False)
+        self.link_graph_chunk = config.getint("LOCAL PROPERTIES", "LINKGRAPHCHUNK", fallback=1048576)
+        self.archive = config.getboolean("LOCAL PROPERTIES", "ARCHIVE", fallback=False)
+        self.archive_dir = config.get("LOCAL PROPERTIES", "ARCHIVEDIR", fallback="archive")
+        self.archive_segment = config.getint("LOCAL PROPERTIES", "ARCHIVESEGMENT", fallback=1073741824)
+        self.archive_compression = config.get("LOCAL PROPERTIES", "ARCHIVECOMPRESSION", fallback="gzip")
 
         self.host = config["CONNECTION"]["HOST"]
         self.port = int(config["CONNECTION"]["PORT"])
 
         self.seed_urls = config["CRAWLER"]["SEEDURL"].split(",")
         self.time_delay = float(config["CRAWLER"]["POLITENESS"])
+        self.robots = config.getboolean("CRAWLER", "ROBOTS", fallback=True)
+        self.robots_ttl = config.getfloat("CRAWLER", "ROBOTSTTL", fallback=86400)
+        self.robots_cache_size = config.getint("CRAWLER", "ROBOTSCACHE", fallback=4096)
+        self.simhash_distance = config.getint("CRAWLER", "SIMHASHDISTANCE", fallback=3)
+        self.traps = config.getboolean("CRAWLER", "TRAPS", fallback=True)
+        self.trap_min_pages = config.getint("CRAWLER", "TRAPMINPAGES", fallback=20)
+        self.trap_throttle_rate = config.getfloat("CRAWLER", "TRAPTHROTTLERATE", fallback=0.5)
+        self.trap_drop_rate = config.getfloat("CRAWLER", "TRAPDROPRATE", fallback=0.8)
+        self.trap_sample = config.getint("CRAWLER", "TRAPSAMPLE", fallback=10)
+        self.scorer = config.get("CRAWLER", "SCORER", fallback="depth")
+        self.max_page_size = config.getint("CRAWLER", "MAXPAGESIZE", fallback=10485760)
+        self.timeout = config.getfloat("CRAWLER", "TIMEOUT", fallback=30)
+        self.max_retries = config.getint("CRAWLER", "MAXRETRIES", fallback=3)
+        self.retry_backoff = config.getfloat("CRAWLER", "RETRYBACKOFF", fallback=5)
+        self.breaker_window = config.getint("CRAWLER", "BREAKERWINDOW", fallback=20)
+        self.breaker_error_rate = config.getfloat("CRAWLER", "BREAKERERRORRATE", fallback=0.5)
+        self.breaker_cooldown = config.getfloat("CRAWLER", "BREAKERCOOLDOWN", fallback=300)
 
-        self.cache_server = None
\ No newline at end of file
+        self.cache_server = None
+        # Set by launch.py --recrawl.
+        self.recrawl = False
+        # Set by crawler.archive.configure_replay for launch.py --replay.
+        self.replay = False
+        # Set by crawler.shards.configure_shard in the process of one shard.
+        self.shard = None
+        self.spool_dir = None
\ No newline at end of file
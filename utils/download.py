@@ -1,21 +1,131 @@
-import requests
-import cbor
 import time
 
+from hashlib import blake2b
+from threading import local
+
 from utils.response import Response
 
-def download(url, config, logger=None):
-    host, port = config.cache_server
-    resp = requests.get(
-        f"http://{host}:{port}/",
-        params=[("q", f"{url}"), ("u", f"{config.user_agent}")])
+# requests and cbor are imported on first use, so that starting the crawler
+# (or a tool that imports it) does not pay for them up front.
+
+# Bytes read from the cache server at a time when MAXPAGESIZE is set.
+READ_SIZE = 1 << 16
+
+# One keep-alive session per thread, so every download from a worker reuses
+# its connection to the cache server.
+_sessions = local()
+
+def _get_session():
+    session = getattr(_sessions, "session", None)
+    if session is None:
+        import requests
+        session = _sessions.session = requests.Session()
+    return session
+
+def to_response(url, status_code, content, logger=None):
+    ''' Builds a Response from the raw reply of the cache server. '''
     try:
-        if resp and resp.content:
-            return Response(cbor.loads(resp.content))
+        if status_code < 400 and content:
+            import cbor
+            return Response(cbor.loads(content))
     except (EOFError, ValueError) as e:
         pass
-    logger.error(f"Spacetime Response error {resp} with url {url}.")
+    error = f"Spacetime Response error <Response [{status_code}]> with url {url}."
+    if logger:
+        logger.error(error)
+    return Response({
+        "error": error,
+        "status": status_code,
+        "url": url})
+
+# Status of the Response for a page that was dropped for being larger than
+# MAXPAGESIZE.
+TOO_LARGE = 413
+
+class PageTooLarge(Exception):
+    def __init__(self, size=None):
+        super().__init__(size)
+        self.size = size # None if it was not known before reading the reply
+
+def too_large(url, limit, size=None, logger=None):
+    ''' Builds the Response for a page whose reply from the cache server is
+    larger than limit bytes, which is dropped without reading or unpickling
+    the rest of it. '''
+    size = f"{size} bytes" if size else f"more than {limit} bytes"
+    error = f"Reply of {size} for {url} is over MAXPAGESIZE, dropped."
+    if logger:
+        logger.info(error)
     return Response({
-        "error": f"Spacetime Response error {resp} with url {url}.",
-        "status": resp.status_code,
+        "error": error,
+        "status": TOO_LARGE,
         "url": url})
+
+# Statuses of the Response for a download that got no reply from the cache
+# server: none came within TIMEOUT seconds, or the server could not be
+# reached or dropped the connection.
+TIMED_OUT = 504
+UNREACHABLE = 502
+
+def failed(url, status, reason, logger=None):
+    ''' Builds the Response for a download that got no reply. '''
+    error = f"Could not download {url}: {reason}."
+    if logger:
+        logger.info(error)
+    return Response({
+        "error": error,
+        "status": status,
+        "url": url})
+
+def conditional_headers(validators):
+    ''' Request headers that ask for the page only if it changed since it
+    was downloaded with validators (etag, last modified, content hash). '''
+    headers = dict()
+    if validators:
+        etag, last_modified, _ = validators
+        if etag:
+            headers["If-None-Match"] = etag
+        if last_modified:
+            headers["If-Modified-Since"] = last_modified
+    return headers
+
+def page_validators(raw_response):
+    ''' The validators of a downloaded page, for conditional_headers on its
+    next download: (etag, last modified, content hash). '''
+    headers = raw_response.headers
+    return (
+        headers.get("etag"), headers.get("last-modified"),
+        blake2b(raw_response.content, digest_size=16).digest())
+
+def download(url, config, logger=None, validators=None):
+    import requests
+    try:
+        return _download(url, config, logger, validators)
+    except requests.Timeout:
+        return failed(
+            url, TIMED_OUT, f"no reply within {config.timeout}s", logger)
+    except requests.RequestException as e:
+        return failed(url, UNREACHABLE, e, logger)
+
+def _download(url, config, logger, validators):
+    host, port = config.cache_server
+    limit = config.max_page_size
+    resp = _get_session().get(
+        f"http://{host}:{port}/",
+        params=[("q", f"{url}"), ("u", f"{config.user_agent}")],
+        headers=conditional_headers(validators), stream=limit > 0,
+        timeout=config.timeout or None)
+    if limit <= 0:
+        return to_response(url, resp.status_code, resp.content, logger)
+    # Read the reply in blocks and give up as soon as it is too large,
+    # without holding more than limit bytes of it.
+    with resp:
+        length = int(resp.headers.get("content-length") or 0)
+        if length > limit:
+            return too_large(url, limit, length, logger)
+        chunks, size = list(), 0
+        for chunk in resp.iter_content(READ_SIZE):
+            size += len(chunk)
+            if size > limit:
+                return too_large(url, limit, logger=logger)
+            chunks.append(chunk)
+    return to_response(url, resp.status_code, b"".join(chunks), logger)
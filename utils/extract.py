@@ -0,0 +1,204 @@
+import re
+import codecs
+
+from html.parser import HTMLParser
+
+# lxml's etree and the errors its parser raises, set by _load_lxml when the
+# first page is parsed. etree stays None if lxml is not installed.
+etree = None
+PARSE_ERRORS = ()
+_lxml_loaded = False
+
+
+def _load_lxml():
+    global etree, PARSE_ERRORS, _lxml_loaded
+    if not _lxml_loaded:
+        try:
+            from lxml import etree
+            PARSE_ERRORS = (etree.LxmlError,)
+        except ImportError:
+            pass
+        _lxml_loaded = True
+    return etree
+
+# Tokens are runs of word characters made only of ascii letters, the same
+# as re.findall(r'\b[a-zA-Z]{2,}\b', text.lower()) over the whole text.
+TOKEN = re.compile(r"\b[a-z]{2,}\b")
+TRAILING_WORD = re.compile(r"\w+$")
+
+SKIPPED_TAGS = {"script", "style"}
+
+# charset parameter of a Content-Type header, and a charset declared in the
+# head of a page (<meta charset> or <meta http-equiv content>).
+CHARSET = re.compile(r"""charset\s*=\s*["']?([\w.:-]+)""", re.I)
+META_CHARSET = re.compile(rb"""<meta[^>]+charset\s*=\s*["']?([\w.:-]+)""", re.I)
+# Bytes at the start of a page searched for a <meta> charset.
+SNIFF_SIZE = 1024
+
+# Bytes of html fed to the parser at a time by iter_text.
+BLOCK_SIZE = 1 << 16
+# Characters of text tokenized at a time by iter_tokens.
+TEXT_BLOCK_SIZE = 1 << 13
+
+
+def iter_tokens(chunks, block_size=TEXT_BLOCK_SIZE):
+    ''' Yields the tokens of the concatenation of chunks without building
+    the full text. Chunks are joined into blocks of about block_size
+    characters, and a word split across two blocks is carried over. '''
+    carry = ""
+    block, size = list(), 0
+    for chunk in chunks:
+        block.append(chunk)
+        size += len(chunk)
+        if size < block_size:
+            continue
+        text = carry + "".join(block).lower()
+        block, size = list(), 0
+        match = TRAILING_WORD.search(text)
+        if match:
+            carry = text[match.start():]
+            text = text[:match.start()]
+        else:
+            carry = ""
+        yield from TOKEN.findall(text)
+    text = carry + "".join(block).lower()
+    if text:
+        yield from TOKEN.findall(text)
+
+
+class PageHandler(object):
+    ''' Parser target that collects anchor hrefs and the visible text of a
+    page in a single pass, without building a tree. Text inside script and
+    style elements is skipped, like decomposing them before get_text(). '''
+
+    def __init__(self):
+        self.hrefs = list()
+        self.chunks = list()
+        self.skipping = 0
+
+    def start(self, tag, attrib):
+        tag = tag.lower()
+        if tag in SKIPPED_TAGS:
+            self.skipping += 1
+        elif tag == "a":
+            href = attrib.get("href")
+            if href is not None:
+                self.hrefs.append(href)
+
+    def end(self, tag):
+        if tag.lower() in SKIPPED_TAGS and self.skipping:
+            self.skipping -= 1
+
+    def data(self, text):
+        if not self.skipping:
+            self.chunks.append(text)
+
+    def comment(self, text):
+        pass
+
+    def close(self):
+        return self
+
+
+def _known(encoding):
+    try:
+        codecs.lookup(encoding)
+        return True
+    except LookupError:
+        return False
+
+
+def get_encoding(content, content_type=None):
+    ''' The encoding of the html page in content (bytes): the charset of its
+    Content-Type header, else a byte order mark or a <meta> charset in its
+    first SNIFF_SIZE bytes, else utf-8 if it decodes as utf-8, else
+    windows-1252. The same order of guesses BeautifulSoup makes, with the
+    header first. '''
+    match = CHARSET.search(content_type or "")
+    if match and _known(match.group(1)):
+        return match.group(1)
+    for bom, encoding in (
+            (codecs.BOM_UTF8, "utf-8"), (codecs.BOM_UTF16_LE, "utf-16"),
+            (codecs.BOM_UTF16_BE, "utf-16")):
+        if content.startswith(bom):
+            return encoding
+    match = META_CHARSET.search(content[:SNIFF_SIZE])
+    if match and _known(match.group(1).decode("ascii")):
+        return match.group(1).decode("ascii")
+    try:
+        content.decode("utf-8")
+        return "utf-8"
+    except UnicodeDecodeError:
+        return "windows-1252"
+
+
+class _StdlibAdapter(HTMLParser):
+    ''' Feeds html.parser events into a PageHandler when lxml is missing.
+    Takes bytes like lxml's parser, decoded with encoding. '''
+
+    def __init__(self, handler, encoding="utf-8"):
+        super().__init__(convert_charrefs=True)
+        self.handler = handler
+        self.decoder = codecs.getincrementaldecoder(encoding)(errors="replace")
+
+    def feed(self, data):
+        super().feed(self.decoder.decode(data))
+
+    def close(self):
+        super().feed(self.decoder.decode(b"", final=True))
+        super().close()
+
+    def handle_starttag(self, tag, attrs):
+        attrib = dict()
+        for name, value in attrs:
+            attrib.setdefault(name, value if value is not None else "")
+        self.handler.start(tag, attrib)
+
+    def handle_startendtag(self, tag, attrs):
+        self.handle_starttag(tag, attrs)
+        self.handler.end(tag)
+
+    def handle_endtag(self, tag):
+        self.handler.end(tag)
+
+    def handle_data(self, data):
+        self.handler.data(data)
+
+
+def iter_text(content, handler, content_type=None, block_size=BLOCK_SIZE):
+    ''' Parses the html page in content (bytes) into handler block_size
+    bytes at a time, and yields the text chunks of each block once it is
+    parsed, so the text of the page is never held all at once. The hrefs in
+    handler are complete once the generator is exhausted. content_type is
+    the page's Content-Type header, see get_encoding. Uses lxml's
+    event-driven parser if available. '''
+    encoding = get_encoding(content, content_type)
+    if _load_lxml() is not None:
+        try:
+            parser = etree.HTMLParser(target=handler, encoding=encoding)
+        except LookupError:
+            # A codec Python has and libxml2 does not.
+            content = content.decode(encoding, errors="replace").encode("utf-8")
+            parser = etree.HTMLParser(target=handler, encoding="utf-8")
+    else:
+        parser = _StdlibAdapter(handler, encoding)
+    view = memoryview(content)
+    try:
+        for start in range(0, len(content), block_size):
+            parser.feed(bytes(view[start:start + block_size]))
+            yield from handler.chunks
+            handler.chunks.clear()
+        parser.close()
+    except PARSE_ERRORS:
+        # Keep whatever was parsed before the error, like the soup path.
+        pass
+    yield from handler.chunks
+    handler.chunks.clear()
+
+
+def extract(content, content_type=None):
+    ''' Returns a PageHandler holding the hrefs and text chunks of the html
+    page in content (bytes). '''
+    handler = PageHandler()
+    handler.chunks = list(iter_text(content, handler, content_type))
+    return handler
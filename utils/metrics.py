@@ -0,0 +1,279 @@
+import time
+
+from bisect import bisect_left
+from threading import Lock, Thread, Event
+
+# Upper bounds in seconds of the stage histogram buckets, from 100us to 1min.
+BUCKETS = (
+    0.0001, 0.00025, 0.0005, 0.001, 0.0025, 0.005, 0.01, 0.025, 0.05,
+    0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0, 30.0, 60.0)
+
+
+class Histogram(object):
+    ''' Counts of observed durations in fixed buckets, plus their sum. An
+    observation is a bisect and three additions under a lock. '''
+
+    def __init__(self):
+        self.lock = Lock()
+        # counts[i] counts values <= BUCKETS[i] and > BUCKETS[i - 1]; the last
+        # slot counts values above every bound.
+        self.counts = [0] * (len(BUCKETS) + 1)
+        self.total = 0.0
+        self.count = 0
+
+    def observe(self, value):
+        i = bisect_left(BUCKETS, value)
+        with self.lock:
+            self.counts[i] += 1
+            self.total += value
+            self.count += 1
+
+    def snapshot(self):
+        with self.lock:
+            return list(self.counts), self.total, self.count
+
+
+def quantile(counts, q):
+    ''' Estimates the q quantile from non-cumulative bucket counts, by linear
+    interpolation inside the bucket it falls in. '''
+    total = sum(counts)
+    if not total:
+        return 0.0
+    rank = q * total
+    seen = 0
+    for i, count in enumerate(counts):
+        if count and seen + count >= rank:
+            if i == len(BUCKETS):
+                return BUCKETS[-1]
+            low = BUCKETS[i - 1] if i else 0.0
+            return low + (BUCKETS[i] - low) * (rank - seen) / count
+        seen += count
+    return BUCKETS[-1]
+
+
+class Timer(object):
+    ''' Context manager that observes the time spent in its block. '''
+
+    def __init__(self, metrics, stage):
+        self.metrics = metrics
+        self.stage = stage
+
+    def __enter__(self):
+        self.start = time.perf_counter()
+        return self
+
+    def __exit__(self, *exc_info):
+        self.metrics.observe(self.stage, time.perf_counter() - self.start)
+        return False
+
+
+def _escape(value):
+    return (
+        str(value).replace("\\", "\\\\").replace('"', '\\"')
+        .replace("\n", "\\n"))
+
+
+class Metrics(object):
+    ''' Crawl telemetry shared by all workers.
+
+    stages:   stage name -> Histogram of seconds spent in it (download,
+              parse, is_valid, add_url, ...).
+    counters: name -> {label value -> count}, e.g. fetches per host.
+    gauges:   name -> (help, label name, function returning {label value ->
+              value} or a number), read only when the metrics are exported,
+              so queue depths cost nothing on the hot path.
+
+    The metrics are served as Prometheus text on http://127.0.0.1:port/metrics
+    by serve, and summarized in a log line every interval seconds by
+    start_summaries. '''
+
+    PREFIX = "crawler"
+
+    COUNTERS = {
+        "fetches": ("Pages downloaded per host.", "host"),
+        "responses": ("Downloads per status code.", "status"),
+        "forwarded": ("Urls forwarded to the shard that owns them.", "shard"),
+        "retries": ("Failed downloads queued again per host.", "host"),
+        "breaker_trips": ("Circuit breaker trips per host.", "host"),
+    }
+
+    def __init__(self):
+        self.lock = Lock()
+        self.enabled = True
+        self.started = time.monotonic()
+        self.stages = dict()
+        self.counters = dict()
+        self.gauges = dict()
+        self.server = None
+        self.stopped = Event()
+        # Counter and histogram values at the last summary, to report rates
+        # and quantiles over the interval.
+        self.last_summary = (self.started, dict(), dict())
+
+    def time(self, stage):
+        return Timer(self, stage)
+
+    def observe(self, stage, seconds):
+        if not self.enabled:
+            return
+        histogram = self.stages.get(stage)
+        if histogram is None:
+            with self.lock:
+                histogram = self.stages.setdefault(stage, Histogram())
+        histogram.observe(seconds)
+
+    def count(self, name, label="", amount=1):
+        if not self.enabled:
+            return
+        with self.lock:
+            counter = self.counters.get(name)
+            if counter is None:
+                counter = self.counters[name] = dict()
+            counter[label] = counter.get(label, 0) + amount
+
+    def gauge(self, name, help, function, label=None):
+        ''' Registers function as the source of gauge name, replacing an
+        earlier one of the same name. '''
+        with self.lock:
+            self.gauges[name] = (help, label, function)
+
+    def _snapshot(self):
+        with self.lock:
+            stages = list(self.stages.items())
+            counters = {
+                name: dict(values) for name, values in self.counters.items()}
+            gauges = list(self.gauges.items())
+        stages = {name: histogram.snapshot() for name, histogram in stages}
+        gauge_values = dict()
+        for name, (help, label, function) in gauges:
+            try:
+                values = function()
+            except Exception:
+                continue
+            if not isinstance(values, dict):
+                values = {"": values}
+            gauge_values[name] = (help, label, values)
+        return stages, counters, gauge_values
+
+    def render(self):
+        ''' All metrics in the Prometheus text exposition format. '''
+        stages, counters, gauges = self._snapshot()
+        prefix = self.PREFIX
+        lines = [
+            f"# HELP {prefix}_stage_seconds Time spent in each stage of the crawl.",
+            f"# TYPE {prefix}_stage_seconds histogram"]
+        for stage, (counts, total, count) in sorted(stages.items()):
+            stage = _escape(stage)
+            cumulative = 0
+            for bound, bucket_count in zip(BUCKETS, counts):
+                cumulative += bucket_count
+                lines.append(
+                    f'{prefix}_stage_seconds_bucket{{stage="{stage}",'
+                    f'le="{bound}"}} {cumulative}')
+            lines.append(
+                f'{prefix}_stage_seconds_bucket{{stage="{stage}",le="+Inf"}} {count}')
+            lines.append(f'{prefix}_stage_seconds_sum{{stage="{stage}"}} {total}')
+            lines.append(f'{prefix}_stage_seconds_count{{stage="{stage}"}} {count}')
+        for name, values in sorted(counters.items()):
+            help, label = self.COUNTERS.get(name, (name, "label"))
+            lines.append(f"# HELP {prefix}_{name}_total {help}")
+            lines.append(f"# TYPE {prefix}_{name}_total counter")
+            for value, count in sorted(values.items(), key=lambda x: str(x[0])):
+                lines.append(
+                    f'{prefix}_{name}_total{{{label}="{_escape(value)}"}} {count}')
+        for name, (help, label, values) in sorted(gauges.items()):
+            lines.append(f"# HELP {prefix}_{name} {help}")
+            lines.append(f"# TYPE {prefix}_{name} gauge")
+            for value, amount in sorted(values.items(), key=lambda x: str(x[0])):
+                labels = f'{{{label}="{_escape(value)}"}}' if label else ""
+                lines.append(f"{prefix}_{name}{labels} {amount}")
+        lines.append(f"# HELP {prefix}_uptime_seconds Seconds since the crawl started.")
+        lines.append(f"# TYPE {prefix}_uptime_seconds gauge")
+        lines.append(f"{prefix}_uptime_seconds {time.monotonic() - self.started}")
+        return "\n".join(lines) + "\n"
+
+    def summary(self, top_hosts=5):
+        ''' One line with the rates and stage quantiles since the previous
+        summary, the gauges, and the busiest hosts. '''
+        stages, counters, gauges = self._snapshot()
+        now = time.monotonic()
+        last_time, last_stages, last_counters = self.last_summary
+        self.last_summary = (now, stages, counters)
+        elapsed = max(now - last_time, 1e-9)
+
+        def delta(name):
+            last = last_counters.get(name, dict())
+            return {
+                label: count - last.get(label, 0)
+                for label, count in counters.get(name, dict()).items()}
+
+        fetches = delta("fetches")
+        parts = [f"{sum(fetches.values()) / elapsed:.1f} pages/s"]
+        for stage, (counts, total, count) in sorted(stages.items()):
+            last_counts, last_total, last_count = last_stages.get(
+                stage, ([0] * len(counts), 0.0, 0))
+            count -= last_count
+            if not count:
+                continue
+            counts = [a - b for a, b in zip(counts, last_counts)]
+            parts.append(
+                f"{stage} {count}x p50 {quantile(counts, 0.5) * 1000:.1f}ms "
+                f"p99 {quantile(counts, 0.99) * 1000:.1f}ms "
+                f"total {total - last_total:.1f}s")
+        for name, (_, label, values) in sorted(gauges.items()):
+            if not label:
+                parts.append(f"{name} {values['']}")
+        busiest = sorted(fetches.items(), key=lambda x: x[1], reverse=True)
+        if busiest[:top_hosts]:
+            parts.append("top hosts " + ", ".join(
+                f"{host} {count / elapsed:.2f}/s"
+                for host, count in busiest[:top_hosts] if count))
+        return "; ".join(parts)
+
+    def serve(self, port, host="127.0.0.1"):
+        ''' Serves render() on http://host:port/metrics from a daemon
+        thread. '''
+        # Only imported when the metrics are served.
+        from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+        metrics = self
+
+        class MetricsHandler(BaseHTTPRequestHandler):
+            def do_GET(self):
+                if self.path.split("?")[0] not in ("/", "/metrics"):
+                    self.send_error(404)
+                    return
+                body = metrics.render().encode("utf-8")
+                self.send_response(200)
+                self.send_header(
+                    "Content-Type", "text/plain; version=0.0.4; charset=utf-8")
+                self.send_header("Content-Length", str(len(body)))
+                self.end_headers()
+                self.wfile.write(body)
+
+            def log_message(self, format, *args):
+                pass
+
+        self.server = ThreadingHTTPServer((host, port), MetricsHandler)
+        self.server.daemon_threads = True
+        Thread(target=self.server.serve_forever, daemon=True).start()
+        return self.server.server_address
+
+    def start_summaries(self, interval, logger):
+        ''' Logs summary() every interval seconds until stop. '''
+        def log_periodically():
+            while not self.stopped.wait(interval):
+                logger.info(f"Metrics: {self.summary()}")
+        self.stopped.clear()
+        self.last_summary = (time.monotonic(), dict(), dict())
+        Thread(target=log_periodically, daemon=True).start()
+
+    def stop(self):
+        self.stopped.set()
+        if self.server:
+            self.server.shutdown()
+            self.server.server_close()
+            self.server = None
+
+
+# Global metrics, safe to update from any thread.
+METRICS = Metrics()
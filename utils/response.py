@@ -1,14 +1,28 @@
 import pickle
 
 class Response(object):
+    __slots__ = ("url", "status", "error", "_pickled", "_raw_response")
+
     def __init__(self, resp_dict):
         self.url = resp_dict["url"]
         self.status = resp_dict["status"]
         self.error = resp_dict["error"] if "error" in resp_dict else None
-        try:
-            self.raw_response = (
-                pickle.loads(resp_dict["response"])
-                if "response" in resp_dict else
-                None)
-        except TypeError:
-            self.raw_response = None
+        # The pickled requests.Response, only unpickled when raw_response is
+        # first used, so rejected pages are never unpickled.
+        self._pickled = resp_dict["response"] if "response" in resp_dict else None
+        self._raw_response = None
+
+    @property
+    def raw_response(self):
+        if self._pickled is not None:
+            try:
+                self._raw_response = pickle.loads(self._pickled)
+            except TypeError:
+                self._raw_response = None
+            self._pickled = None
+        return self._raw_response
+
+    @raw_response.setter
+    def raw_response(self, raw_response):
+        self._pickled = None
+        self._raw_response = raw_response
@@ -0,0 +1,103 @@
+import time
+
+from collections import OrderedDict
+from threading import Lock, Event
+from urllib.parse import urlparse
+
+from utils.download import download
+
+
+class RobotsCache(object):
+    ''' Parsed robots.txt rules per host, fetched through the cache server.
+
+    Keeps at most max_hosts hosts in LRU order, and refetches a host's rules
+    once they are older than ttl seconds. Concurrent requests for a host
+    whose rules are missing share a single fetch. '''
+
+    def __init__(self, config, logger, max_hosts, ttl):
+        self.config = config
+        self.logger = logger
+        self.max_hosts = max_hosts
+        self.ttl = ttl
+        self.lock = Lock()
+        self.rules = OrderedDict() # host -> (RobotFileParser, expiry time)
+        self.fetching = dict() # host -> Event set once its fetch is done
+
+    def allowed(self, url, fetch=True):
+        ''' Whether robots.txt allows fetching url. If fetch is False and the
+        host's rules are not cached, returns None instead of fetching. '''
+        parsed = urlparse(url)
+        host = parsed.netloc.lower()
+        rules = self._cached(host)
+        if rules is None:
+            if not fetch:
+                return None
+            rules = self.fetch(parsed.scheme, host)
+        return rules.can_fetch(self.config.user_agent, url)
+
+    def crawl_delay(self, host):
+        ''' Crawl-delay for host from its cached rules, or None. '''
+        rules = self._cached(host)
+        if rules is None:
+            return None
+        return rules.crawl_delay(self.config.user_agent)
+
+    def _cached(self, host):
+        with self.lock:
+            entry = self.rules.get(host)
+            if entry is None or entry[1] < time.monotonic():
+                return None
+            self.rules.move_to_end(host)
+            return entry[0]
+
+    def fetch(self, scheme, host):
+        ''' Fetches and caches the rules for host, or waits for a fetch of
+        the same host already in progress. '''
+        with self.lock:
+            done = self.fetching.get(host)
+            owner = done is None
+            if owner:
+                done = self.fetching[host] = Event()
+        if not owner:
+            done.wait()
+            rules = self._cached(host)
+            return rules if rules is not None else self.fetch(scheme, host)
+
+        try:
+            rules, ttl = self._download(scheme, host)
+            with self.lock:
+                self.rules[host] = (rules, time.monotonic() + ttl)
+                self.rules.move_to_end(host)
+                while len(self.rules) > self.max_hosts:
+                    self.rules.popitem(last=False)
+            return rules
+        finally:
+            with self.lock:
+                del self.fetching[host]
+            done.set()
+
+    def _download(self, scheme, host):
+        # Imported on the first fetch, it pulls in urllib.request.
+        from urllib.robotparser import RobotFileParser
+        rules = RobotFileParser(f"{scheme}://{host}/robots.txt")
+        try:
+            resp = download(rules.url, self.config, self.logger)
+        except Exception as e:
+            self.logger.info(f"Could not fetch {rules.url}: {e}.")
+            rules.allow_all = True
+            return rules, min(self.ttl, 3600)
+        if resp.status == 200 and resp.raw_response is not None:
+            content = resp.raw_response.content or b""
+            rules.parse(content.decode("utf-8", errors="ignore").splitlines())
+            return rules, self.ttl
+        if resp.status in (401, 403):
+            rules.disallow_all = True
+            return rules, self.ttl
+        rules.allow_all = True
+        if 400 <= resp.status < 500:
+            # No robots.txt, nothing is disallowed.
+            return rules, self.ttl
+        # Server or cache error: allow for now, but try again soon.
+        self.logger.info(
+            f"Could not fetch {rules.url}, status <{resp.status}>.")
+        return rules, min(self.ttl, 3600)
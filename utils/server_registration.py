@@ -1,8 +1,7 @@
 import os
-from spacetime import Node
-from utils.pcc_models import Register
 
 def init(df, user_agent, fresh):
+    from utils.pcc_models import Register
     reg = df.read_one(Register, user_agent)
     if not reg:
         reg = Register(user_agent, fresh)
@@ -20,6 +19,9 @@ def init(df, user_agent, fresh):
     return reg.load_balancer
 
 def get_cache_server(config, restart):
+    # spacetime is only needed to register, not imported with this module.
+    from spacetime import Node
+    from utils.pcc_models import Register
     init_node = Node(
         init, Types=[Register], dataframe=(config.host, config.port))
     return init_node.start(
@@ -0,0 +1,143 @@
+import os
+import struct
+
+from functools import lru_cache
+from hashlib import blake2b
+from threading import Lock
+
+from utils.compact import DigestSet
+
+
+@lru_cache(maxsize=1 << 16)
+def _token_hash(token):
+    return int.from_bytes(
+        blake2b(token.encode("utf-8"), digest_size=8).digest(), "little")
+
+
+def checksum(word_frequencies):
+    ''' Exact fingerprint of a page's token counts. '''
+    digest = blake2b(digest_size=16)
+    for word, freq in sorted(word_frequencies.items()):
+        digest.update(f"{word}:{freq} ".encode("utf-8"))
+    return digest.digest()
+
+
+def simhash(word_frequencies):
+    ''' 64 bit SimHash of a page, weighting each token by its frequency. '''
+    weights = [0] * 64
+    for word, freq in word_frequencies.items():
+        h = _token_hash(word)
+        for bit in range(64):
+            if h >> bit & 1:
+                weights[bit] += freq
+            else:
+                weights[bit] -= freq
+    fingerprint = 0
+    for bit, weight in enumerate(weights):
+        if weight > 0:
+            fingerprint |= 1 << bit
+    return fingerprint
+
+
+class SimHashIndex(object):
+    ''' Finds stored fingerprints within max_distance bits of a query.
+
+    The 64 bits are cut into max_distance + 1 blocks, and every fingerprint
+    is filed under each of its blocks. Two fingerprints that differ in at
+    most max_distance bits agree exactly on at least one block, so only the
+    fingerprints sharing a block with the query are compared. '''
+
+    def __init__(self, max_distance):
+        self.max_distance = max_distance
+        blocks = max_distance + 1
+        bounds = [64 * i // blocks for i in range(blocks + 1)]
+        self.blocks = [
+            (start, (1 << (end - start)) - 1)
+            for start, end in zip(bounds, bounds[1:])]
+        self.tables = [dict() for _ in self.blocks]
+
+    def _keys(self, fingerprint):
+        return [fingerprint >> start & mask for start, mask in self.blocks]
+
+    def find(self, fingerprint):
+        ''' Returns a stored fingerprint close to fingerprint, or None. '''
+        for table, key in zip(self.tables, self._keys(fingerprint)):
+            for candidate in table.get(key, ()):
+                if bin(candidate ^ fingerprint).count("1") <= self.max_distance:
+                    return candidate
+        return None
+
+    def add(self, fingerprint):
+        for table, key in zip(self.tables, self._keys(fingerprint)):
+            table.setdefault(key, list()).append(fingerprint)
+
+
+class DuplicateDetector(object):
+    ''' Remembers the pages seen so far and reports exact and near
+    duplicates. Safe to use from several threads.
+
+    After start_checkpoints, the checksum and SimHash of each page passed
+    to completed are appended to a journal file by checkpoint, as ROW, and
+    load restores them. A page must only be passed to completed once its
+    completion is saved: a page whose fingerprints were checkpointed but
+    which is downloaded again after a resume would be a duplicate of
+    itself. '''
+
+    ROW = struct.Struct("<16sQ")
+
+    def __init__(self, max_distance):
+        self.lock = Lock()
+        # 16 byte checksums of the pages seen.
+        self.checksums = DigestSet(16)
+        self.index = SimHashIndex(max_distance) if max_distance >= 0 else None
+        self.exact = self.near = 0
+        self.journal_file = None
+        self.rows = list() # of completed pages, not checkpointed yet
+
+    def is_duplicate(self, page_checksum, page_simhash):
+        ''' Records a page and returns whether it duplicates an earlier one. '''
+        with self.lock:
+            if not self.checksums.add(page_checksum):
+                self.exact += 1
+                return True
+            if self.index is None:
+                return False
+            if self.index.find(page_simhash) is not None:
+                self.near += 1
+                return True
+            self.index.add(page_simhash)
+            return False
+
+    def start_checkpoints(self, path):
+        self.journal_file = path
+
+    def completed(self, page_checksum, page_simhash):
+        ''' Queues the fingerprints of a page that is not a duplicate and is
+        saved as complete for the next checkpoint. '''
+        if self.journal_file is None:
+            return
+        with self.lock:
+            self.rows.append(self.ROW.pack(page_checksum, page_simhash))
+
+    def checkpoint(self):
+        ''' Appends the fingerprints queued by completed to the journal. '''
+        with self.lock:
+            rows, self.rows = self.rows, list()
+        if rows:
+            with open(self.journal_file, "ab") as journal:
+                journal.write(b"".join(rows))
+
+    def load(self, path):
+        ''' Restores the pages checkpointed to path, filed under this
+        detector's max_distance. Returns False if path does not exist. '''
+        if not os.path.exists(path):
+            return False
+        with open(path, "rb") as journal:
+            data = journal.read()
+        # A partial row at the end was being written when the crawl stopped.
+        data = data[:len(data) - len(data) % self.ROW.size]
+        with self.lock:
+            for page_checksum, page_simhash in self.ROW.iter_unpack(data):
+                if self.checksums.add(page_checksum) and self.index is not None:
+                    self.index.add(page_simhash)
+        return True
@@ -0,0 +1,271 @@
+import os
+import heapq
+import pickle
+import struct
+import zlib
+
+from hashlib import blake2b
+
+from threading import Lock, Thread, Event
+
+from utils.metrics import METRICS
+from utils.compact import DigestSet
+
+
+class CrawlStats(object):
+    ''' Report statistics shared by all workers.
+
+    Every update happens under one lock, once per page. The top words are
+    kept up to date incrementally: word counts only grow, so a word can only
+    enter the top K when its own count passes the smallest count in the top
+    K. The report is written from a snapshot on a timer or at shutdown
+    instead of after every page.
+
+    Unique pages are kept as 8 byte digests of their url in a DigestSet,
+    about 16 bytes per page. The statistics can
+    be checkpointed to a compact file with save and restored with load, so
+    the report of a resumed crawl covers the pages crawled before it.
+
+    After start_checkpoints, each checkpoint only appends the pages counted
+    since the last one to {path}.journal, each as a length prefixed,
+    compressed pickle of (url, subdomain, word_frequencies) made by
+    record_page outside the lock. Once the journal outgrows
+    the last save, it is folded into path by a save on a background thread,
+    which moves it to {path}.journal.old while it works. load replays the
+    journals over path; pages already counted are skipped, so replaying a
+    journal that a save already covered changes nothing. '''
+
+    VERSION = 1
+    RECORD = struct.Struct("<I")
+    # Journal size below which it is never compacted.
+    MIN_COMPACT_SIZE = 8 * 2 ** 20
+
+    def __init__(self, top_k=50):
+        self.lock = Lock()
+        self.top_k = top_k
+        self.unique_urls = DigestSet(8)
+        self.subdomain_counts = dict() # dictionary of (subdomain: page count)
+        self.word_frequencies = dict() # dictionary of (word: frequency)
+        self.longest_page = ("", 0) # tuple of (url, word count)
+        # top_words holds the current top K words. top_heap is a min-heap of
+        # (count, word) over them that may also hold stale entries, which
+        # are dropped lazily when they reach the top of the heap.
+        self.top_words = dict()
+        self.top_heap = list()
+        self.stopped = Event()
+        self.checkpoint_path = None
+        self.changes = list() # pages counted since the last checkpoint
+        self.journal_lock = Lock()
+        self.save_lock = Lock()
+        self.compacting = False
+        self.saved_size = 0
+
+    def record_page(self, url, subdomain, word_frequencies):
+        ''' Counts a crawled page. word_frequencies is None for pages with too
+        little text to be counted in the word statistics. '''
+        url_digest = blake2b(url.encode("utf-8"), digest_size=8).digest()
+        record = None
+        if self.checkpoint_path is not None:
+            record = zlib.compress(pickle.dumps(
+                (url, subdomain, word_frequencies),
+                protocol=pickle.HIGHEST_PROTOCOL), 1)
+        with self.lock:
+            if (self._count(url_digest, url, subdomain, word_frequencies)
+                    and record is not None):
+                self.changes.append(self.RECORD.pack(len(record)) + record)
+
+    def _count(self, url_digest, url, subdomain, word_frequencies):
+        # Called with the lock held. Returns False if url was counted.
+        if not self.unique_urls.add(url_digest):
+            # Counted already: fetched again after a resume, or changed
+            # since the last crawl and fetched again by a recrawl.
+            return False
+        self.subdomain_counts[subdomain] = (
+            self.subdomain_counts.get(subdomain, 0) + 1)
+        if word_frequencies is not None:
+            for word, freq in word_frequencies.items():
+                count = self.word_frequencies.get(word, 0) + freq
+                self.word_frequencies[word] = count
+                self._update_top(word, count)
+            word_count = sum(word_frequencies.values())
+            if word_count > self.longest_page[1]:
+                self.longest_page = (url, word_count)
+        return True
+
+    def _update_top(self, word, count):
+        top_words, top_heap = self.top_words, self.top_heap
+        if word not in top_words:
+            if len(top_words) >= self.top_k:
+                self._drop_stale()
+                if count <= top_heap[0][0]:
+                    return
+                _, evicted = heapq.heappop(top_heap)
+                del top_words[evicted]
+        top_words[word] = count
+        heapq.heappush(top_heap, (count, word))
+        if len(top_heap) > 4 * self.top_k:
+            self.top_heap = [(c, w) for w, c in top_words.items()]
+            heapq.heapify(self.top_heap)
+
+    def _drop_stale(self):
+        top_words, top_heap = self.top_words, self.top_heap
+        while top_words.get(top_heap[0][1]) != top_heap[0][0]:
+            heapq.heappop(top_heap)
+
+    def snapshot(self):
+        with self.lock:
+            return (
+                len(self.unique_urls), self.longest_page,
+                sorted(self.subdomain_counts.items()),
+                sorted(self.top_words.items(), key=lambda x: x[1], reverse=True))
+
+    def write_report(self, path):
+        unique_count, longest_page, subdomains, top_words = self.snapshot()
+        tmp_path = f"{path}.tmp"
+        with open(tmp_path, "w", encoding="utf-8") as f:
+            f.write(f"Total Unique URLs: {unique_count}\n")
+            f.write(f"Longest Page: {longest_page[0]} with {longest_page[1]} words\n")
+            f.write("Subdomain Counts:\n")
+            for subdomain, count in subdomains:
+                f.write(f"{subdomain}: {count} pages\n")
+            f.write(f"Top {self.top_k} Words:\n")
+            for word, freq in top_words:
+                f.write(f"{word}: {freq}\n")
+        os.replace(tmp_path, path)
+
+    @staticmethod
+    def remove(path):
+        for file_path in (path, f"{path}.journal", f"{path}.journal.old"):
+            if os.path.exists(file_path):
+                os.remove(file_path)
+
+    def start_checkpoints(self, path):
+        ''' Keeps the pages counted from now on for checkpoint, which
+        journals them next to path. '''
+        self.checkpoint_path = path
+
+    def checkpoint(self):
+        ''' Appends the pages counted since the last checkpoint, already
+        serialized, to the journal. '''
+        with self.lock:
+            changes, self.changes = self.changes, list()
+        if not changes:
+            return
+        with self.journal_lock:
+            with open(f"{self.checkpoint_path}.journal", "ab") as journal:
+                journal.write(b"".join(changes))
+                size = journal.tell()
+            if (size < max(self.MIN_COMPACT_SIZE, self.saved_size)
+                    or self.compacting):
+                return
+            self.compacting = True
+        Thread(
+            target=self.save, args=(self.checkpoint_path,), daemon=True).start()
+
+    def save(self, path):
+        ''' Writes all the statistics to path atomically, and removes the
+        journal records they include. The counters are copied under the
+        lock, and serialized outside it. '''
+        journal = f"{path}.journal"
+        with self.save_lock:
+            with self.journal_lock:
+                with self.lock:
+                    unique_urls = self.unique_urls.copy()
+                    state = {
+                        "version": self.VERSION,
+                        "subdomain_counts": dict(self.subdomain_counts),
+                        "word_frequencies": dict(self.word_frequencies),
+                        "longest_page": self.longest_page,
+                    }
+                # Records appended from here on are not included. If an old
+                # journal is left by a crash, the journal is not moved and
+                # stays to be replayed, which is harmless.
+                old = f"{journal}.old"
+                if os.path.exists(journal) and not os.path.exists(old):
+                    os.replace(journal, old)
+            state["unique_urls"] = unique_urls.to_bytes()
+            data = zlib.compress(
+                pickle.dumps(state, protocol=pickle.HIGHEST_PROTOCOL))
+            tmp_path = f"{path}.tmp"
+            with open(tmp_path, "wb") as stats_file:
+                stats_file.write(data)
+            os.replace(tmp_path, path)
+            if os.path.exists(old):
+                os.remove(old)
+            with self.journal_lock:
+                self.saved_size = len(data)
+                self.compacting = False
+
+    def load(self, path):
+        ''' Restores statistics saved by save and checkpoint. Returns False if
+        none were. '''
+        found = False
+        if os.path.exists(path):
+            found = True
+            with open(path, "rb") as stats_file:
+                data = stats_file.read()
+            state = pickle.loads(zlib.decompress(data))
+            unique_urls = state["unique_urls"]
+            with self.lock:
+                self.unique_urls = DigestSet.from_bytes(unique_urls, 8)
+                self.subdomain_counts = state["subdomain_counts"]
+                self.word_frequencies = state["word_frequencies"]
+                self.longest_page = state["longest_page"]
+                self.top_words = dict(heapq.nlargest(
+                    self.top_k, self.word_frequencies.items(), key=lambda x: x[1]))
+                self.top_heap = [(c, w) for w, c in self.top_words.items()]
+                heapq.heapify(self.top_heap)
+            self.saved_size = len(data)
+        for journal in (f"{path}.journal.old", f"{path}.journal"):
+            if os.path.exists(journal):
+                found = True
+                self._replay(journal)
+        return found
+
+    def _replay(self, journal):
+        with open(journal, "rb") as journal_file:
+            data = journal_file.read()
+        offset = 0
+        while offset + self.RECORD.size <= len(data):
+            size, = self.RECORD.unpack_from(data, offset)
+            offset += self.RECORD.size
+            if offset + size > len(data):
+                # Being written when the crawl stopped.
+                break
+            url, subdomain, word_frequencies = pickle.loads(
+                zlib.decompress(data[offset:offset + size]))
+            offset += size
+            url_digest = blake2b(url.encode("utf-8"), digest_size=8).digest()
+            with self.lock:
+                self._count(url_digest, url, subdomain, word_frequencies)
+
+    def merge(self, path):
+        ''' Adds statistics saved by save, e.g. by another shard of the
+        crawl, to these. Returns False if there are none. '''
+        other = CrawlStats(self.top_k)
+        if not other.load(path):
+            return False
+        with self.lock:
+            self.unique_urls.update(other.unique_urls)
+            for subdomain, count in other.subdomain_counts.items():
+                self.subdomain_counts[subdomain] = (
+                    self.subdomain_counts.get(subdomain, 0) + count)
+            for word, freq in other.word_frequencies.items():
+                count = self.word_frequencies.get(word, 0) + freq
+                self.word_frequencies[word] = count
+                self._update_top(word, count)
+            if other.longest_page[1] > self.longest_page[1]:
+                self.longest_page = other.longest_page
+        return True
+
+    def start_snapshots(self, path, interval):
+        ''' Writes the report to path every interval seconds until stop. '''
+        def write_periodically():
+            while not self.stopped.wait(interval):
+                with METRICS.time("report"):
+                    self.write_report(path)
+        self.stopped.clear()
+        Thread(target=write_periodically, daemon=True).start()
+
+    def stop(self):
+        self.stopped.set()
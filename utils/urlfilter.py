@@ -0,0 +1,160 @@
+import re
+
+from collections import Counter
+from urllib.parse import urlsplit, unquote
+
+
+class DomainTrie(object):
+    ''' Suffix trie over domain labels. Maps a host to the value of the most
+    specific domain it ends with.
+
+    Like str.endswith, the leftmost label of a domain also matches the end
+    of a longer label, so "cs.uci.edu" matches "eecs.uci.edu". '''
+
+    def __init__(self):
+        self.root = dict()
+
+    def add(self, domain, value):
+        node = self.root
+        for label in reversed(domain.lower().split(".")):
+            node = node.setdefault(label, dict())
+        node[None] = value
+
+    def match(self, host):
+        node, value = self.root, None
+        for label in reversed(host.split(".")):
+            child = node.get(label)
+            if child is None:
+                # The host can still end with a domain whose leftmost label
+                # is a suffix of this label; take the longest one.
+                partial = [
+                    key for key, child in node.items()
+                    if key and None in child and label.endswith(key)]
+                if partial:
+                    value = node[max(partial, key=len)][None]
+                break
+            node = child
+            value = node.get(None, value)
+        return value
+
+
+def has_repeated_directory(path):
+    ''' Same result as
+        re.match(r"^.?(/.+?/).?\\1.$|^.?/(.+?/)\\2.*$", path)
+    without the backtracking: a directory sequence repeated right at the
+    start of the path, or a path made of the same directory sequence twice
+    with at most one character around it. '''
+    size = len(path)
+    # ^.?(/.+?/).?\1.$
+    for start in (0, 1):
+        for gap in (0, 1):
+            rest = size - 1 - start - gap
+            if rest >= 6 and rest % 2 == 0:
+                half = rest // 2
+                group = path[start:start + half]
+                if (group[0] == "/" and group[-1] == "/"
+                        and path.startswith(group, start + half + gap)):
+                    return True
+    # ^.?/(.+?/)\2.*$
+    for start in (0, 1):
+        if path[start:start + 1] != "/":
+            continue
+        end = path.find("/", start + 2)
+        while end != -1:
+            group = path[start + 1:end + 1]
+            if path.startswith(group, end + 1):
+                return True
+            end = path.find("/", end + 1)
+    return False
+
+
+class UrlFilter(object):
+    ''' Decides whether a url should be crawled, with every rule compiled
+    once up front.
+
+    Rules are checked cheapest first and the first rule that rejects a url
+    is counted in hits, so the counters show which rules do the work. '''
+
+    SCHEMES = frozenset(("http", "https"))
+
+    def __init__(self, allowed_domains, blocked_domains, blocked_query_keys,
+                 path_patterns, blocked_extensions, max_query_length,
+                 max_path_depth):
+        self.domains = DomainTrie()
+        for domain in allowed_domains:
+            self.domains.add(domain, True)
+        for domain in blocked_domains:
+            self.domains.add(domain, False)
+        # query key -> name of the rule that blocks it
+        self.blocked_query_keys = dict(blocked_query_keys)
+        # One alternation of named groups; the group that matched names the
+        # rule.
+        self.path_pattern = re.compile("|".join(
+            f"(?P<{name}>{pattern})" for name, pattern in path_patterns.items()))
+        self.blocked_extensions = frozenset(blocked_extensions)
+        self.max_query_length = max_query_length
+        self.max_path_depth = max_path_depth
+        self.hits = Counter()
+
+    def check(self, url):
+        ''' Returns None if url should be crawled, otherwise the name of the
+        first rule that rejects it. '''
+        parsed = urlsplit(url)
+        if parsed.scheme not in self.SCHEMES:
+            return "scheme"
+        host = parsed.netloc.split(":")[0].lower()
+        allowed = self.domains.match(host)
+        if allowed is None:
+            return "domain"
+        if not allowed:
+            return "blocked_domain"
+
+        query = parsed.query
+        if len(query) > self.max_query_length:
+            return "query_length"
+        if query:
+            rule = self._check_query(query)
+            if rule:
+                return rule
+
+        path = parsed.path
+        if ";" in path:
+            # urlparse would move ;params of the last segment out of the path.
+            semicolon = path.find(";", max(path.rfind("/"), 0))
+            if semicolon != -1:
+                path = path[:semicolon]
+        path = path.lower()
+        depth = path.count("/")
+        if depth > self.max_path_depth:
+            return "path_depth"
+        dot = path.rfind(".")
+        if dot != -1 and path[dot + 1:] in self.blocked_extensions:
+            return "extension"
+        match = self.path_pattern.search(path)
+        if match:
+            return match.lastgroup
+        if depth >= 3 and has_repeated_directory(path):
+            return "repeated_directory"
+        return None
+
+    def _check_query(self, query):
+        # Same keys as parse_qs(query): pairs without "=" or with an empty
+        # value are ignored, and keys are unquoted.
+        blocked = self.blocked_query_keys
+        for pair in query.split("&"):
+            key, sep, value = pair.partition("=")
+            if not value:
+                continue
+            if "%" in key or "+" in key:
+                key = unquote(key.replace("+", " "))
+            rule = blocked.get(key)
+            if rule:
+                return rule
+        return None
+
+    def is_valid(self, url):
+        rule = self.check(url)
+        if rule is None:
+            return True
+        self.hits[rule] += 1
+        return False